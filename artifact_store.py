@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import datetime as dt
+from contextlib import contextmanager
+
+import numpy as np
+
+from instrumentation import span
+
+# The version of the artifact layout. Artifacts written by another version are not loaded.
+STORE_VERSION = 1
+
+
+class StaleArtifactError(Exception):
+    """
+    Raised when an artifact does not exist, is written by another store version or
+    is created from source files that have changed since.
+    """
+
+
+def file_fingerprint(path):
+    """
+    Returns the size and modification time of the file, which is checked before hashing the whole file.
+    """
+    stat = os.stat (path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Returns the sha256 hash of the file by reading it in blocks of 'block_size' bytes.
+    """
+    sha = hashlib.sha256 ()
+    with open (path, 'rb') as f:
+        for block in iter (lambda: f.read (block_size), b""):
+            sha.update (block)
+    return sha.hexdigest ()
+
+
+class ArtifactStore:
+    """
+    Creates the ArtifactStore class which keeps the artifacts as directories of '.npy' files under 'root'.
+    Every array can be memory-mapped, so loading an artifact does not read or copy the arrays and
+    processes that load the same artifact share the pages.
+    The manifest keeps the store version and the hashes of the source files of every artifact.
+    Every save writes the arrays to a new version directory of the artifact and the manifest, which points to
+    the versions, is replaced atomically. The files of a version are never written again, so the processes which
+    memory-map them keep working while the store is rebuilt or refreshed, and they load the new versions after
+    'reload'. The newest 'keep_versions' versions of every artifact are kept, older versions are removed.
+    If 'save_manifest' parameter is False, the manifest is not written when an artifact is saved, so processes
+    can save artifacts to the same store and one process records them with 'add_artifacts'.
+    """
+
+    def __init__(self, root="artifacts", sources=(), save_manifest=True, keep_versions=2):
+        self.root = root
+        self.sources = list (sources)
+        self.save_manifest = save_manifest
+        self.keep_versions = keep_versions
+        self.manifest_path = os.path.join (root, "manifest.json")
+        self.manifest = self._read_manifest ()
+        self._hashes = {}
+
+    def _read_manifest(self):
+        if os.path.exists (self.manifest_path):
+            with open (self.manifest_path, 'r') as f:
+                return json.load (f)
+        return {"version": STORE_VERSION, "artifacts": {}}
+
+    def _write_manifest(self):
+        os.makedirs (self.root, exist_ok=True)
+        temp_path = "{}.{}.tmp".format (self.manifest_path, os.getpid ())
+        with open (temp_path, 'w') as f:
+            json.dump (self.manifest, f, indent=2)
+        os.replace (temp_path, self.manifest_path)
+        self._remove_old_versions ()
+
+    def _remove_old_versions(self):
+        # Removing the files does not break the memory maps of the processes which still use an old version.
+        for name, entry in self.manifest["artifacts"].items ():
+            directory = os.path.join (self.root, name)
+            if "version" not in entry or not os.path.isdir (directory):
+                continue
+            versions = sorted (version for version in os.listdir (directory)
+                               if os.path.isdir (os.path.join (directory, version)))
+            for version in versions[:-self.keep_versions]:
+                if version != entry["version"]:
+                    shutil.rmtree (os.path.join (directory, version), ignore_errors=True)
+
+    def reload(self):
+        """
+        Reads the manifest again, so the artifacts published by other processes since are loaded.
+        """
+        self.manifest = self._read_manifest ()
+
+    @contextmanager
+    def publish(self):
+        """
+        Writes the manifest once for all artifacts saved in the block, so the readers load either all old
+        or all new artifacts. The manifest is not written if the block raises an exception.
+        """
+        save_manifest, self.save_manifest = self.save_manifest, False
+        try:
+            yield self
+        finally:
+            self.save_manifest = save_manifest
+        if save_manifest:
+            self._write_manifest ()
+
+    def source_hashes(self):
+        """
+        Returns the fingerprints and sha256 hashes of the existing source files of the store by their paths.
+        Source files are hashed again only if their size or modification time has changed.
+        """
+        hashes = {}
+        for path in self.sources:
+            if not os.path.exists (path):
+                continue
+            fingerprint = file_fingerprint (path)
+            if path not in self._hashes or self._hashes[path]["fingerprint"] != fingerprint:
+                self._hashes[path] = {"fingerprint": fingerprint, "sha256": file_hash (path)}
+            hashes[path] = dict (self._hashes[path])
+        return hashes
+
+    def _array_path(self, name, key, version=None):
+        # Artifacts saved before the version directories keep their arrays in the directory of the artifact.
+        if version is None:
+            version = self.manifest["artifacts"].get (name, {}).get ("version")
+        if version is None:
+            return os.path.join (self.root, name, key + ".npy")
+        return os.path.join (self.root, name, version, key + ".npy")
+
+    def check(self, name):
+        """
+        Raises StaleArtifactError if the artifact can not be used. Source files are hashed only if
+        their size or modification time has changed. Source files that do not exist are not checked.
+        """
+        if self.manifest.get ("version") != STORE_VERSION:
+            raise StaleArtifactError ("Artifact store version is {}, expected {}.".format (
+                self.manifest.get ("version"), STORE_VERSION))
+
+        if name not in self.manifest["artifacts"]:
+            raise StaleArtifactError ("Artifact '{}' is not found in {}.".format (name, self.root))
+
+        for path, source in self.manifest["artifacts"][name]["sources"].items ():
+            if not os.path.exists (path) or file_fingerprint (path) == source["fingerprint"]:
+                continue
+            if file_hash (path) != source["sha256"]:
+                raise StaleArtifactError ("Artifact '{}' is created from an older version of {}.".format (name, path))
+
+    def save_arrays(self, name, arrays, kind="arrays", meta=None):
+        """
+        Saves the arrays as '.npy' files of a new version and records the artifact in the manifest.
+        Object arrays are saved as fixed-width string arrays, so they can be memory-mapped as well.
+        """
+        # Version names are ordered by their creation time.
+        version = "{:020d}-{}".format (time.time_ns (), os.getpid ())
+        os.makedirs (os.path.join (self.root, name, version))
+        with span ("artifact_save." + name):
+            for key, array in arrays.items ():
+                array = np.asarray (array)
+                if array.dtype == object:
+                    array = array.astype (str)
+                np.save (self._array_path (name, key, version), array, allow_pickle=False)
+
+        self.manifest["version"] = STORE_VERSION
+        self.manifest["artifacts"][name] = {"kind": kind,
+                                            "version": version,
+                                            "arrays": list (arrays),
+                                            "meta": meta or {},
+                                            "sources": self.source_hashes (),
+                                            "created": dt.datetime.now ().isoformat ()}
+        if self.save_manifest:
+            self._write_manifest ()
+
+    def add_artifacts(self, artifacts):
+        """
+        Records the manifest entries of the artifacts saved by other stores with the hashes of the source files
+        of this store and writes the manifest.
+        """
+        sources = self.source_hashes ()
+        for name, entry in artifacts.items ():
+            self.manifest["artifacts"][name] = dict (entry, sources=sources)
+        self.manifest["version"] = STORE_VERSION
+        self._write_manifest ()
+
+    def load_arrays(self, name, mmap=True, check_sources=True):
+        """
+        Loads the arrays of the artifact. If 'mmap' parameter is True, the arrays are memory-mapped read-only.
+        """
+        with span ("artifact_load." + name):
+            if check_sources:
+                self.check (name)
+
+            mmap_mode = "r" if mmap else None
+            return {key: np.load (self._array_path (name, key), mmap_mode=mmap_mode, allow_pickle=False)
+                    for key in self.manifest["artifacts"][name]["arrays"]}
+
+    def save(self, name, artifact):
+        """
+        Saves the artifact which keeps its data in 'arrays' attribute.
+        """
+        self.save_arrays (name, artifact.arrays, kind=type (artifact).__name__)
+
+    def load(self, name, cls, mmap=True, check_sources=True):
+        """
+        Loads the artifact by creating 'cls' from its arrays with 'from_arrays' method.
+        """
+        return cls.from_arrays (self.load_arrays (name, mmap, check_sources))
+
+    def save_dataframe(self, name, dataframe):
+        """
+        Saves the dataframe column by column. Categorical columns are saved as codes and categories,
+        datetime columns are saved as int64 nanoseconds with their time zones. Object columns are saved as strings
+        with a mask of their missing values, so the missing values are not loaded as 'None' or 'nan' strings.
+        """
+        # Pandas is imported only for dataframes, so the artifacts of the serving core are loaded without it.
+        import pandas as pd
+
+        arrays, columns = {}, []
+        for i, col in enumerate (dataframe.columns):
+            series = dataframe[col]
+            key = "col{}".format (i)
+            column = {"name": col, "key": key}
+            if pd.api.types.is_categorical_dtype (series):
+                arrays[key + "_codes"] = series.cat.codes.values
+                arrays[key + "_categories"] = series.cat.categories.values.astype (str)
+                column.update (type="category", ordered=bool (series.cat.ordered))
+            elif pd.api.types.is_datetime64_any_dtype (series):
+                tz = series.dt.tz
+                values = series.dt.tz_convert (None) if tz is not None else series
+                arrays[key] = values.values.astype ("datetime64[ns]").view (np.int64)
+                column.update (type="datetime", tz=str (tz) if tz is not None else None)
+            elif series.dtype == object:
+                nulls = series.isnull ().values
+                arrays[key] = series.where (~nulls, "").values
+                arrays[key + "_nulls"] = nulls
+                column.update (type="objects")
+            else:
+                arrays[key] = series.values
+                column.update (type="values")
+            columns.append (column)
+
+        self.save_arrays (name, arrays, kind="DataFrame", meta={"columns": columns})
+
+    def load_dataframe(self, name, mmap=True, check_sources=True):
+        """
+        Loads the dataframe saved by 'save_dataframe' method.
+        """
+        import pandas as pd
+
+        arrays = self.load_arrays (name, mmap, check_sources)
+        data = {}
+        for column in self.manifest["artifacts"][name]["meta"]["columns"]:
+            key = column["key"]
+            if column["type"] == "category":
+                data[column["name"]] = pd.Categorical.from_codes (arrays[key + "_codes"], arrays[key + "_categories"],
+                                                                  ordered=column["ordered"])
+            elif column["type"] == "datetime":
+                values = pd.to_datetime (arrays[key].view ("datetime64[ns]"))
+                data[column["name"]] = values.tz_localize ("UTC").tz_convert (column["tz"]) if column["tz"] else values
+            elif column["type"] == "objects":
+                values = arrays[key].astype (object)
+                values[arrays[key + "_nulls"]] = None
+                data[column["name"]] = values
+            else:
+                data[column["name"]] = arrays[key]
+
+        return pd.DataFrame (data)
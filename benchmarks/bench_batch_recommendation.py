@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+import random
+
+sys.path.insert (0, os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
+
+from funcs import data_preparation, create_sparse_session_product_matrix, create_rules, RuleIndex, \
+    create_item_similarity_table, create_recommendation_index, create_session_neighborhood, recommend_batch
+from synthetic_data import create_synthetic_row_dataframe
+
+
+def create_carts(products, n_carts, max_cart_size=4, seed=42):
+    """
+    Returns a dictionary of session ids and random carts of given products.
+    """
+    rng = random.Random (seed)
+    return {"session_{}".format (i): rng.sample (products, rng.randint (1, max_cart_size)) for i in range (n_carts)}
+
+
+def main(n_events=200000, cart_counts=(10000, 100000), n_jobs=os.cpu_count ()):
+    df_prep = data_preparation (create_synthetic_row_dataframe (n_events=n_events))
+    rules = RuleIndex.from_rules (create_rules (create_sparse_session_product_matrix (df_prep)))
+    similarity_table = create_item_similarity_table (create_sparse_session_product_matrix (df_prep, binary=False))
+    rec_index = create_recommendation_index (df_prep, rules, similarity_table)
+    session_neighborhood = create_session_neighborhood (df_prep)
+    products = rec_index.products.tolist ()
+
+    print ("{:>10} {:>8} {:>12} {:>14}".format ("CARTS", "JOBS", "TIME (s)", "CARTS / SEC"))
+    for n_carts in cart_counts:
+        carts = create_carts (products, n_carts)
+        for jobs in sorted ({1, n_jobs}):
+            start = time.perf_counter ()
+            recommendations = recommend_batch (carts, rec_index, session_neighborhood, rules, n_jobs=jobs)
+            elapsed = time.perf_counter () - start
+            assert len (recommendations) == n_carts and all (len (recs) == 10 for recs in recommendations.values ())
+            print ("{:>10} {:>8} {:>12.2f} {:>14.0f}".format (n_carts, jobs, elapsed, n_carts / elapsed))
+
+
+if __name__ == '__main__':
+    main ()
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert (0, os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
+
+from funcs import data_preparation, missing_col_ratio
+from synthetic_data import create_synthetic_row_dataframe
+
+
+def data_preparation_legacy(dataframe):
+    """
+    The previous version of 'data_preparation' function, which is kept for comparison.
+    """
+    dataframe.columns = [col.upper () for col in dataframe.columns]
+
+    df_prep = dataframe.copy ()
+    one_class_feature = [col for col in df_prep.columns if df_prep[col].nunique () == 1]
+    df_prep.drop (one_class_feature, axis=1, inplace=True)
+
+    na_cols_high_rated, missing_df = missing_col_ratio (df_prep)
+
+    for col in na_cols_high_rated:
+        if pd.api.types.is_categorical_dtype (df_prep[col]) and "None" not in df_prep[col].cat.categories:
+            df_prep[col] = df_prep[col].cat.add_categories ("None")
+        df_prep[col].fillna ("None", inplace=True)
+
+    df_prep.dropna (axis=0, inplace=True)
+
+    df_prep["NEW_EVENTTIME"] = pd.to_datetime (df_prep["EVENTTIME"].dt.strftime ('%Y-%m-%d'))
+    df_prep["NEW_EVENTHOURS"] = df_prep["EVENTTIME"].dt.hour
+    df_prep["NEW_WEEKDAY"] = df_prep["NEW_EVENTTIME"].dt.weekday
+    day_map = {0: "MONDAY",
+               1: "TUESDAY",
+               2: "WEDNESDAY",
+               3: "THURSDAY",
+               4: "FRIDAY",
+               5: "SATURDAY",
+               6: "SUNDAY"}
+
+    df_prep["NEW_WEEKDAY"] = df_prep["NEW_WEEKDAY"].map (day_map)
+
+    df_prep["NEW_EVENTHOURS_RANGE"] = pd.cut (df_prep["NEW_EVENTHOURS"],
+                                              bins=[df_prep["NEW_EVENTHOURS"].min () - 1, 3, 7, 11, 15, 19,
+                                                    df_prep["NEW_EVENTHOURS"].max ()],
+                                              labels=["0_3", "4_7", "8_11", "12_15", "16_19", "20_23"])
+
+    df_prep["NEW_DAY_TIME"] = ["_".join (row) for row in df_prep[["NEW_WEEKDAY", "NEW_EVENTHOURS_RANGE"]].values]
+
+    return df_prep
+
+
+def best_time(function, dataframe, repeat=3):
+    """
+    Returns the best wall time of 'repeat' runs of the function and the result of the last run.
+    """
+    times = []
+    for _ in range (repeat):
+        data = dataframe.copy ()
+        start = time.perf_counter ()
+        result = function (data)
+        times.append (time.perf_counter () - start)
+    return min (times), result
+
+
+def main(sizes=(10000, 100000, 1000000), chunk_size=250000):
+    print ("{:>10} {:>12} {:>12} {:>12} {:>9}".format ("EVENTS", "LEGACY (s)", "CURRENT (s)", "CHUNKED (s)", "SPEEDUP"))
+    for size in sizes:
+        dataframe = create_synthetic_row_dataframe (n_events=size, n_products=max (size // 50, 100))
+
+        legacy_time, legacy_result = best_time (data_preparation_legacy, dataframe)
+        current_time, current_result = best_time (data_preparation, dataframe)
+        chunked_time, chunked_result = best_time (
+            lambda data: data_preparation (data.iloc[i:i + chunk_size] for i in range (0, len (data), chunk_size)),
+            dataframe)
+
+        # Both versions must prepare the same data.
+        assert (legacy_result.astype (str).values == current_result.astype (str).values).all ()
+        assert (legacy_result.astype (str).values == chunked_result.astype (str).values).all ()
+
+        print ("{:>10} {:>12.3f} {:>12.3f} {:>12.3f} {:>8.1f}x".format (size, legacy_time, current_time, chunked_time,
+                                                                       legacy_time / current_time))
+
+
+if __name__ == '__main__':
+    main ()
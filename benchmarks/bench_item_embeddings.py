@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert (0, os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
+
+from funcs import data_preparation, create_sparse_session_product_matrix, create_item_similarity_table, \
+    create_item_embedding_index
+from synthetic_data import create_synthetic_row_dataframe
+
+
+def create_queries(user_pro_matrix, n_queries=1000, seed=42):
+    """
+    Returns random product ids and random carts of the session ids which include at least 2 products.
+    """
+    rng = np.random.default_rng (seed)
+    matrix = user_pro_matrix.matrix
+    products = user_pro_matrix.products.astype (str)
+    single = products[rng.choice (len (products), min (n_queries, len (products)), replace=False)].tolist ()
+
+    sessions = np.flatnonzero (np.diff (matrix.indptr) > 1)
+    sessions = sessions[rng.choice (len (sessions), min (n_queries, len (sessions)), replace=False)]
+    carts = [products[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]].tolist () for row in sessions]
+    return single, carts
+
+
+def measure_queries(query, items, rec_count=10):
+    """
+    Returns the results and latencies of the queries in milliseconds.
+    """
+    results, latencies = [], []
+    for item in items:
+        start = time.perf_counter ()
+        results.append (query (item)[:rec_count])
+        latencies.append ((time.perf_counter () - start) * 1000)
+    return results, np.array (latencies)
+
+
+def recall(results, exact_results):
+    """
+    Returns the mean ratio of the exact results which are found by the approximate search.
+    """
+    return float (np.mean ([len (set (result).intersection (exact)) / len (exact)
+                            for result, exact in zip (results, exact_results) if exact]))
+
+
+def run(n_events, n_products, methods=("svd", "als"), probes=(1, 4, 8, 16, 64), n_queries=1000, rec_count=10,
+        dim=64, compare_table=True):
+    """
+    Builds the item embedding index of every method from synthetic data and prints the build times and
+    the recall of approximate search against exact search of the same vectors with latencies of single product
+    and cart queries for every number of probed lists. If 'compare_table' parameter is True, the exact pearson
+    similarity table is also built and the overlap of its neighbors with the neighbors of the vectors is printed.
+    """
+    df_prep = data_preparation (create_synthetic_row_dataframe (n_events=n_events, n_products=n_products))
+    user_pro_matrix = create_sparse_session_product_matrix (df_prep, binary=False)
+    single, carts = create_queries (user_pro_matrix, n_queries)
+    print ("\nevents={}, products={}, session ids={}".format (n_events, len (user_pro_matrix.products),
+                                                           len (user_pro_matrix.sessions)))
+
+    print ("{:<22} {:>10}".format ("STAGE", "TIME (s)"))
+    table = None
+    if compare_table:
+        start = time.perf_counter ()
+        table = create_item_similarity_table (user_pro_matrix)
+        print ("{:<22} {:>10.2f}".format ("pearson table", time.perf_counter () - start))
+
+    indexes = {}
+    for method in methods:
+        start = time.perf_counter ()
+        indexes[method] = create_item_embedding_index (user_pro_matrix, dim=dim, method=method)
+        print ("{:<22} {:>10.2f}".format (method + " index", time.perf_counter () - start))
+
+    print ("{:<6} {:<7} {:>8} {:>10} {:>10} {:>10} {:>10}".format ("METHOD", "QUERY", "N_PROBE", "RECALL@10",
+                                                                    "TABLE@10", "P50 (ms)", "P99 (ms)"))
+    for method, index in indexes.items ():
+        queries = {"single": (single, lambda n_probe, exact: lambda product:
+                              index.similar_products (product, count=rec_count, n_probe=n_probe, exact=exact)),
+                   "cart": (carts, lambda n_probe, exact: lambda cart:
+                            index.recommend_cart (cart, rec_count, n_probe=n_probe, exact=exact))}
+        for query_name, (items, create_query) in queries.items ():
+            exact_results, exact_latencies = measure_queries (create_query (None, True), items, rec_count)
+            for n_probe in list (probes) + ["exact"]:
+                if n_probe == "exact":
+                    results, latencies = exact_results, exact_latencies
+                else:
+                    results, latencies = measure_queries (create_query (n_probe, False), items, rec_count)
+
+                # Overlap with the exact pearson neighbors, only for single product queries.
+                overlap = np.nan
+                if table is not None and query_name == "single":
+                    overlap = recall (results, [table.similar_products (product, count=rec_count) for product in items])
+
+                print ("{:<6} {:<7} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format (
+                    method, query_name, n_probe, recall (results, exact_results), overlap,
+                    *np.percentile (latencies, [50, 99])))
+
+
+def main():
+    parser = argparse.ArgumentParser (description="Measures the recall and latency of the item embedding index.")
+    parser.add_argument ("--scales", nargs="+", default=["200000:5000", "1000000:50000"],
+                         help="synthetic data scales as 'events:products'")
+    parser.add_argument ("--methods", nargs="+", default=["svd", "als"])
+    parser.add_argument ("--probes", nargs="+", type=int, default=[1, 4, 8, 16, 64])
+    parser.add_argument ("--queries", type=int, default=1000)
+    parser.add_argument ("--dim", type=int, default=64)
+    parser.add_argument ("--no-table", action="store_true", help="do not build the exact pearson similarity table")
+    args = parser.parse_args ()
+
+    for scale in args.scales:
+        n_events, n_products = (int (value) for value in scale.split (":"))
+        run (n_events, n_products, args.methods, args.probes, args.queries, dim=args.dim,
+             compare_table=not args.no_table)
+
+
+if __name__ == '__main__':
+    main ()
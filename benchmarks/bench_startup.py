@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname (os.path.dirname (os.path.abspath (__file__)))
+sys.path.insert (0, ROOT)
+
+# The code run by a new process for every entry point. It prints the times from the start of the process
+# to the end of the imports, the end of artifact loading and the first recommendation.
+ENTRY_POINTS = {
+    "service": """
+from recommendation_service import RecommendationService
+from artifact_store import ArtifactStore
+imported = time.time ()
+service = RecommendationService (store=ArtifactStore (root), use_index=use_index, max_workers=1)
+loaded = time.time ()
+product = service.products.products[0]
+recommendations = asyncio.run (service.add_to_cart ("session", str (product)))["recommendations"]
+service.executor.shutdown ()
+""",
+    "core": """
+from recommender_core import *
+from artifact_store import ArtifactStore
+imported = time.time ()
+store = ArtifactStore (root)
+session_neighborhood = store.load ("session_neighborhood", SessionNeighborhood)
+if use_index:
+    rec_index, rules, similarity_table, bestseller_tables = store.load ("recommendation_index", RecommendationIndex), None, None, None
+else:
+    rec_index, rules = None, store.load ("rules", RuleIndex)
+    similarity_table = store.load ("item_similarity_table", ItemSimilarityTable)
+    bestseller_tables = store.load ("bestseller_tables", BestsellerTables)
+products = rec_index if use_index else bestseller_tables
+loaded = time.time ()
+product = str (products.products[0])
+candidates = recommendation_candidates (product, [product], session_neighborhood, rec_index=rec_index, rules=rules,
+                                        similarity_table=similarity_table, bestseller_tables=bestseller_tables)
+recommendations = hybrid_rank (candidates, products, shopping_cart=[product])
+""",
+    "funcs": """
+from funcs import *
+from recommender_core import recommendation_candidates, hybrid_rank
+from artifact_store import ArtifactStore
+imported = time.time ()
+store = ArtifactStore (root)
+session_neighborhood = read_session_neighborhood (prep_df=None, store=store)
+if use_index:
+    rec_index, rules, similarity_table, bestseller_tables = read_recommendation_index (store=store), None, None, None
+else:
+    rec_index, rules = None, read_rules_df (session_product_df=None, store=store)
+    similarity_table = read_item_similarity_table (user_pro_matrix=None, store=store)
+    bestseller_tables = read_bestseller_tables (prep_df=None, store=store)
+products = rec_index if use_index else bestseller_tables
+loaded = time.time ()
+product = str (products.products[0])
+candidates = recommendation_candidates (product, [product], session_neighborhood, rec_index=rec_index, rules=rules,
+                                        similarity_table=similarity_table, bestseller_tables=bestseller_tables)
+recommendations = hybrid_rank (candidates, products, shopping_cart=[product])
+"""}
+
+CHILD = """
+import sys, time, json, asyncio
+start, root, use_index = float (sys.argv[1]), sys.argv[2], sys.argv[3] == "1"
+{code}
+done = time.time ()
+print (json.dumps ({{"import": imported - start, "load": loaded - imported, "first": done - loaded, "total": done - start,
+                    "recommendations": len (recommendations),
+                    "heavy_modules": sorted (name for name in ["pandas", "scipy", "matplotlib", "seaborn", "mlxtend"]
+                                             if name in sys.modules)}}))
+"""
+
+
+def measure(entry_point, root, use_index=False):
+    """
+    Runs the entry point in a new python process and returns its times in seconds from the start of the process.
+    """
+    start = time.time ()
+    output = subprocess.run ([sys.executable, "-c", CHILD.format (code=ENTRY_POINTS[entry_point]), str (start), root,
+                              "1" if use_index else "0"], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads (output.strip ().splitlines ()[-1])
+
+
+def build_synthetic_artifacts(root, n_events=200000, n_products=2000):
+    """
+    Builds the artifacts of synthetic events to given directory with the build pipeline.
+    """
+    from synthetic_data import write_synthetic_json
+    from artifact_store import ArtifactStore
+    from build_pipeline import run_pipeline, create_stages
+
+    events_path, meta_path = write_synthetic_json (os.path.join (root, "data"), n_events=n_events, n_products=n_products)
+    store = ArtifactStore (os.path.join (root, "artifacts"), sources=[events_path, meta_path])
+    run_pipeline (store, create_stages (events_path, meta_path, n_jobs=os.cpu_count ()), verbose=False)
+    return store.root
+
+
+def main(root=None, repeats=5, entry_points=("service", "core", "funcs")):
+    """
+    Prints the median times from process start to the end of the imports, artifact loading and
+    the first recommendation of every entry point, with and without the recommendation index.
+    The artifacts are built from synthetic events if 'root' is not given.
+    """
+    with tempfile.TemporaryDirectory () as directory:
+        root = root or build_synthetic_artifacts (directory)
+
+        print ("{:<10} {:>6} {:>12} {:>10} {:>15} {:>11}  {}".format ("ENTRY", "INDEX", "IMPORT (ms)", "LOAD (ms)",
+                                                                   "FIRST REC (ms)", "TOTAL (ms)", "HEAVY MODULES"))
+        for entry_point in entry_points:
+            for use_index in (False, True):
+                runs = [measure (entry_point, root, use_index) for _ in range (repeats)]
+                times = {key: np.median ([run[key] for run in runs]) * 1000 for key in ["import", "load", "first", "total"]}
+                print ("{:<10} {:>6} {:>12.0f} {:>10.0f} {:>15.1f} {:>11.0f}  {}".format (
+                    entry_point, "yes" if use_index else "no", times["import"], times["load"], times["first"],
+                    times["total"], ", ".join (runs[0]["heavy_modules"]) or "-"))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser (description="Measures the time from process start to the first recommendation.")
+    parser.add_argument ("--artifacts", help="artifact store to load, synthetic artifacts are built if not given")
+    parser.add_argument ("--repeats", type=int, default=5)
+    parser.add_argument ("--entry-points", nargs="+", default=["service", "core", "funcs"],
+                         choices=list (ENTRY_POINTS))
+    args = parser.parse_args ()
+
+    main (args.artifacts, args.repeats, args.entry_points)
@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert (0, os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
+
+from funcs import data_preparation, create_row_dataframe, create_sparse_session_product_matrix, create_rules, \
+    RuleIndex, create_item_similarity_table, create_session_neighborhood, create_bestseller_tables, \
+    create_recommendation_index, arl_recommender, user_based_recommendation, item_based_recommendation
+from recommender_core import recommendation_candidates, hybrid_rank
+from synthetic_data import create_synthetic_row_dataframe
+
+APPROACHES = ["bestseller", "arl", "user", "item", "hybrid"]
+
+
+def time_split(prep_df, test_ratio=0.2):
+    """
+    Splits the prepared dataframe by time. The session ids which start after the '1 - test_ratio' quantile of
+    the start times are held out and the events before that time are used for training.
+    """
+    session_start = prep_df.groupby ("SESSIONID", observed=True)["EVENTTIME"].min ()
+    cut_time = session_start.quantile (1 - test_ratio)
+    is_test = prep_df["SESSIONID"].isin (session_start.index[session_start > cut_time])
+
+    train_df = prep_df[~is_test & (prep_df["EVENTTIME"] <= cut_time)].copy ()
+    test_df = prep_df[is_test].copy ()
+    for dataframe in (train_df, test_df):
+        for col in dataframe.columns:
+            if pd.api.types.is_categorical_dtype (dataframe[col]):
+                dataframe[col] = dataframe[col].cat.remove_unused_categories ()
+
+    return train_df, test_df
+
+
+def held_out_sessions(test_df, max_sessions=2000, seed=42):
+    """
+    Returns the held out session ids which include at least 2 different products as a list of
+    (first product, day and time label of the first event, other products) tuples.
+    The first product is added to the cart and the other products of the session id are expected to be recommended.
+    """
+    events = test_df.sort_values (["SESSIONID", "EVENTTIME"], kind="mergesort")
+    events = events.drop_duplicates (["SESSIONID", "PRODUCTID"])
+    sessions = []
+    for _, session in events.groupby ("SESSIONID", observed=True, sort=False):
+        products = session["PRODUCTID"].astype (str).tolist ()
+        if len (products) > 1:
+            sessions.append ((products[0], str (session["NEW_DAY_TIME"].iloc[0]), set (products[1:])))
+
+    rng = np.random.default_rng (seed)
+    if len (sessions) > max_sessions:
+        sessions = [sessions[i] for i in np.sort (rng.choice (len (sessions), max_sessions, replace=False))]
+    return sessions
+
+
+def measure(function, *args, trace_memory=True):
+    """
+    Returns the result, wall time and peak traced memory in MB of the function. The function is run again with
+    tracemalloc for the peak memory, so the wall time is not slowed down by tracing.
+    """
+    start = time.perf_counter ()
+    result = function (*args)
+    elapsed = time.perf_counter () - start
+
+    peak = np.nan
+    if trace_memory:
+        tracemalloc.start ()
+        function (*args)
+        peak = tracemalloc.get_traced_memory ()[1] / 2 ** 20
+        tracemalloc.stop ()
+
+    return result, elapsed, peak
+
+
+def build_artifacts(train_df, trace_memory=True):
+    """
+    Creates the artifacts of the recommenders from the training data.
+    Returns the artifacts and the build time and peak memory of every stage.
+    """
+    artifacts, stats = {}, []
+
+    def build(name, function, *args):
+        artifacts[name], elapsed, peak = measure (function, *args, trace_memory=trace_memory)
+        stats.append ({"kind": "build", "name": name, "seconds": elapsed, "peak_mb": peak})
+
+    build ("session_matrix", create_sparse_session_product_matrix, train_df)
+    build ("rules", lambda matrix: RuleIndex.from_rules (create_rules (matrix)), artifacts["session_matrix"])
+    build ("user_matrix", lambda dataframe: create_sparse_session_product_matrix (dataframe, binary=False), train_df)
+    build ("similarity_table", create_item_similarity_table, artifacts["user_matrix"])
+    build ("session_neighborhood", create_session_neighborhood, train_df)
+    build ("bestseller_tables", create_bestseller_tables, train_df)
+    build ("rec_index", create_recommendation_index, train_df, artifacts["rules"], artifacts["similarity_table"])
+
+    return artifacts, stats
+
+
+def recommenders(artifacts, rec_count=10):
+    """
+    Returns the functions which recommend 'rec_count' products for the product added to an empty cart
+    at given day and time label. Popularity based recommendations are read from the bestseller tables with
+    the label of the held out session id, since 'bestseller_same_diff_cat_day_time' uses the current time.
+    """
+    rec_index = artifacts["rec_index"]
+
+    def hybrid(product_id, daytime_label):
+        candidates = recommendation_candidates (product_id, [product_id], artifacts["session_neighborhood"],
+                                                rec_index=rec_index, daytime_label=daytime_label)
+        return hybrid_rank (candidates, rec_index, rec_count, shopping_cart=[product_id], daytime_label=daytime_label)
+
+    return {"bestseller": lambda product_id, daytime_label:
+            artifacts["bestseller_tables"].bestseller_products (product_id, daytime_label),
+            "arl": lambda product_id, daytime_label: arl_recommender (artifacts["rules"], product_id, rec_count),
+            "user": lambda product_id, daytime_label:
+            user_based_recommendation (artifacts["session_neighborhood"], None, [product_id], rec_count=rec_count),
+            "item": lambda product_id, daytime_label:
+            item_based_recommendation (artifacts["similarity_table"], product_id, rec_count=rec_count),
+            "hybrid": hybrid}
+
+
+def evaluate(artifacts, sessions, rec_count=10):
+    """
+    Replays the held out session ids and returns hit rate, precision, recall, catalogue coverage and
+    latency percentiles of every approach. Session ids whose first product is not in the training data are skipped.
+    """
+    rec_index = artifacts["rec_index"]
+    sessions = [session for session in sessions if session[0] in rec_index]
+
+    stats = []
+    for name, recommend in recommenders (artifacts, rec_count).items ():
+        hits, precisions, recalls, latencies, recommended = [], [], [], [], set ()
+        for product_id, daytime_label, expected in sessions:
+            start = time.perf_counter ()
+            recommendations = recommend (product_id, daytime_label)[:rec_count]
+            latencies.append (time.perf_counter () - start)
+
+            found = len (expected.intersection (recommendations))
+            hits.append (found > 0)
+            precisions.append (found / rec_count)
+            recalls.append (found / len (expected))
+            recommended.update (recommendations)
+
+        p50, p95, p99 = np.percentile (latencies, [50, 95, 99]) * 1000 if latencies else (np.nan,) * 3
+        stats.append ({"kind": "quality", "name": name, "sessions": len (sessions),
+                       "hit_rate": float (np.mean (hits)) if hits else np.nan,
+                       "precision": float (np.mean (precisions)) if hits else np.nan,
+                       "recall": float (np.mean (recalls)) if hits else np.nan,
+                       "coverage": len (recommended) / len (rec_index.products),
+                       "p50_ms": p50, "p95_ms": p95, "p99_ms": p99})
+    return stats
+
+
+def run(dataframe, scale, test_ratio=0.2, max_sessions=2000, rec_count=10, trace_memory=True):
+    """
+    Prepares the row dataframe, splits it by time, builds the artifacts and evaluates the approaches.
+    Returns the records of the build stages and approaches.
+    """
+    prep_df, elapsed, peak = measure (data_preparation, dataframe, trace_memory=trace_memory)
+    records = [{"kind": "build", "name": "data_preparation", "seconds": elapsed, "peak_mb": peak}]
+
+    train_df, test_df = time_split (prep_df, test_ratio)
+    artifacts, build_stats = build_artifacts (train_df, trace_memory)
+    records += build_stats
+    records += evaluate (artifacts, held_out_sessions (test_df, max_sessions), rec_count)
+
+    for record in records:
+        record.update (scale=scale, products=int (prep_df["PRODUCTID"].nunique ()),
+                       sessions_total=int (prep_df["SESSIONID"].nunique ()))
+    return records
+
+
+def report(records):
+    """
+    Prints the build stages and the approaches of every scale.
+    """
+    for scale in dict.fromkeys (record["scale"] for record in records):
+        scale_records = [record for record in records if record["scale"] == scale]
+        print ("\n{} ({} products, {} session ids)".format (scale, scale_records[0]["products"],
+                                                            scale_records[0]["sessions_total"]))
+        print ("{:<22} {:>10} {:>12}".format ("STAGE", "TIME (s)", "PEAK (MB)"))
+        for record in scale_records:
+            if record["kind"] == "build":
+                print ("{:<22} {:>10.3f} {:>12.1f}".format (record["name"], record["seconds"], record["peak_mb"]))
+
+        print ("{:<12} {:>9} {:>9} {:>10} {:>8} {:>9} {:>9} {:>9} {:>9}".format (
+            "APPROACH", "SESSIONS", "HIT@10", "PRECISION", "RECALL", "COVERAGE", "P50 (ms)", "P95 (ms)", "P99 (ms)"))
+        for record in scale_records:
+            if record["kind"] == "quality":
+                print ("{:<12} {:>9} {:>9.3f} {:>10.3f} {:>8.3f} {:>9.3f} {:>9.2f} {:>9.2f} {:>9.2f}".format (
+                    record["name"], record["sessions"], record["hit_rate"], record["precision"], record["recall"],
+                    record["coverage"], record["p50_ms"], record["p95_ms"], record["p99_ms"]))
+
+
+def check_regressions(records, baseline, tolerance=0.25):
+    """
+    Returns the messages of the build times and p95 latencies which are slower than the baseline records
+    by more than 'tolerance' ratio, and of the hit rates which are lower by more than 'tolerance' ratio.
+    """
+    baseline = {(record["scale"], record["kind"], record["name"]): record for record in baseline}
+    messages = []
+    for record in records:
+        previous = baseline.get ((record["scale"], record["kind"], record["name"]))
+        if previous is None:
+            continue
+        for metric, slower in [("seconds", True), ("p95_ms", True), ("hit_rate", False)]:
+            if metric not in record:
+                continue
+            value, previous_value = record[metric], previous[metric]
+            if (slower and value > previous_value * (1 + tolerance)) or \
+                    (not slower and value < previous_value * (1 - tolerance)):
+                messages.append ("{} {} {}: {:.4g} -> {:.4g}".format (record["scale"], record["name"], metric,
+                                                                      previous_value, value))
+    return messages
+
+
+def main(scales=((50000, 500), (200000, 2000), (500000, 5000)), events=False, output=None, baseline=None,
+         tolerance=0.25, max_sessions=2000, trace_memory=True):
+    """
+    Evaluates the approaches on synthetic data of given (events, products) scales or on the events data.
+    The records are written to 'output' as json lines, and compared with the 'baseline' json lines file.
+    Returns False if a regression is found.
+    """
+    records = []
+    if events:
+        records += run (create_row_dataframe (), "events", max_sessions=max_sessions, trace_memory=trace_memory)
+    else:
+        for n_events, n_products in scales:
+            dataframe = create_synthetic_row_dataframe (n_events=n_events, n_products=n_products)
+            records += run (dataframe, "events={},products={}".format (n_events, n_products),
+                            max_sessions=max_sessions, trace_memory=trace_memory)
+
+    report (records)
+
+    if output:
+        with open (output, 'w') as f:
+            for record in records:
+                f.write (json.dumps (record) + "\n")
+
+    if baseline:
+        with open (baseline, 'r') as f:
+            messages = check_regressions (records, [json.loads (line) for line in f if line.strip ()], tolerance)
+        print ("\nREGRESSIONS:" if messages else "\nNo regressions against {}.".format (baseline))
+        for message in messages:
+            print (message)
+        return not messages
+
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser (description="Evaluates the recommenders on held out session ids.")
+    parser.add_argument ("--events", action="store_true", help="use the events data instead of synthetic data")
+    parser.add_argument ("--scales", nargs="+", default=["50000:500", "200000:2000", "500000:5000"],
+                         help="synthetic data scales as 'events:products'")
+    parser.add_argument ("--sessions", type=int, default=2000, help="maximum number of held out session ids")
+    parser.add_argument ("--output", help="json lines file to write the records to")
+    parser.add_argument ("--baseline", help="json lines file of previous records to check regressions")
+    parser.add_argument ("--tolerance", type=float, default=0.25)
+    parser.add_argument ("--no-memory", action="store_true", help="do not trace the peak memory of the stages")
+    args = parser.parse_args ()
+
+    scales = [tuple (int (value) for value in scale.split (":")) for scale in args.scales]
+    sys.exit (0 if main (scales, args.events, args.output, args.baseline, args.tolerance, args.sessions,
+                         not args.no_memory) else 1)
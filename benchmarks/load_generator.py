@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import numpy as np
+
+sys.path.insert (0, os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
+
+
+def read_traffic(path):
+    """
+    Reads the requests from the json lines file. Every line keeps 'session_id' and 'product_id' of a request.
+    """
+    with open (path, 'r') as f:
+        requests = [json.loads (line) for line in f if line.strip ()]
+    return [(str (request["session_id"]), str (request["product_id"])) for request in requests]
+
+
+def create_traffic(products, n_requests, n_sessions, seed=42):
+    """
+    Returns random requests of given products, which are added to the carts of 'n_sessions' session ids.
+    """
+    rng = random.Random (seed)
+    return [("session_{}".format (rng.randrange (n_sessions)), rng.choice (products)) for _ in range (n_requests)]
+
+
+def write_traffic(requests, path):
+    """
+    Writes the requests to the json lines file which is read by 'read_traffic'.
+    """
+    with open (path, 'w') as f:
+        for session_id, product_id in requests:
+            f.write (json.dumps ({"session_id": session_id, "product_id": product_id}) + "\n")
+
+
+async def _send_requests(host, port, queue, latencies, statuses):
+    reader, writer = await asyncio.open_connection (host, port)
+    try:
+        while not queue.empty ():
+            session_id, product_id = queue.get_nowait ()
+            body = json.dumps ({"product_id": product_id}).encode ("utf-8")
+            start = time.perf_counter ()
+            writer.write ("POST /sessions/{}/cart HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n"
+                          "Content-Length: {}\r\n\r\n".format (session_id, host, len (body)).encode ("latin-1") + body)
+            await writer.drain ()
+
+            status = int ((await reader.readline ()).split ()[1])
+            length = 0
+            while True:
+                line = await reader.readline ()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode ("latin-1").partition (":")
+                if name.strip ().lower () == "content-length":
+                    length = int (value)
+            await reader.readexactly (length)
+
+            latencies.append (time.perf_counter () - start)
+            statuses[status] = statuses.get (status, 0) + 1
+    finally:
+        writer.close ()
+
+
+async def replay(requests, host="127.0.0.1", port=8080, concurrency=32):
+    """
+    Sends the requests to the recommendation service over 'concurrency' keep-alive connections and
+    returns the elapsed time, latencies of the requests and counts of response statuses.
+    """
+    queue = asyncio.Queue ()
+    for request in requests:
+        queue.put_nowait (request)
+
+    latencies, statuses = [], {}
+    start = time.perf_counter ()
+    await asyncio.gather (*[_send_requests (host, port, queue, latencies, statuses) for _ in range (concurrency)])
+    return time.perf_counter () - start, np.array (latencies), statuses
+
+
+def report(elapsed, latencies, statuses):
+    """
+    Prints the throughput and p50, p95 and p99 latencies of the replayed requests.
+    """
+    p50, p95, p99 = np.percentile (latencies, [50, 95, 99]) * 1000 if len (latencies) else (np.nan,) * 3
+    print ("{:>10} {:>10} {:>14} {:>10} {:>10} {:>10}".format ("REQUESTS", "TIME (s)", "REQUESTS / SEC",
+                                                             "P50 (ms)", "P95 (ms)", "P99 (ms)"))
+    print ("{:>10} {:>10.2f} {:>14.0f} {:>10.2f} {:>10.2f} {:>10.2f}".format (len (latencies), elapsed,
+                                                                          len (latencies) / elapsed, p50, p95, p99))
+    print ("Statuses: {}".format (", ".join ("{}: {}".format (status, count) for status, count in sorted (statuses.items ()))))
+
+
+def main():
+    parser = argparse.ArgumentParser (description="Replays cart requests to the recommendation service.")
+    parser.add_argument ("traffic", nargs="?", help="json lines file of 'session_id' and 'product_id' requests")
+    parser.add_argument ("--host", default="127.0.0.1")
+    parser.add_argument ("--port", type=int, default=8080)
+    parser.add_argument ("--concurrency", type=int, default=32)
+    parser.add_argument ("--requests", type=int, default=10000, help="number of random requests if no traffic file")
+    parser.add_argument ("--sessions", type=int, default=1000, help="number of random session ids if no traffic file")
+    parser.add_argument ("--artifacts", default="artifacts", help="artifact store of the products of random requests")
+    parser.add_argument ("--save", help="json lines file to write the random requests to, so they can be replayed")
+    args = parser.parse_args ()
+
+    if args.traffic:
+        requests = read_traffic (args.traffic)
+    else:
+        from recommender_core import BestsellerTables
+        from artifact_store import ArtifactStore
+
+        products = ArtifactStore (args.artifacts).load ("bestseller_tables", BestsellerTables,
+                                                        check_sources=False).products.tolist ()
+        requests = create_traffic (products, args.requests, args.sessions)
+        if args.save:
+            write_traffic (requests, args.save)
+
+    report (*asyncio.run (replay (requests, args.host, args.port, args.concurrency)))
+
+
+if __name__ == '__main__':
+    main ()
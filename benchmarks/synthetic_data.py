@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert (0, os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
+
+from funcs import EVENTS_SCHEMA, META_SCHEMA, grab_col_types
+
+CATEGORIES = ["Temel Gıda", "Su", "Fırın", "Pet Shop", "Kişisel Bakım", "Kahvaltılık ve Süt", "Meyve, Sebze",
+              "Et, Balık, Şarküteri", "Atıştırmalık", "Deterjan ve Temizlik"]
+
+
+def create_synthetic_meta(n_products=1000, seed=42):
+    """
+    Creates synthetic 'meta' dataframe with the columns of meta.json.
+    """
+    rng = np.random.default_rng (seed)
+    product_ids = np.array (["HBV{:08d}".format (i) for i in range (n_products)])
+    categories = np.array (CATEGORIES)[rng.integers (0, len (CATEGORIES), n_products)]
+    brands = np.array (["Brand{}".format (i) for i in range (max (n_products // 20, 1))])[
+        rng.integers (0, max (n_products // 20, 1), n_products)].astype (object)
+    brands[rng.random (n_products) < 0.15] = None
+
+    return pd.DataFrame ({"productid": product_ids,
+                          "brand": brands,
+                          "category": categories,
+                          "subcategory": [category + " {}".format (i % 5) for i, category in enumerate (categories)],
+                          "name": ["Product {}".format (i) for i in range (n_products)]})
+
+
+def create_synthetic_events(n_events=100000, n_products=1000, n_sessions=None, days=30, seed=42):
+    """
+    Creates synthetic 'events' dataframe with the columns of events.json. Product popularity follows a
+    zipf distribution and every session id buys mostly from a few neighbouring products.
+    """
+    rng = np.random.default_rng (seed)
+    n_sessions = n_sessions or max (n_events // 3, 1)
+
+    session_codes = np.sort (rng.integers (0, n_sessions, n_events))
+    session_base = rng.zipf (1.3, n_sessions) % n_products
+    product_codes = (session_base[session_codes] + rng.zipf (1.6, n_events) - 1) % n_products
+
+    session_start = pd.Timestamp ("2020-06-01", tz="UTC") + pd.to_timedelta (
+        rng.integers (0, days * 24 * 3600, n_sessions), unit="s")
+    event_times = session_start[session_codes] + pd.to_timedelta (rng.integers (0, 1800, n_events), unit="s")
+
+    return pd.DataFrame ({"event": "cart",
+                          "sessionid": np.char.add ("s", session_codes.astype (str)),
+                          "eventtime": event_times,
+                          "price": rng.uniform (1, 500, n_events).round (2),
+                          "productid": np.array (["HBV{:08d}".format (i) for i in range (n_products)])[product_codes]})
+
+
+def create_synthetic_row_dataframe(n_events=100000, n_products=1000, n_sessions=None, seed=42):
+    """
+    Creates synthetic row dataframe like 'create_row_dataframe' function returns.
+    """
+    events_df = create_synthetic_events (n_events, n_products, n_sessions, seed=seed)
+    meta_df = create_synthetic_meta (n_products, seed=seed)
+
+    grab_col_types (events_df, EVENTS_SCHEMA)
+    grab_col_types (meta_df, META_SCHEMA)
+
+    product_ids = pd.api.types.union_categoricals ([events_df["productid"], meta_df["productid"]]).categories
+    events_df["productid"] = events_df["productid"].cat.set_categories (product_ids)
+    meta_df["productid"] = meta_df["productid"].cat.set_categories (product_ids)
+
+    return events_df.merge (meta_df, how="left", on="productid")
+
+
+def write_synthetic_json(directory, n_events=100000, n_products=1000, n_sessions=None, seed=42):
+    """
+    Writes synthetic events.json and meta.json files to given directory and returns their paths.
+    """
+    os.makedirs (directory, exist_ok=True)
+    events_df = create_synthetic_events (n_events, n_products, n_sessions, seed=seed)
+    events_df["eventtime"] = events_df["eventtime"].dt.strftime ("%Y-%m-%dT%H:%M:%S.000Z")
+    meta_df = create_synthetic_meta (n_products, seed=seed)
+
+    events_path = os.path.join (directory, "events.json")
+    meta_path = os.path.join (directory, "meta.json")
+    with open (events_path, 'w') as f:
+        json.dump ({"events": events_df.to_dict (orient="records")}, f)
+    with open (meta_path, 'w') as f:
+        json.dump ({"meta": meta_df.to_dict (orient="records")}, f, ensure_ascii=False)
+
+    return events_path, meta_path
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from funcs import EVENTS_PATH, META_PATH, SparseSessionProductMatrix, RuleIndex, ItemSimilarityTable, \
+    create_row_dataframe, convert_json_to_df, read_data_prepared, read_product_catalogue, read_session_pro_df, \
+    read_session_neighborhood, read_bestseller_tables, read_rules_df, read_user_product_matrix_df, \
+    create_item_similarity_table, read_recommendation_index, read_item_embedding_index
+from artifact_store import ArtifactStore, file_hash
+from incremental_refresh import read_refresh_state
+from instrumentation import INSTRUMENTATION, reset_peak_rss, peak_rss
+
+# The source files of the code which builds the artifacts. The stages are built again when they change.
+CODE_PATHS = [os.path.join (os.path.dirname (os.path.abspath (__file__)), name)
+              for name in ["funcs.py", "recommender_core.py", "incremental_refresh.py", "artifact_store.py",
+                           "build_pipeline.py"]]
+
+
+class Stage:
+    """
+    Creates the Stage class which builds 'artifacts' of the store after the stages in 'inputs' are built.
+    The 'sources' are the source files the stage reads. The 'function' is called with the store and 'params'
+    in a worker process. If 'shard' and 'merge' are given instead, 'shard' is called with the shard number and
+    the number of shards in parallel workers and 'merge' saves the artifacts from the results of the shards.
+    """
+
+    def __init__(self, name, artifacts, inputs=(), sources=(), function=None, shard=None, merge=None, params=None):
+        self.name = name
+        self.artifacts = list (artifacts)
+        self.inputs = list (inputs)
+        self.sources = list (sources)
+        self.function = function
+        self.shard = shard
+        self.merge = merge
+        self.params = params or {}
+
+
+## STAGES
+def _build_df_prep(store, events_path=EVENTS_PATH, meta_path=META_PATH):
+    read_data_prepared (create_row_dataframe (events_path=events_path, meta_path=meta_path), True, store=store)
+
+
+def _build_product_catalogue(store, meta_path=META_PATH):
+    read_product_catalogue (meta_df=convert_json_to_df (meta_path, "meta", chunk_size=100000), upgrade=True,
+                            store=store)
+
+
+def _build_session_pro_matrix(store):
+    read_session_pro_df (dataframe=store.load_dataframe ("df_prep"), upgrade=True, store=store)
+
+
+def _build_session_neighborhood(store):
+    read_session_neighborhood (prep_df=store.load_dataframe ("df_prep"), upgrade=True, store=store)
+
+
+def _build_bestseller_tables(store):
+    read_bestseller_tables (prep_df=store.load_dataframe ("df_prep"), upgrade=True, store=store)
+
+
+def _build_user_product_matrix(store):
+    read_user_product_matrix_df (prep_data=store.load_dataframe ("df_prep"), upgrade=True, store=store)
+
+
+def _build_rules(store, n_jobs=1):
+    read_rules_df (session_product_df=store.load ("session_pro_matrix", SparseSessionProductMatrix), upgrade=True,
+                   store=store, n_jobs=n_jobs)
+
+
+def _similarity_shard(store, shard, n_shards, method="pearson"):
+    # The rows of the products of the shard, the products are split into contiguous ranges.
+    user_product_matrix = store.load ("user_product_matrix", SparseSessionProductMatrix)
+    columns = np.array_split (np.arange (len (user_product_matrix.products)), n_shards)[shard]
+    table = create_item_similarity_table (user_product_matrix, method=method, columns=columns)
+    return columns, table.neighbors[columns], table.scores[columns]
+
+
+def _merge_similarity(store, shards, method="pearson"):
+    products = store.load ("user_product_matrix", SparseSessionProductMatrix).products
+    k = shards[0][1].shape[1]
+    neighbors = np.full ((len (products), k), -1, dtype=np.int32)
+    scores = np.full ((len (products), k), np.nan, dtype=np.float32)
+    for columns, shard_neighbors, shard_scores in shards:
+        neighbors[columns], scores[columns] = shard_neighbors, shard_scores
+    store.save ("item_similarity_table", ItemSimilarityTable (products, neighbors, scores))
+
+
+def _build_item_embeddings(store, method="svd"):
+    read_item_embedding_index (store.load ("user_product_matrix", SparseSessionProductMatrix), method=method,
+                               upgrade=True, store=store)
+
+
+def _build_recommendation_index(store):
+    read_recommendation_index (prep_df=store.load_dataframe ("df_prep"), rules_df=store.load ("rules", RuleIndex),
+                               user_pro_matrix=store.load ("item_similarity_table", ItemSimilarityTable),
+                               upgrade=True, store=store)
+
+
+def _build_refresh_state(store):
+    read_refresh_state (prep_df=store.load_dataframe ("df_prep"), upgrade=True, store=store)
+
+
+def create_stages(events_path=EVENTS_PATH, meta_path=META_PATH, n_jobs=1, embeddings=None):
+    """
+    Returns the stages of create_data.py. The stages which only need the prepared dataframe are built together,
+    the rules and the item similarity table are built together after their matrices, and the item similarity table
+    is split into 'n_jobs' product shards. If 'embeddings' is "svd" or "als", the item embedding index is also built.
+    """
+    stages = [Stage ("df_prep", ["df_prep"], sources=[events_path, meta_path], function=_build_df_prep,
+                     params={"events_path": events_path, "meta_path": meta_path}),
+              Stage ("product_catalogue", ["product_catalogue"], sources=[meta_path], function=_build_product_catalogue,
+                     params={"meta_path": meta_path}),
+              Stage ("session_pro_matrix", ["session_pro_matrix"], ["df_prep"], function=_build_session_pro_matrix),
+              Stage ("session_neighborhood", ["session_neighborhood"], ["df_prep"], function=_build_session_neighborhood),
+              Stage ("bestseller_tables", ["bestseller_tables"], ["df_prep"], function=_build_bestseller_tables),
+              Stage ("user_product_matrix", ["user_product_matrix"], ["df_prep"], function=_build_user_product_matrix),
+              Stage ("rules", ["rules"], ["session_pro_matrix"], function=_build_rules,
+                     params={"n_jobs": max (n_jobs // 2, 1)}),
+              Stage ("item_similarity_table", ["item_similarity_table"], ["user_product_matrix"],
+                     shard=_similarity_shard, merge=_merge_similarity),
+              Stage ("recommendation_index", ["recommendation_index"], ["df_prep", "rules", "item_similarity_table"],
+                     function=_build_recommendation_index),
+              Stage ("refresh_state", ["refresh_state"], ["df_prep"], function=_build_refresh_state)]
+    if embeddings:
+        stages.append (Stage ("item_embeddings", ["item_embeddings"], ["user_product_matrix"],
+                              function=_build_item_embeddings, params={"method": embeddings}))
+    return stages
+
+
+## WORKERS
+def _run_stage(root, function, params):
+    # Artifacts are saved without writing the manifest, the manifest entries are returned to the pipeline.
+    reset_peak_rss ()
+    start = time.perf_counter ()
+    store = ArtifactStore (root, save_manifest=False)
+    created = {name: entry["created"] for name, entry in store.manifest["artifacts"].items ()}
+    function (store, **params)
+    return {"seconds": time.perf_counter () - start, "peak_rss": peak_rss (),
+            "artifacts": {name: entry for name, entry in store.manifest["artifacts"].items ()
+                          if created.get (name) != entry["created"]}}
+
+
+def _run_shard(root, function, shard, n_shards, params):
+    reset_peak_rss ()
+    start = time.perf_counter ()
+    result = function (ArtifactStore (root, save_manifest=False), shard, n_shards, **params)
+    return {"seconds": time.perf_counter () - start, "peak_rss": peak_rss (), "result": result}
+
+
+## PIPELINE
+def _stage_fingerprints(stages, store, code_hash):
+    # The fingerprint of a stage depends on its code, parameters, source files and the fingerprints of its inputs.
+    source_hashes = store.source_hashes ()
+    fingerprints = {}
+    for stage in stages:
+        sources = {path: source_hashes[path]["sha256"] if path in source_hashes else
+                   (file_hash (path) if os.path.exists (path) else None) for path in stage.sources}
+        key = json.dumps ({"name": stage.name, "code": code_hash, "params": stage.params, "sources": sources,
+                           "inputs": [fingerprints[name] for name in stage.inputs]}, sort_keys=True)
+        fingerprints[stage.name] = hashlib.sha256 (key.encode ("utf-8")).hexdigest ()
+    return fingerprints
+
+
+def run_pipeline(store, stages=None, n_jobs=None, force=False, verbose=True):
+    """
+    Builds the artifacts of the stages in a process pool of 'n_jobs' processes. A stage is started as soon as
+    its inputs are built, so independent stages are built at the same time. The stages whose code, parameters,
+    source files and inputs have not changed since the last build are skipped unless 'force' parameter is True.
+    Returns the report of every stage with its status, wall time and peak resident set size of its processes.
+    """
+    n_jobs = n_jobs or os.cpu_count ()
+    stages = stages if stages is not None else create_stages (n_jobs=n_jobs)
+    pipeline_path = os.path.join (store.root, "pipeline.json")
+    previous = {}
+    if os.path.exists (pipeline_path):
+        with open (pipeline_path, 'r') as f:
+            previous = json.load (f)
+
+    code_hash = hashlib.sha256 ("".join (file_hash (path) for path in CODE_PATHS).encode ("utf-8")).hexdigest ()
+    fingerprints = _stage_fingerprints (stages, store, code_hash)
+
+    report, done = {}, set ()
+    for stage in stages:
+        unchanged = previous.get (stage.name, {}).get ("fingerprint") == fingerprints[stage.name]
+        if not force and unchanged and all (artifact in store.manifest["artifacts"] for artifact in stage.artifacts) \
+                and all (name in done for name in stage.inputs):
+            report[stage.name] = dict (previous[stage.name], status="skipped")
+            done.add (stage.name)
+
+    def finish(stage, seconds, peak, artifacts):
+        store.add_artifacts (artifacts)
+        report[stage.name] = {"status": "built", "fingerprint": fingerprints[stage.name], "seconds": seconds,
+                              "peak_rss_mb": peak / 2 ** 20 if peak is not None else None}
+        INSTRUMENTATION.record_span ("build." + stage.name, seconds)
+        done.add (stage.name)
+        with open (pipeline_path + ".tmp", 'w') as f:
+            json.dump ({name: stage_report for name, stage_report in report.items ()}, f, indent=2)
+        os.replace (pipeline_path + ".tmp", pipeline_path)
+        if verbose:
+            print ("{:<24} built in {:.2f}s".format (stage.name, seconds))
+
+    os.makedirs (store.root, exist_ok=True)
+    start = time.perf_counter ()
+    running, shards, started = {}, {}, set (done)
+    with ProcessPoolExecutor (n_jobs) as executor:
+        while len (done) < len (stages):
+            for stage in stages:
+                if stage.name in started or not all (name in done for name in stage.inputs):
+                    continue
+                started.add (stage.name)
+                if stage.shard is not None:
+                    shards[stage.name] = {"start": time.perf_counter (), "results": [None] * n_jobs}
+                    for shard in range (n_jobs):
+                        future = executor.submit (_run_shard, store.root, stage.shard, shard, n_jobs, stage.params)
+                        running[future] = (stage, shard)
+                else:
+                    future = executor.submit (_run_stage, store.root, stage.function, stage.params)
+                    running[future] = (stage, None)
+
+            if not running:
+                raise RuntimeError ("Stages {} can not be built, their inputs are missing.".format (
+                    [stage.name for stage in stages if stage.name not in done]))
+
+            finished, _ = wait (running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, shard = running.pop (future)
+                result = future.result ()
+                if shard is None:
+                    finish (stage, result["seconds"], result["peak_rss"], result["artifacts"])
+                    continue
+
+                shard_state = shards[stage.name]
+                shard_state["results"][shard] = result
+                if all (shard_result is not None for shard_result in shard_state["results"]):
+                    # The shards are merged and saved by the pipeline, which writes the manifest itself.
+                    stage.merge (store, [shard_result["result"] for shard_result in shard_state["results"]],
+                                 **stage.params)
+                    peaks = [shard_result["peak_rss"] for shard_result in shard_state["results"]
+                             if shard_result["peak_rss"] is not None]
+                    finish (stage, time.perf_counter () - shard_state["start"], max (peaks) if peaks else None, {})
+
+    if verbose:
+        print_report (report, time.perf_counter () - start)
+    return report
+
+
+def print_report(report, elapsed=None):
+    """
+    Prints the status, wall time and peak memory of every stage.
+    """
+    print ("{:<24} {:>8} {:>10} {:>14}".format ("STAGE", "STATUS", "TIME (s)", "PEAK RSS (MB)"))
+    for name, stage_report in report.items ():
+        peak = stage_report.get ("peak_rss_mb")
+        print ("{:<24} {:>8} {:>10.2f} {:>14}".format (name, stage_report["status"], stage_report["seconds"],
+                                                       "{:.1f}".format (peak) if peak is not None else "-"))
+    if elapsed is not None:
+        print ("Total wall time: {:.2f}s".format (elapsed))
@@ -1,13 +1,31 @@
-from funcs import *
+import os
+import sys
+import warnings
+
+import pandas as pd
+
+from funcs import EVENTS_PATH, META_PATH
+from artifact_store import ArtifactStore
+from build_pipeline import run_pipeline, create_stages
+from instrumentation import INSTRUMENTATION
 
 # YOU SHOULD RUN THIS FILE BEFORE YOU START THE PROJECT, FOR DOWNLOADING THE DATAFRAMES TO YOUR LOCAL WHICH USED IN THIS PROJECT.
+# The artifacts are built by the stages of build_pipeline.py. The stages whose inputs have not changed are skipped,
+# run with '--force' to build all of them again. Run with '--embeddings svd' or '--embeddings als' to build
+# the item embedding index too.
 
-df = create_row_dataframe ()
+if __name__ == '__main__':
+    warnings.filterwarnings ("ignore")
 
-df_prep = read_data_prepared (df, True)
+    pd.set_option ('display.max_rows', 30)
+    pd.set_option ('display.width', 500)
+    pd.set_option ('display.max_columns', 50)
 
-session_pro_df = read_session_pro_df (dataframe=df_prep, upgrade=True)
+    store = ArtifactStore ("artifacts", sources=[EVENTS_PATH, META_PATH])
 
-rules = read_rules_df (session_product_df=session_pro_df, upgrade=True)
+    embeddings = sys.argv[sys.argv.index ("--embeddings") + 1] if "--embeddings" in sys.argv else None
+    run_pipeline (store, create_stages (n_jobs=os.cpu_count (), embeddings=embeddings), n_jobs=os.cpu_count (),
+                  force="--force" in sys.argv)
 
-user_product_matrix = read_user_product_matrix_df (prep_data=df_prep, upgrade=True)
\ No newline at end of file
+    # Build time of every stage.
+    INSTRUMENTATION.export_jsonl (os.path.join ("artifacts", "build_metrics.jsonl"), events=False)
@@ -1,58 +1,137 @@
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import datetime as dt
-import matplotlib.pyplot as plt
-import warnings
 import random
-import time
-import sys
+import scipy.sparse as sp
+from concurrent.futures import ProcessPoolExecutor
 
-warnings.filterwarnings ("ignore")
+from instrumentation import timed, increment
+from recommender_core import EVENTS_PATH, META_PATH, DAY_MAP, HOUR_RANGES, DAY_TIME_LABELS, create_cart_matrix, \
+    matrix_contains, top_per_row, ProductPositions, RuleIndex, ProductCatalogue, create_current_time, \
+    BestsellerTables, SessionNeighborhood, ItemSimilarityTable, ItemEmbeddingIndex, RecommendationIndex, HYBRID_WEIGHTS
 
-pd.set_option ('display.max_rows', 30)
-pd.set_option ('display.width', 500)
-pd.set_option ('display.max_columns', 50)
 
-from mlxtend.frequent_patterns import apriori, association_rules
-
-
-class Cart:
+def iter_json_records(path, recordPath, buffer_size=1 << 20):
     """
-    Creates the Cart class.
+    Yields the records of the array whose key is 'recordPath' in the json file one by one.
+    The keys of the top level object are walked one by one, so only the array of the top level 'recordPath' key is
+    streamed and the values of the other keys are skipped. The file is read in parts of 'buffer_size' characters,
+    so the whole record array is never kept in memory.
     """
+    import json
+    decoder = json.JSONDecoder ()
+    whitespace = " \t\r\n"
 
-    def __init__(self):
-        self.shopping_list = []
-
-    def display_cart(self):
-        """
-        Displays the cart.
-        """
-        print (self.shopping_list)
-
-    def add_to_cart(self, product_id):
-        """
-        Adds product to cart.
-        """
-        self.shopping_list.append (product_id)
+    with open (path, 'r') as f:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def read():
+            # Dropping the decoded part of the buffer and reading the next part of the file.
+            nonlocal buffer, position, eof
+            part = f.read (buffer_size)
+            eof = not part
+            buffer = buffer[position:] + part
+            position = 0
+            return not eof
+
+        def next_char(skipped):
+            # Skipping the given characters, returns the next character or "" at the end of the file.
+            nonlocal position
+            while True:
+                while position < len (buffer) and buffer[position] in skipped:
+                    position += 1
+                if position < len (buffer):
+                    return buffer[position]
+                if eof or not read ():
+                    return ""
+
+        def decode():
+            # Decoding the next value, the file is read until the value is complete in the buffer.
+            # A value which ends at the end of the buffer is decoded again with the next part, since a number
+            # may continue in the next part.
+            nonlocal position
+            next_char (whitespace)
+            while True:
+                try:
+                    value, end = decoder.raw_decode (buffer, position)
+                    if end < len (buffer) or eof:
+                        position = end
+                        return value
+                except ValueError:
+                    if eof:
+                        raise ValueError ("Json file {} is not complete.".format (path))
+                read ()
+
+        # Walking the keys of the top level object until the record array.
+        if next_char (whitespace) != "{":
+            raise ValueError ("Record path '{}' is not found in {}.".format (recordPath, path))
+        position += 1
+        while True:
+            if next_char (whitespace + ",") in ("}", ""):
+                raise ValueError ("Record path '{}' is not found in {}.".format (recordPath, path))
+            key = decode ()
+            if next_char (whitespace) != ":":
+                raise ValueError ("Json file {} is not complete.".format (path))
+            position += 1
+            if key == recordPath:
+                break
+            decode ()
+
+        if next_char (whitespace) != "[":
+            raise ValueError ("Record path '{}' is not an array in {}.".format (recordPath, path))
+        position += 1
+
+        while True:
+            # Skipping the whitespaces and commas between records.
+            character = next_char (whitespace + ",")
+            if character == "]":
+                return
+            if not character:
+                raise ValueError ("Record array '{}' is not complete in {}.".format (recordPath, path))
+
+            yield decode ()
+
+
+def iter_json_chunks(path, recordPath, chunk_size=100000):
+    """
+    Yields the records of the json file as dataframes which include 'chunk_size' records.
+    """
+    records = []
+    for record in iter_json_records (path, recordPath):
+        records.append (record)
+        if len (records) == chunk_size:
+            yield pd.json_normalize (records)
+            records = []
 
-    def clear_cart(self):
-        """
-        Clears the cart.
-        """
-        self.shopping_list.clear ()
+    if records:
+        yield pd.json_normalize (records)
 
 
-def convert_json_to_df(path, recordPath):
+@timed (memory=True)
+def convert_json_to_df(path, recordPath, chunk_size=None, schema=None):
     """
     Converts the json file to dataframe.
+    If 'chunk_size' parameter is given, the json file is read as a stream and the dataframe is created
+    from the chunks of 'chunk_size' records instead of loading the whole json file.
+    If 'schema' parameter is given, the column types are converted by 'grab_col_types' with the schema. The chunks are
+    converted as they are read and concatenated by 'concat_chunks', so only one chunk is kept with object columns.
     """
+    if chunk_size:
+        chunks = []
+        for chunk in iter_json_chunks (path, recordPath, chunk_size):
+            if schema is not None:
+                grab_col_types (chunk, schema)
+            chunks.append (chunk)
+        return concat_chunks (chunks) if chunks else pd.DataFrame ()
+
     import json
     with open (path, 'r') as f:
         data = json.loads (f.read ())
 
     dataframe = pd.json_normalize (data, record_path=[recordPath])
+    if schema is not None:
+        grab_col_types (dataframe, schema)
     return dataframe
 
 
@@ -73,6 +152,20 @@ def check_df(dataframe, head=5):
     print (dataframe.head ())
 
 
+# Declared column types of 'events' and 'meta' json files. Keys and repeated strings are kept as categorical.
+EVENTS_SCHEMA = {"event": "category",
+                 "sessionid": "category",
+                 "eventtime": "datetime",
+                 "price": "float",
+                 "productid": "category"}
+
+META_SCHEMA = {"productid": "category",
+               "brand": "category",
+               "category": "category",
+               "subcategory": "category",
+               "name": "category"}
+
+
 def is_float(dataframe, col):
     """
     Returns True if the type of the given column is float if not returns False.
@@ -106,19 +199,47 @@ def is_date(dataframe, col):
         return False
 
 
-def grab_col_types(dataframe):
+def infer_col_type(dataframe, col, sample_size=1000):
     """
-    Grabs the type of columns as float, integer, datetime or object and assigns it to grabbed version by converting.
+    Returns the type of the given column as 'float', 'int', 'datetime' or 'O' by trying the conversions
+    on a sample of 'sample_size' non-missing values instead of the whole column.
     """
-    for col in dataframe.columns:
-        if is_float (dataframe, col):
-            dataframe[col] = dataframe[col].astype (float)
-        elif is_integer (dataframe, col):
-            dataframe[col] = dataframe[col].astype (int)
-        elif is_date (dataframe, col):
+    sample_df = dataframe[[col]].dropna ()
+    if len (sample_df) > sample_size:
+        sample_df = sample_df.sample (sample_size, random_state=42)
+
+    if is_float (sample_df, col):
+        return "float"
+    elif is_integer (sample_df, col):
+        return "int"
+    elif is_date (sample_df, col):
+        return "datetime"
+    return "O"
+
+
+def convert_col_type(dataframe, col, col_type):
+    """
+    Converts the given column to given type. If the column can not be converted, it is kept as object.
+    """
+    try:
+        if col_type == "datetime":
             dataframe[col] = pd.to_datetime (dataframe[col])
         else:
-            dataframe[col] = dataframe[col].astype ("O")
+            dataframe[col] = dataframe[col].astype (col_type)
+    except (ValueError, TypeError):
+        dataframe[col] = dataframe[col].astype ("O")
+
+
+def grab_col_types(dataframe, schema=None, sample_size=1000):
+    """
+    Grabs the type of columns as float, integer, datetime or object and assigns it to grabbed version by converting.
+    The types of the columns in 'schema' are not grabbed, the columns are converted to the declared types.
+    The types of other columns are grabbed from a sample of 'sample_size' values.
+    """
+    schema = schema or {}
+    for col in dataframe.columns:
+        col_type = schema.get (col) or infer_col_type (dataframe, col, sample_size)
+        convert_col_type (dataframe, col, col_type)
 
 
 def missing_col_ratio(dataframe, threshold=0.1):
@@ -134,25 +255,30 @@ def missing_col_ratio(dataframe, threshold=0.1):
     return na_cols, na_ratio_df
 
 
+@timed (memory=True)
 def create_row_dataframe(
-        events_path='/Users/ozanguner/PycharmProjects/Hybrid_Recommender/raw_datasets/events.json',
+        events_path=EVENTS_PATH,
         events_record_path='events',
-        meta_path='/Users/ozanguner/PycharmProjects/Hybrid_Recommender/raw_datasets/meta.json',
-        meta_record_path='meta'):
+        meta_path=META_PATH,
+        meta_record_path='meta',
+        chunk_size=100000):
     """
     Converts the json files include the function to dataframe.
-    Then converts the columns types of 'events' and 'meta' dataframes to grabbed versions and merges
-    'events_df' and 'meta_df' as a dataframe.
+    The columns types of 'events' and 'meta' dataframes are converted to grabbed versions chunk by chunk
+    and 'events_df' and 'meta_df' are merged as a dataframe.
+    The json files are read as streams in chunks of 'chunk_size' records.
 
     Notes: Make sure the events json path and meta json path are in the right direction
     when you give these paths as parameter.
     """
     try:
-        events_df = convert_json_to_df (events_path, events_record_path)
-        meta_df = convert_json_to_df (meta_path, meta_record_path)
+        events_df = convert_json_to_df (events_path, events_record_path, chunk_size, schema=EVENTS_SCHEMA)
+        meta_df = convert_json_to_df (meta_path, meta_record_path, chunk_size, schema=META_SCHEMA)
 
-        grab_col_types (events_df)
-        grab_col_types (meta_df)
+        # Both product id columns have the same categories, so the merged product id column stays categorical.
+        product_ids = pd.api.types.union_categoricals ([events_df["productid"], meta_df["productid"]]).categories
+        events_df["productid"] = events_df["productid"].cat.set_categories (product_ids)
+        meta_df["productid"] = meta_df["productid"].cat.set_categories (product_ids)
 
         dataframe = events_df.merge (meta_df, how="left", on="productid")
 
@@ -161,56 +287,118 @@ def create_row_dataframe(
         print ("File Not Found. Please check the events json path and meta json path are in the right direction on your local when you give these paths as parameter.")
 
 
+def is_one_class(series):
+    """
+    Returns True if the given column has only one class except missing values.
+    Compares the values with the first value instead of counting the unique values.
+    """
+    values = series.cat.codes.values if pd.api.types.is_categorical_dtype (series) else series.values
+    not_missing = values != -1 if pd.api.types.is_categorical_dtype (series) else series.notnull ().values
+    values = values[not_missing]
+    return len (values) > 0 and bool ((values == values[0]).all ())
+
+
+def add_time_features(dataframe):
+    """
+    Adds day and time features to the dataframe by using 'EVENTTIME' column. Weekdays, hour ranges and
+    day and time labels are created as categorical columns from their integer codes.
+    """
+    event_time = dataframe["EVENTTIME"]
+    if event_time.dt.tz is not None:
+        event_time = event_time.dt.tz_localize (None)
+
+    # Missing event times get -1 codes, which are missing values of categorical columns.
+    missing = event_time.isnull ().values
+    hours = event_time.dt.hour.fillna (-1).values.astype (np.int64)
+    weekday_codes = np.where (missing, -1, event_time.dt.weekday.fillna (-1).values.astype (np.int64))
+    hour_range_codes = np.where (missing, -1, hours // 4)
+    day_time_codes = np.where (missing, -1, weekday_codes * len (HOUR_RANGES) + hour_range_codes)
+
+    dataframe["NEW_EVENTTIME"] = event_time.dt.normalize ()
+    dataframe["NEW_EVENTHOURS"] = hours
+    dataframe["NEW_WEEKDAY"] = pd.Categorical.from_codes (weekday_codes, [DAY_MAP[day] for day in range (7)])
+    dataframe["NEW_EVENTHOURS_RANGE"] = pd.Categorical.from_codes (hour_range_codes, HOUR_RANGES, ordered=True)
+    dataframe["NEW_DAY_TIME"] = pd.Categorical.from_codes (day_time_codes, DAY_TIME_LABELS)
+
+
+def concat_chunks(chunks):
+    """
+    Concatenates the dataframes. Categorical columns stay categorical by taking the union of their categories.
+    The columns which are missing in some dataframes are missing values in their rows.
+    """
+    if len (chunks) == 1:
+        return chunks[0]
+
+    data = {}
+    for col in dict.fromkeys (col for chunk in chunks for col in chunk.columns):
+        present = [chunk[col] for chunk in chunks if col in chunk.columns]
+        categorical = all (pd.api.types.is_categorical_dtype (column) for column in present)
+        columns = [chunk[col] if col in chunk.columns else
+                   pd.Series (pd.Categorical.from_codes (np.full (len (chunk), -1), dtype=present[0].dtype)
+                              if categorical else np.full (len (chunk), np.nan)) for chunk in chunks]
+        if categorical:
+            if all (column.cat.categories.equals (columns[0].cat.categories) for column in columns):
+                data[col] = pd.Categorical.from_codes (np.concatenate ([column.cat.codes.values for column in columns]),
+                                                       dtype=columns[0].dtype)
+            else:
+                data[col] = pd.api.types.union_categoricals (columns, sort_categories=True)
+        else:
+            data[col] = pd.concat (columns, ignore_index=True)
+
+    return pd.DataFrame (data)
 
 
+@timed (memory=True)
 def data_preparation(dataframe):
     """
     Returns row dataframe to prepared dataframe by applying preprocessing.
+    The 'dataframe' parameter can also be a list or generator of row dataframe chunks, then the features are
+    created chunk by chunk and the chunks are concatenated before the preprocessing of the whole data.
     """
-    dataframe.columns = [col.upper () for col in dataframe.columns]
+    chunks = [dataframe] if isinstance (dataframe, pd.DataFrame) else dataframe
+
+    prepared_chunks = []
+    for chunk in chunks:
+        chunk = chunk.rename (columns=str.upper)
+        row_columns = list (chunk.columns)
+
+        # Feature Engineering.
+        add_time_features (chunk)
+        prepared_chunks.append (chunk)
+
+    df_prep = concat_chunks (prepared_chunks)
 
-    df_prep = dataframe.copy ()
     # Deleting the feature that has only one class.
-    one_class_feature = [col for col in df_prep.columns if df_prep[col].nunique () == 1]
-    df_prep.drop (one_class_feature, axis=1, inplace=True)
+    one_class_feature = [col for col in row_columns if is_one_class (df_prep[col])]
+    for col in one_class_feature:
+        del df_prep[col]
+    row_columns = [col for col in row_columns if col not in one_class_feature]
 
     na_cols_high_rated, missing_df = missing_col_ratio (df_prep)
+    na_cols_high_rated = [col for col in na_cols_high_rated if col in row_columns]
 
     for col in na_cols_high_rated:
+        if pd.api.types.is_categorical_dtype (df_prep[col]) and "None" not in df_prep[col].cat.categories:
+            df_prep[col] = df_prep[col].cat.add_categories ("None")
         df_prep[col].fillna ("None", inplace=True)
 
-    df_prep.dropna (axis=0, inplace=True)
-
-    # Feature Engineering.
-    df_prep["NEW_EVENTTIME"] = pd.to_datetime (df_prep["EVENTTIME"].dt.strftime ('%Y-%m-%d'))
-    df_prep["NEW_EVENTHOURS"] = df_prep["EVENTTIME"].dt.hour
-    df_prep["NEW_WEEKDAY"] = df_prep["NEW_EVENTTIME"].dt.weekday
-    day_map = {0: "MONDAY",
-               1: "TUESDAY",
-               2: "WEDNESDAY",
-               3: "THURSDAY",
-               4: "FRIDAY",
-               5: "SATURDAY",
-               6: "SUNDAY"}
-
-    df_prep["NEW_WEEKDAY"] = df_prep["NEW_WEEKDAY"].map (day_map)
-
-    df_prep["NEW_EVENTHOURS_RANGE"] = pd.cut (df_prep["NEW_EVENTHOURS"],
-                                              bins=[df_prep["NEW_EVENTHOURS"].min () - 1, 3, 7, 11, 15, 19,
-                                                    df_prep["NEW_EVENTHOURS"].max ()],
-                                              labels=["0_3", "4_7", "8_11", "12_15", "16_19", "20_23"])
-
-    df_prep["NEW_DAY_TIME"] = ["_".join (row) for row in df_prep[["NEW_WEEKDAY", "NEW_EVENTHOURS_RANGE"]].values]
+    df_prep.dropna (axis=0, subset=row_columns, inplace=True)
 
     return df_prep
 
 
-def read_data_prepared(dataframe, upgrade=False):
+def read_data_prepared(dataframe, upgrade=False, store=None):
     """
     Converts row dataframe to prepared dataframe if 'upgrade' parameter is True or
     reads prepared dataframe from its pickle format that is already exist if 'upgrade' parameter is False.
+    If 'store' parameter is given, the prepared dataframe is saved to and loaded from the artifact store.
     """
-    if upgrade:
+    if store is not None and upgrade:
+        df_prep = data_preparation (dataframe)
+        store.save_dataframe ("df_prep", df_prep)
+    elif store is not None:
+        df_prep = store.load_dataframe ("df_prep")
+    elif upgrade:
         df_prep = data_preparation (dataframe)
         df_prep.to_pickle ("df_prep.pickle")
     else:
@@ -219,22 +407,231 @@ def read_data_prepared(dataframe, upgrade=False):
     return df_prep
 
 
+## SPARSE SESSION ID-PRODUCT MATRICES
+class SparseSessionProductMatrix:
+    """
+    Creates the SparseSessionProductMatrix class which keeps a session id-product matrix in CSR format
+    with its session id and product vocabularies. Rows are session ids, columns are products.
+    """
+
+    def __init__(self, matrix, sessions, products):
+        self.matrix = matrix.tocsr ()
+        self.sessions = np.asarray (sessions)
+        self.products = np.asarray (products)
+        self.product_positions = ProductPositions (self.products)
+        self._csc = None
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def csc(self):
+        """
+        Returns the matrix in CSC format, so the session ids of a product can be sliced directly.
+        """
+        if self._csc is None:
+            self._csc = self.matrix.tocsc ()
+        return self._csc
+
+    @property
+    def arrays(self):
+        return {"data": self.matrix.data, "indices": self.matrix.indices, "indptr": self.matrix.indptr,
+                "shape": np.array (self.matrix.shape), "sessions": self.sessions.astype (str),
+                "products": self.products.astype (str)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        matrix = sp.csr_matrix ((arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple (arrays["shape"]),
+                                copy=False)
+        return cls (matrix, arrays["sessions"], arrays["products"])
+
+    def to_npz(self, path):
+        """
+        Saves the matrix and its vocabularies to given path in npz format.
+        """
+        np.savez (path, **self.arrays)
+
+    @classmethod
+    def read_npz(cls, path):
+        """
+        Reads the matrix and its vocabularies from given path which is saved by 'to_npz' method.
+        """
+        with np.load (path) as npz_file:
+            return cls.from_arrays ({name: npz_file[name] for name in npz_file.files})
+
+
+@timed (memory=True)
+def create_sparse_session_product_matrix(dataframe, binary=True):
+    """
+    Creates sparse session id-product matrix from prepared dataframe without creating the dense matrix.
+    If 'binary' parameter is True, focuses on whether the relevant product is in the session id or not,
+    otherwise focuses on how many of the relevant product is in the session id.
+    """
+    session_codes, sessions = pd.factorize (dataframe["SESSIONID"], sort=True)
+    product_codes, products = pd.factorize (dataframe["PRODUCTID"], sort=True)
+
+    matrix = sp.csr_matrix ((np.ones (len (session_codes), dtype=np.int32), (session_codes, product_codes)),
+                            shape=(len (sessions), len (products)))
+    matrix.sum_duplicates ()
+    if binary:
+        matrix.data[:] = 1
+
+    return SparseSessionProductMatrix (matrix, np.asarray (sessions), np.asarray (products))
+
+
 ## ASSOCIATION RULES
-def create_rules(session_pro_df, metric_name="support", minimum_support=0.002, minimum_threshold=0.002):
+# Number of set bits of every byte value, used to count the sessions of the bitsets.
+POPCOUNT_TABLE = np.array ([bin (i).count ("1") for i in range (256)], dtype=np.uint8)
+
+# The bitsets and pair counts of frequent products which are shared by the eclat worker processes.
+_eclat_data = None
+
+
+def popcount(bitsets):
+    """
+    Returns the number of set bits of every row of given uint8 bitsets.
+    """
+    return POPCOUNT_TABLE[bitsets].sum (axis=-1, dtype=np.int64)
+
+
+def create_product_bitsets(matrix):
+    """
+    Returns the uint8 bitsets of the products of boolean session id-product matrix. The bit 's' of the bitset
+    of a product is set if the session id at row 's' of the matrix includes the product.
+    """
+    csc = sp.csc_matrix (matrix)
+    sessions = csc.indices
+    items = np.repeat (np.arange (matrix.shape[1]), np.diff (csc.indptr))
+
+    bitsets = np.zeros ((matrix.shape[1], (matrix.shape[0] + 7) // 8), dtype=np.uint8)
+    np.bitwise_or.at (bitsets, (items, sessions >> 3), (1 << (sessions & 7)).astype (np.uint8))
+    return bitsets
+
+
+def _init_eclat_worker(data):
+    global _eclat_data
+    _eclat_data = data
+
+
+def _eclat_extend(prefix, prefix_bitset, candidates, minimum_count, max_len, itemsets):
+    # Intersecting the bitset of the prefix with the bitsets of all candidates at once.
+    bitsets = _eclat_data[0][candidates] & prefix_bitset
+    counts = popcount (bitsets)
+    frequent = np.flatnonzero (counts >= minimum_count)
+
+    for i, position in enumerate (frequent):
+        itemset = prefix + (int (candidates[position]),)
+        itemsets.append ((itemset, int (counts[position])))
+        if len (itemset) < max_len and i + 1 < len (frequent):
+            _eclat_extend (itemset, bitsets[position], candidates[frequent[i + 1:]], minimum_count, max_len,
+                           itemsets)
+
+
+def _eclat_prefix(task):
+    position, minimum_count, max_len = task
+    bitsets, pair_counts = _eclat_data
+
+    # The supports of the pairs are read from the pair counts, the bitsets are intersected for longer itemsets.
+    row = pair_counts[position]
+    frequent = (row.indices > position) & (row.data >= minimum_count)
+    order = np.argsort (row.indices[frequent])
+    pairs, counts = row.indices[frequent][order], row.data[frequent][order]
+
+    itemsets = []
+    for i, (pair, count) in enumerate (zip (pairs, counts)):
+        itemsets.append (((position, int (pair)), int (count)))
+        candidates = pairs[i + 1:]
+        if max_len > 2 and len (candidates):
+            # Candidates which are not frequent with the second product of the pair can not extend it.
+            candidates = candidates[np.asarray (pair_counts[pair, candidates].todense ()).ravel () >= minimum_count]
+        if max_len > 2 and len (candidates):
+            _eclat_extend ((position, int (pair)), bitsets[position] & bitsets[pair], candidates, minimum_count,
+                           max_len, itemsets)
+    return itemsets
+
+
+@timed (memory=True)
+def eclat(matrix, products, min_support=0.002, max_len=None, n_jobs=1):
+    """
+    Returns frequent itemsets of boolean session id-product matrix with 'support' and 'itemsets' columns
+    like mlxtend apriori function.
+    The supports of the pairs are counted by sparse matrix multiplication. The sessions of every frequent product
+    are kept as a bitset, so the support of a longer itemset is the number of set bits of the intersection of
+    its products' bitsets.
+    The 'max_len' parameter determines maximum number of products of an itemset.
+    The itemsets that start with different products are mined by 'n_jobs' processes.
+    """
+    matrix = sp.csr_matrix (matrix).astype (bool)
+    transaction_count = matrix.shape[0]
+    minimum_count = max (int (np.ceil (min_support * transaction_count - 1e-9)), 1)
+    max_len = max_len or matrix.shape[1]
+
+    product_counts = np.asarray (matrix.sum (axis=0)).ravel ()
+    positions = np.flatnonzero (product_counts >= minimum_count)
+    itemsets = [((i,), int (product_counts[position])) for i, position in enumerate (positions)]
+
+    if max_len > 1 and len (positions) > 1:
+        frequent_matrix = matrix[:, positions].astype (np.int32)
+        pair_counts = sp.csr_matrix (frequent_matrix.T @ frequent_matrix)
+        bitsets = create_product_bitsets (frequent_matrix) if max_len > 2 else None
+
+        tasks = [(i, minimum_count, max_len) for i in range (len (positions))]
+        if n_jobs > 1:
+            with ProcessPoolExecutor (n_jobs, initializer=_init_eclat_worker,
+                                      initargs=((bitsets, pair_counts),)) as executor:
+                for prefix_itemsets in executor.map (_eclat_prefix, tasks):
+                    itemsets += prefix_itemsets
+        else:
+            _init_eclat_worker ((bitsets, pair_counts))
+            for task in tasks:
+                itemsets += _eclat_prefix (task)
+            _init_eclat_worker (None)
+
+    products = np.asarray (products)[positions]
+    return pd.DataFrame ({"support": [count / transaction_count for _, count in itemsets],
+                          "itemsets": [frozenset (products[list (itemset)].tolist ()) for itemset, _ in itemsets]})
+
+
+@timed (memory=True)
+def create_rules(session_pro_df, metric_name="support", minimum_support=0.002, minimum_threshold=0.002,
+                 engine="eclat", max_len=None, n_jobs=1):
     """
     Returns dataframe created with products' association rules.
+    The 'engine' parameter determines the algorithm of frequent itemsets:
+    'eclat' mines the itemsets from bitsets of the sparse matrix with 'n_jobs' processes,
+    'apriori' uses mlxtend apriori function.
+    The 'max_len' parameter determines maximum number of products of a frequent itemset.
     """
-    buy_diff_pro = session_pro_df.transpose ().sum ().sort_values (ascending=False).reset_index ()
-    buy_diff_pro.rename (columns={0: "COUNT"}, inplace=True)
+    from mlxtend.frequent_patterns import apriori, association_rules
 
-    # Selecting of session id that purchased more than 1 kind of product.
-    sessions_more_than_one_products = buy_diff_pro.loc[buy_diff_pro["COUNT"] > 1, "SESSIONID"].tolist ()
+    if isinstance (session_pro_df, SparseSessionProductMatrix):
+        # Selecting of session id that purchased more than 1 kind of product without densifying the matrix.
+        matrix = session_pro_df.matrix
+        fin_matrix = matrix[np.diff (matrix.indptr) > 1].astype (bool)
+        products = session_pro_df.products
+    else:
+        buy_diff_pro = session_pro_df.transpose ().sum ().sort_values (ascending=False).reset_index ()
+        buy_diff_pro.rename (columns={0: "COUNT"}, inplace=True)
 
-    fin_pro_df = session_pro_df.loc[session_pro_df.index.isin (sessions_more_than_one_products)]
+        # Selecting of session id that purchased more than 1 kind of product.
+        sessions_more_than_one_products = buy_diff_pro.loc[buy_diff_pro["COUNT"] > 1, "SESSIONID"].tolist ()
 
-    # Apriori & Association Rules.
-    freq_pro_sets = apriori (fin_pro_df, min_support=minimum_support, use_colnames=True, low_memory=True)
+        fin_pro_df = session_pro_df.loc[session_pro_df.index.isin (sessions_more_than_one_products)]
+        fin_matrix = None
+        products = fin_pro_df.columns
 
+    if engine == "eclat":
+        if fin_matrix is None:
+            fin_matrix = sp.csr_matrix (fin_pro_df.values > 0)
+        freq_pro_sets = eclat (fin_matrix, products, min_support=minimum_support, max_len=max_len, n_jobs=n_jobs)
+    else:
+        if fin_matrix is not None:
+            fin_pro_df = pd.DataFrame.sparse.from_spmatrix (fin_matrix, columns=products)
+        freq_pro_sets = apriori (fin_pro_df, min_support=minimum_support, use_colnames=True, max_len=max_len,
+                                 low_memory=True)
+
+    # Association Rules.
     rules = association_rules (freq_pro_sets, metric=metric_name, min_threshold=minimum_threshold)
 
     sorted_rules = rules.sort_values (metric_name, ascending=False)
@@ -242,27 +639,45 @@ def create_rules(session_pro_df, metric_name="support", minimum_support=0.002, m
     return sorted_rules
 
 
-def read_rules_df(session_product_df, metric="support", upgrade=False):
+def read_rules_df(session_product_df, metric="support", upgrade=False, as_index=False, store=None, n_jobs=1):
     """
     Converts session id and product matrix to products' association rules dataframe if 'upgrade' parameter is True or
     reads products' association rules dataframe from its pickle format that is already exist if 'upgrade' parameter is False.
+    If 'as_index' parameter is True, the rules are returned as RuleIndex sorted by given metric.
+    If 'store' parameter is given, the rules are saved to and loaded from the artifact store as RuleIndex.
+    The 'n_jobs' parameter determines the number of processes which mine the frequent itemsets.
     """
-    if upgrade:
-        rules = create_rules (session_product_df, metric_name=metric)
+    if store is not None and upgrade:
+        rules = RuleIndex.from_rules (create_rules (session_product_df, metric_name=metric, n_jobs=n_jobs), metric)
+        store.save ("rules", rules)
+        return rules
+    elif store is not None:
+        return store.load ("rules", RuleIndex)
+    elif upgrade:
+        rules = create_rules (session_product_df, metric_name=metric, n_jobs=n_jobs)
         rules.to_pickle ("rules_df.pickle")
     else:
         rules = pd.read_pickle ("rules_df.pickle")
         rules = rules.sort_values (by=metric, ascending=False)
 
+    if as_index:
+        return RuleIndex.from_rules (rules, metric)
+
     return rules
 
 
-def arl_recommender(rules_df, product_id, rec_count=10):
+@timed ()
+def arl_recommender(rules_df, product_id, rec_count=10, shopping_cart=None):
     """
     Converts given dataframe, which is created by association rules,
      to product recommendation list that includes given number of products
      as 'rec_count' parameter for given product id.
+    If 'rules_df' is RuleIndex and 'shopping_cart' parameter is given, the rules whose antecedents are
+    included by the whole cart are used first and the rules of the given product id complete the list.
     """
+    if isinstance (rules_df, RuleIndex):
+        return rules_df.recommend_with_cart (product_id, shopping_cart, rec_count)
+
     rec_list = list (rules_df.loc[rules_df["antecedents"].apply (lambda x: product_id in x), "consequents"])[
                0:20]
     recommendation_list = list (set ([list (x)[0] for x in rec_list]))[0:rec_count]
@@ -270,10 +685,55 @@ def arl_recommender(rules_df, product_id, rec_count=10):
     return recommendation_list
 
 
+@timed (memory=True)
+def create_product_catalogue(meta_df):
+    """
+    Creates product catalogue from 'meta' dataframe or prepared dataframe. Missing values are kept as 'None'.
+    """
+    meta_df = meta_df.rename (columns=str.upper).drop_duplicates ("PRODUCTID")
+    product_codes, products = pd.factorize (meta_df["PRODUCTID"], sort=True)
+    order = np.argsort (product_codes)
+
+    arrays = {"products": np.asarray (products).astype (str)}
+    for col in ProductCatalogue.COLUMNS:
+        values = meta_df[col].astype (object).where (meta_df[col].notnull (), "None").astype (str).values[order]
+        codes, categories = pd.factorize (values, sort=True)
+        arrays[col + "_codes"] = codes.astype (np.int32)
+        arrays[col + "_categories"] = np.asarray (categories).astype (str)
+
+    return ProductCatalogue (arrays)
+
+
+def read_product_catalogue(meta_df, upgrade=False, store=None):
+    """
+    Converts given 'meta' dataframe to product catalogue if 'upgrade' parameter is True or
+    reads product catalogue from its npz format that is already exist if 'upgrade' parameter is False.
+    If 'store' parameter is given, the product catalogue is saved to and loaded from the artifact store.
+    """
+    if store is not None and upgrade:
+        product_catalogue = create_product_catalogue (meta_df)
+        store.save ("product_catalogue", product_catalogue)
+    elif store is not None:
+        product_catalogue = store.load ("product_catalogue", ProductCatalogue)
+    elif upgrade:
+        product_catalogue = create_product_catalogue (meta_df)
+        np.savez ("product_catalogue.npz", **product_catalogue.arrays)
+    else:
+        with np.load ("product_catalogue.npz") as npz_file:
+            product_catalogue = ProductCatalogue ({name: npz_file[name] for name in npz_file.files})
+
+    return product_catalogue
+
+
+@timed ()
 def product_name(dataframe, productid):
     """
     Returns the name of the product whose id is given.
+    If 'dataframe' is ProductCatalogue, the name is read from the catalogue.
     """
+    if isinstance (dataframe, ProductCatalogue):
+        return dataframe.name (productid)
+
     product = dataframe[dataframe["PRODUCTID"] == productid][["BRAND", "CATEGORY", "NAME", "PRODUCTID"]].values[
         0].tolist ()
     if product[0] == "None":
@@ -284,35 +744,85 @@ def product_name(dataframe, productid):
 
 
 ## POPULARITY-BASED
-def create_current_time(dataframe):
+
+
+@timed (memory=True)
+def create_bestseller_tables(prep_df):
+    """
+    Creates the bestseller tables of all day and time labels from prepared dataframe.
     """
-    Creates day and time label from related dataframe columns includes current day and time by using datetime module.
+    product_categories = prep_df.drop_duplicates ("PRODUCTID").set_index ("PRODUCTID")["CATEGORY"].sort_index ()
+    products = product_categories.index.values.astype (str)
+    category_codes, categories = pd.factorize (product_categories, sort=True)
+
+    sales_df = prep_df.groupby (["NEW_DAY_TIME", "CATEGORY", "PRODUCTID"], observed=True).size ().reset_index (name="COUNT")
+    label_codes, daytime_labels = pd.factorize (sales_df["NEW_DAY_TIME"], sort=True)
+    product_codes = pd.Categorical (sales_df["PRODUCTID"], categories=products).codes
+    counts = sales_df["COUNT"].values
+    n_categories = len (categories)
+
+    # Ranked products of every day and time label and category.
+    keys = label_codes * n_categories + category_codes[product_codes]
+    order = np.lexsort ((product_codes, -counts, keys))
+    same_indices = product_codes[order].astype (np.int32)
+    same_indptr = np.r_[0, np.cumsum (np.bincount (keys, minlength=len (daytime_labels) * n_categories))]
+
+    # Ranked categories of every day and time label by the count of their most sold products.
+    group_starts = same_indptr[:-1][np.diff (same_indptr) > 0]
+    top_keys = keys[order][group_starts]
+    top_counts = counts[order][group_starts]
+    top_labels, top_categories = top_keys // n_categories, top_keys % n_categories
+    top_order = np.lexsort ((top_categories, -top_counts, top_labels))
+
+    arrays = {"products": products,
+              "categories": np.asarray (categories).astype (str),
+              "product_category": category_codes.astype (np.int32),
+              "daytime_labels": np.asarray (daytime_labels).astype (str),
+              "same_indptr": same_indptr.astype (np.int64),
+              "same_indices": same_indices,
+              "diff_indptr": np.r_[0, np.cumsum (np.bincount (top_labels, minlength=len (daytime_labels)))],
+              "diff_indices": same_indices[group_starts][top_order],
+              "diff_categories": top_categories[top_order].astype (np.int32)}
+
+    return BestsellerTables (arrays)
+
+
+def read_bestseller_tables(prep_df, upgrade=False, store=None):
     """
-    current_hour = dt.datetime.now ().hour
-    current_day_index = dt.datetime.now ().weekday ()
-    day_map = {0: "MONDAY",
-               1: "TUESDAY",
-               2: "WEDNESDAY",
-               3: "THURSDAY",
-               4: "FRIDAY",
-               5: "SATURDAY",
-               6: "SUNDAY"}
-    current_day_name = day_map[current_day_index]
-    new_eventhours_range = dataframe.loc[dataframe["NEW_EVENTHOURS"] == current_hour, "NEW_EVENTHOURS_RANGE"].values[0]
-    day_time_label = "_".join ([current_day_name, new_eventhours_range])
-    return day_time_label
+    Converts given prepared dataframe to bestseller tables if 'upgrade' parameter is True or
+    reads bestseller tables from its npz format that is already exist if 'upgrade' parameter is False.
+    If 'store' parameter is given, the bestseller tables are saved to and loaded from the artifact store.
+    """
+    if store is not None and upgrade:
+        bestseller_tables = create_bestseller_tables (prep_df)
+        store.save ("bestseller_tables", bestseller_tables)
+    elif store is not None:
+        bestseller_tables = store.load ("bestseller_tables", BestsellerTables)
+    elif upgrade:
+        bestseller_tables = create_bestseller_tables (prep_df)
+        np.savez ("bestseller_tables.npz", **bestseller_tables.arrays)
+    else:
+        with np.load ("bestseller_tables.npz") as npz_file:
+            bestseller_tables = BestsellerTables ({name: npz_file[name] for name in npz_file.files})
 
+    return bestseller_tables
 
+
+@timed ()
 def bestseller_same_diff_cat_day_time(dataframe, product_id, diff_cat_rec_count=5, same_cat_rec_count=3):
     """
     According to the day and time of shopping, suggesting the most sold products in the same and different categories as the product added to the cart.
     The 'diff_cat_rec_count' parameter determines how many different categories of products will be recommended.
     The 'same_cat_rec_count' parameter determines how many different products will be recommended in the same category.
+    If 'dataframe' is BestsellerTables, the products are sliced from the precomputed tables.
     """
 
-    daytime_label = create_current_time (dataframe)
+    daytime_label = create_current_time ()
+
+    if isinstance (dataframe, BestsellerTables):
+        return dataframe.bestseller_products (product_id, daytime_label, diff_cat_rec_count, same_cat_rec_count)
 
-    agg_df = dataframe.groupby (["NEW_DAY_TIME", "CATEGORY", "PRODUCTID"]).agg ({"PRODUCTID": "count"})
+    agg_df = dataframe.groupby (["NEW_DAY_TIME", "CATEGORY", "PRODUCTID"], observed=True).agg ({"PRODUCTID": "count"})
     agg_df.rename (columns={"PRODUCTID": "COUNT"}, inplace=True)
     product_sales_df = agg_df.reset_index ().sort_values (by=["NEW_DAY_TIME", "CATEGORY", "COUNT"], ascending=False)
 
@@ -326,7 +836,7 @@ def bestseller_same_diff_cat_day_time(dataframe, product_id, diff_cat_rec_count=
     diff_bestseller_categories = [categories for categories in all_categories if categories != category_purchased]
     diff_category_product_rec = product_sales_df.loc[(product_sales_df["NEW_DAY_TIME"] == daytime_label)
                                                      & (product_sales_df["CATEGORY"]
-                                                        .isin (diff_bestseller_categories))].groupby ("CATEGORY").head (
+                                                        .isin (diff_bestseller_categories))].groupby ("CATEGORY", observed=True).head (
         1).sort_values (by="COUNT", ascending=False)["PRODUCTID"].tolist ()[:diff_cat_rec_count]
 
     # Creating the recommendation list which includes different products in the same categories with product added to cart, according to day and time label.
@@ -348,19 +858,31 @@ def create_sessionid_product_matrix(dataframe):
     Creates session id and product matrix for user-based collaborative recommendation.
     Focuses on whether the relevant product is in the session id or not.
     """
-    session_pro_df = dataframe.groupby (['SESSIONID', 'PRODUCTID'])['PRODUCTID'].count ().unstack ().fillna (
+    session_pro_df = dataframe.groupby (['SESSIONID', 'PRODUCTID'], observed=True)['PRODUCTID'].count ().unstack ().fillna (
         0).applymap (
         lambda x: 1 if x > 0 else 0)
 
     return session_pro_df
 
 
-def read_session_pro_df(dataframe, upgrade=False):
+def read_session_pro_df(dataframe, upgrade=False, sparse=False, store=None):
     """
     Converts given prepared dataframe to session id-product matrix if 'upgrade' parameter is True or
     reads session id-product matrix from its pickle format that is already exist if 'upgrade' parameter is False.
+    If 'sparse' parameter is True, the matrix is created and read as SparseSessionProductMatrix in npz format.
+    If 'store' parameter is given, the sparse matrix is saved to and loaded from the artifact store.
     """
-    if upgrade:
+    if store is not None and upgrade:
+        session_pro_df = create_sparse_session_product_matrix (dataframe)
+        store.save ("session_pro_matrix", session_pro_df)
+    elif store is not None:
+        session_pro_df = store.load ("session_pro_matrix", SparseSessionProductMatrix)
+    elif sparse and upgrade:
+        session_pro_df = create_sparse_session_product_matrix (dataframe)
+        session_pro_df.to_npz ("session_pro_matrix.npz")
+    elif sparse:
+        session_pro_df = SparseSessionProductMatrix.read_npz ("session_pro_matrix.npz")
+    elif upgrade:
         session_pro_df = create_sessionid_product_matrix (dataframe)
         session_pro_df.to_pickle ("session_pro_df.pickle")
     else:
@@ -369,24 +891,108 @@ def read_session_pro_df(dataframe, upgrade=False):
     return session_pro_df
 
 
-def user_based_recommendation(session_df, prep_df, shopping_cart=[], rec_count=5):
+@timed (memory=True)
+def create_session_neighborhood(prep_df):
+    """
+    Creates session neighborhood from prepared dataframe which includes posting lists of products
+    and products of session ids.
+    """
+    last_event_times = prep_df.groupby ("SESSIONID", observed=True)["EVENTTIME"].max ().sort_values (ascending=False,
+                                                                                       kind="mergesort")
+    session_positions = pd.Series (np.arange (len (last_event_times)), index=last_event_times.index)
+
+    session_codes = session_positions.loc[prep_df["SESSIONID"]].values
+    product_codes, products = pd.factorize (prep_df["PRODUCTID"], sort=True)
+
+    counts = sp.csr_matrix ((np.ones (len (session_codes), dtype=np.int32), (session_codes, product_codes)),
+                            shape=(len (session_positions), len (products)))
+    counts.sum_duplicates ()
+
+    return create_session_neighborhood_from_matrix (counts, last_event_times.index.values, products)
+
+
+def create_session_neighborhood_from_matrix(counts, sessions, products):
+    """
+    Creates session neighborhood from session id-product count matrix whose rows are ordered by
+    descending last event time of the session ids.
+    """
+    counts = sp.csr_matrix (counts)
+    counts.sort_indices ()
+
+    # Products of every session id by descending counts.
+    rows = np.repeat (np.arange (counts.shape[0]), np.diff (counts.indptr))
+    order = np.lexsort ((counts.indices, -counts.data, rows))
+    session_products = counts.indices[order].astype (np.int32)
+
+    # Session ids of every product by descending last event time.
+    postings = counts.tocsc ()
+    postings.sort_indices ()
+
+    arrays = {"products": np.asarray (products).astype (str),
+              "sessions": np.asarray (sessions).astype (str),
+              "session_indptr": counts.indptr.astype (np.int64),
+              "session_products": session_products,
+              "posting_indptr": postings.indptr.astype (np.int64),
+              "posting_sessions": postings.indices.astype (np.int32)}
+
+    return SessionNeighborhood (arrays)
+
+
+def read_session_neighborhood(prep_df, upgrade=False, store=None):
+    """
+    Converts given prepared dataframe to session neighborhood if 'upgrade' parameter is True or
+    reads session neighborhood from its npz format that is already exist if 'upgrade' parameter is False.
+    If 'store' parameter is given, the session neighborhood is saved to and loaded from the artifact store.
+    """
+    if store is not None and upgrade:
+        session_neighborhood = create_session_neighborhood (prep_df)
+        store.save ("session_neighborhood", session_neighborhood)
+    elif store is not None:
+        session_neighborhood = store.load ("session_neighborhood", SessionNeighborhood)
+    elif upgrade:
+        session_neighborhood = create_session_neighborhood (prep_df)
+        session_neighborhood.to_npz ("session_neighborhood.npz")
+    else:
+        session_neighborhood = SessionNeighborhood.read_npz ("session_neighborhood.npz")
+
+    return session_neighborhood
+
+
+@timed ()
+def user_based_recommendation(session_df, prep_df, shopping_cart=[], rec_count=5, neighbor_count=10,
+                              max_postings=1000):
     """
     Returns recommendation list which is created by using user based collaborative filtering approach.
     The 'shopping_cart' parameter represents the cart that is include added products.
     The 'rec_count' parameter determines maximum number of product will be recommended.
+    If 'session_df' is SessionNeighborhood, the products of the most similar 'neighbor_count' session ids
+    are recommended and 'prep_df' is not used.
     """
-    new_user_df = pd.DataFrame (index=["new_user"], columns=session_df.columns).fillna (0)
+    if isinstance (session_df, SessionNeighborhood):
+        return session_df.recommend (shopping_cart, rec_count, neighbor_count, max_postings=max_postings)
+
     my_cart_unique_list = list (set (shopping_cart))
-    my_cart_unique_list = [col for col in my_cart_unique_list if col in session_df.columns]
 
-    for product in my_cart_unique_list:
-        new_user_df[product] = 1
+    if isinstance (session_df, SparseSessionProductMatrix):
+        my_cart_unique_list = [col for col in my_cart_unique_list if col in session_df.product_positions]
+        cart_positions = [session_df.product_positions[product] for product in my_cart_unique_list]
+
+        # Finding the similar session id by counting the products of the cart in every session id.
+        session_scores = np.asarray (session_df.csc[:, cart_positions].sum (axis=1)).ravel ()
+        similar_user = session_df.sessions[session_scores.argmax ()]
+    else:
+        new_user_df = pd.DataFrame (index=["new_user"], columns=session_df.columns).fillna (0)
+        my_cart_unique_list = [col for col in my_cart_unique_list if col in session_df.columns]
+
+        for product in my_cart_unique_list:
+            new_user_df[product] = 1
 
-    # Finding the similar session id with the new created session id.
-    similar_user = session_df[my_cart_unique_list].T.sum ().sort_values (ascending=False).index[0]
+        # Finding the similar session id with the new created session id.
+        similar_user = session_df[my_cart_unique_list].T.sum ().sort_values (ascending=False).index[0]
 
     similar_user_products_df = prep_df.loc[
         prep_df["SESSIONID"] == similar_user, "PRODUCTID"].value_counts ().sort_values (ascending=False)
+    similar_user_products_df = similar_user_products_df[similar_user_products_df > 0]
 
     recommendation_user_based = [product for product in similar_user_products_df.index if
                                  product not in my_cart_unique_list][:rec_count]
@@ -400,22 +1006,36 @@ def create_user_product_matrix_item_based(prep_data):
     Creates session id-product matrix for item based collaborative recommendation.
     Focuses on how many of the relevant product is in the session ID.
     """
-    user_product = prep_data.groupby ("SESSIONID").agg ({"PRODUCTID": "value_counts"}) \
+    user_product = prep_data.groupby ("SESSIONID", observed=True).agg ({"PRODUCTID": "value_counts"}) \
         .rename (columns={"PRODUCTID": "COUNT"}) \
         .reset_index () \
         .sort_values (by=["SESSIONID", "COUNT"], ascending=False)
+    user_product = user_product[user_product["COUNT"] > 0]
 
-    user_product_matrix = pd.pivot_table (data=user_product, index="SESSIONID", columns="PRODUCTID", values="COUNT")
+    user_product_matrix = pd.pivot_table (data=user_product, index="SESSIONID", columns="PRODUCTID", values="COUNT",
+                                          observed=True)
 
     return user_product_matrix
 
 
-def read_user_product_matrix_df(prep_data, upgrade=False):
+def read_user_product_matrix_df(prep_data, upgrade=False, sparse=False, store=None):
     """
     Converts given prepared dataframe to user-product matrix if 'upgrade' parameter is True or
     reads user-product matrix from its pickle format that is already exist if 'upgrade' parameter is False.
+    If 'sparse' parameter is True, the matrix is created and read as SparseSessionProductMatrix in npz format.
+    If 'store' parameter is given, the sparse matrix is saved to and loaded from the artifact store.
     """
-    if upgrade:
+    if store is not None and upgrade:
+        user_product_matrix = create_sparse_session_product_matrix (prep_data, binary=False)
+        store.save ("user_product_matrix", user_product_matrix)
+    elif store is not None:
+        user_product_matrix = store.load ("user_product_matrix", SparseSessionProductMatrix)
+    elif sparse and upgrade:
+        user_product_matrix = create_sparse_session_product_matrix (prep_data, binary=False)
+        user_product_matrix.to_npz ("user_product_matrix.npz")
+    elif sparse:
+        user_product_matrix = SparseSessionProductMatrix.read_npz ("user_product_matrix.npz")
+    elif upgrade:
         user_product_matrix = create_user_product_matrix_item_based (prep_data)
         user_product_matrix.to_pickle ("user_product_matrix.pickle")
     else:
@@ -424,30 +1044,565 @@ def read_user_product_matrix_df(prep_data, upgrade=False):
     return user_product_matrix
 
 
+def sparse_corrwith(user_pro_matrix, product_id):
+    """
+    Returns the pearson correlation of given product with all products of sparse user-product matrix.
+    Like 'corrwith' of the dense user-product matrix, only the session ids which include both products are used.
+    """
+    csc = user_pro_matrix.csc
+    column = user_pro_matrix.product_positions[product_id]
+    rows = csc.indices[csc.indptr[column]:csc.indptr[column + 1]]
+    x = csc.data[csc.indptr[column]:csc.indptr[column + 1]].astype (float)
+
+    sub_matrix = user_pro_matrix.matrix[rows].astype (float)
+    both_matrix = sub_matrix.copy ()
+    both_matrix.data[:] = 1
+
+    n = np.asarray (both_matrix.sum (axis=0)).ravel ()
+    sum_x = both_matrix.T @ x
+    sum_x2 = both_matrix.T @ (x ** 2)
+    sum_y = np.asarray (sub_matrix.sum (axis=0)).ravel ()
+    sum_y2 = np.asarray (sub_matrix.multiply (sub_matrix).sum (axis=0)).ravel ()
+    sum_xy = sub_matrix.T @ x
+
+    with np.errstate (divide="ignore", invalid="ignore"):
+        corr = (n * sum_xy - sum_x * sum_y) / np.sqrt ((n * sum_x2 - sum_x ** 2) * (n * sum_y2 - sum_y ** 2))
+    corr[n < 2] = np.nan
+
+    return pd.Series (corr, index=user_pro_matrix.products)
+
+
+def product_correlations(user_pro_matrix, product_id):
+    """
+    Returns the correlations of given product with other products by descending order.
+    The product itself and the products that can not be correlated are removed.
+    """
+    if isinstance (user_pro_matrix, SparseSessionProductMatrix):
+        product_correlated = sparse_corrwith (user_pro_matrix, product_id)
+    else:
+        product_correlated = user_pro_matrix.corrwith (user_pro_matrix[product_id])
+
+    product_correlated = product_correlated.loc[product_correlated.index != product_id].dropna ()
+
+    return product_correlated.sort_values (ascending=False)
+
+
+def _top_k_per_column(rows, cols, scores, neighbors, top_scores):
+    """
+    Writes the rows with highest scores of every column to 'neighbors' and 'top_scores' arrays.
+    """
+    k = neighbors.shape[1]
+    order = np.lexsort ((rows, -scores, cols))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    group_starts = np.r_[0, np.flatnonzero (np.diff (cols)) + 1]
+    ranks = np.arange (len (cols)) - np.repeat (group_starts, np.diff (np.r_[group_starts, len (cols)]))
+
+    top = ranks < k
+    neighbors[cols[top], ranks[top]] = rows[top]
+    top_scores[cols[top], ranks[top]] = scores[top]
+
+
+def _sorted_coo(matrix):
+    """
+    Returns the matrix in COO format whose entries are sorted by row and column.
+    """
+    matrix = matrix.tocsr ()
+    matrix.sort_indices ()
+    return matrix.tocoo ()
+
+
+@timed (memory=True)
+def create_item_similarity_table(user_pro_matrix, k=20, method="pearson", min_support=2, batch_size=1024,
+                                 columns=None, norms=None):
+    """
+    Creates the top 'k' item similarity table of all products from sparse user-product matrix.
+    The similarities are computed with sparse matrix products for batches of 'batch_size' products.
+    The 'method' parameter can be 'pearson' or 'cosine'. Pearson correlation is computed like 'corrwith' of
+    the dense user-product matrix by using only the session ids which include both products.
+    The 'min_support' parameter determines the minimum number of session ids which include both products.
+    If 'columns' parameter is given, only the rows of these product positions are computed.
+    If 'norms' parameter is given, it is used as the norms of the products for cosine similarity.
+    """
+    x_matrix = user_pro_matrix.csc.astype (float)
+    both_matrix = x_matrix.copy ()
+    both_matrix.data[:] = 1
+    x2_matrix = x_matrix.multiply (x_matrix).tocsc ()
+    x_matrix_t, both_matrix_t, x2_matrix_t = x_matrix.T.tocsr (), both_matrix.T.tocsr (), x2_matrix.T.tocsr ()
+    if norms is None:
+        norms = np.sqrt (np.asarray (x2_matrix.sum (axis=0)).ravel ())
+
+    n_products = x_matrix.shape[1]
+    columns = np.arange (n_products) if columns is None else np.asarray (columns, dtype=np.int64)
+    neighbors = np.full ((n_products, k), -1, dtype=np.int32)
+    scores = np.full ((n_products, k), np.nan, dtype=np.float32)
+    for start in range (0, len (columns), batch_size):
+        batch = columns[start:start + batch_size]
+
+        # Products of the batch are columns, all products are rows. All sums have the sparsity pattern of 'n'.
+        n = _sorted_coo (both_matrix_t @ both_matrix[:, batch])
+        sum_xy = _sorted_coo (x_matrix_t @ x_matrix[:, batch]).data
+        rows, cols = n.row, batch[n.col]
+
+        if method == "cosine":
+            batch_scores = sum_xy / (norms[rows] * norms[cols])
+        else:
+            sum_x = _sorted_coo (both_matrix_t @ x_matrix[:, batch]).data
+            sum_x2 = _sorted_coo (both_matrix_t @ x2_matrix[:, batch]).data
+            sum_y = _sorted_coo (x_matrix_t @ both_matrix[:, batch]).data
+            sum_y2 = _sorted_coo (x2_matrix_t @ both_matrix[:, batch]).data
+            with np.errstate (divide="ignore", invalid="ignore"):
+                batch_scores = (n.data * sum_xy - sum_x * sum_y) / \
+                               np.sqrt ((n.data * sum_x2 - sum_x ** 2) * (n.data * sum_y2 - sum_y ** 2))
+
+        valid = (n.data >= min_support) & (rows != cols) & ~np.isnan (batch_scores)
+        _top_k_per_column (rows[valid], cols[valid], batch_scores[valid], neighbors, scores)
+
+    return ItemSimilarityTable (user_pro_matrix.products, neighbors, scores)
+
+
+def read_item_similarity_table(user_pro_matrix, method="pearson", upgrade=False, store=None):
+    """
+    Converts given sparse user-product matrix to item similarity table if 'upgrade' parameter is True or
+    reads item similarity table from its npz format that is already exist if 'upgrade' parameter is False.
+    If 'store' parameter is given, the similarity table is saved to and loaded from the artifact store.
+    """
+    if store is not None and upgrade:
+        similarity_table = create_item_similarity_table (user_pro_matrix, method=method)
+        store.save ("item_similarity_table", similarity_table)
+    elif store is not None:
+        similarity_table = store.load ("item_similarity_table", ItemSimilarityTable)
+    elif upgrade:
+        similarity_table = create_item_similarity_table (user_pro_matrix, method=method)
+        similarity_table.to_npz ("item_similarity_table.npz")
+    else:
+        similarity_table = ItemSimilarityTable.read_npz ("item_similarity_table.npz")
+
+    return similarity_table
+
+
+@timed ()
 def item_based_recommendation(user_pro_matrix, product_id, threshold=0.5, rec_count=4):
     """
     Returns recommendation list which is created by using item based collaborative filtering approach.
     The 'threshold' parameter represents the threshold for correlation of products.
     The 'rec_count' parameter determines maximum number of product will be recommended.
+    If 'user_pro_matrix' is ItemSimilarityTable or ItemEmbeddingIndex, the similar products are read from it.
     """
-    user_pro_matrix[product_id].sort_values (ascending=False)
-    try:
-        product_correlated = user_pro_matrix.corrwith (user_pro_matrix[product_id]).sort_values (ascending=False)
+    if isinstance (user_pro_matrix, (ItemSimilarityTable, ItemEmbeddingIndex)):
+        candidates = user_pro_matrix.similar_products (product_id, threshold, 5)
+    else:
+        product_correlated = product_correlations (user_pro_matrix, product_id)
+        candidates = product_correlated[product_correlated > threshold].head (5).index.tolist ()
 
-        # Removing the product added to cart from recommendation list.
-        product_correlated = product_correlated.loc[product_correlated.index != product_id]
+    # All candidates are recommended if they are fewer than 'rec_count'.
+    if len (candidates) < rec_count:
+        increment ("fallbacks_total", reason="item_based_short_candidates")
 
-        # Finding the correlation of products.
-        product_correlated.dropna (inplace=True)
-        product_correlated = product_correlated.reset_index ()
-        product_correlated.rename (columns={0: "CORR"}, inplace=True)
+    return random.sample (candidates, min (rec_count, len (candidates)))
 
-        item_based_rec_df = product_correlated[product_correlated["CORR"] > threshold].head (5)
 
-        item_based_recommendation_list = random.sample (set (item_based_rec_df["PRODUCTID"]), rec_count)
+## ITEM EMBEDDINGS
+def _normalize_rows(vectors):
+    """
+    Returns the rows of the matrix with unit length, rows of zero length are kept as zeros.
+    """
+    norms = np.linalg.norm (vectors, axis=1)
+    return (vectors / np.where (norms > 0, norms, 1)[:, None]).astype (np.float32)
 
-    except ValueError:
-        # item_based_recommendation_list = []
-        item_based_recommendation_list = random.sample (set (item_based_rec_df["PRODUCTID"]), len (item_based_rec_df))
 
-    return item_based_recommendation_list
+def _als_solve(matrix, fixed, factors, regularization, cg_steps=3):
+    """
+    Updates the factors of the rows of 'matrix' by conjugate gradient steps of implicit ALS while the factors
+    of its columns are fixed. The confidence of a stored entry is '1 + data' and its preference is 1,
+    the preference of the other entries is 0 with confidence 1. All rows are solved together with sparse products,
+    so a step costs as much as a pass over the stored entries.
+    """
+    rows = np.repeat (np.arange (matrix.shape[0]), np.diff (matrix.indptr))
+    gram = fixed.T @ fixed + regularization * np.eye (fixed.shape[1], dtype=fixed.dtype)
+
+    def product(x):
+        # (F^T C_u F + regularization * I) x of every row u, where F^T F is shared by the rows.
+        dots = np.einsum ("ij,ij->i", x[rows], fixed[matrix.indices])
+        weighted = sp.csr_matrix ((matrix.data * dots, matrix.indices, matrix.indptr), shape=matrix.shape)
+        return x @ gram + weighted @ fixed
+
+    targets = sp.csr_matrix ((matrix.data + 1, matrix.indices, matrix.indptr), shape=matrix.shape) @ fixed
+    residual = targets - product (factors)
+    direction = residual.copy ()
+    norms = np.einsum ("ij,ij->i", residual, residual)
+    with np.errstate (divide="ignore", invalid="ignore"):
+        for _ in range (cg_steps):
+            step = product (direction)
+            rate = np.nan_to_num (norms / np.einsum ("ij,ij->i", direction, step), posinf=0, neginf=0)
+            factors = factors + rate[:, None] * direction
+            residual -= rate[:, None] * step
+            new_norms = np.einsum ("ij,ij->i", residual, residual)
+            direction = residual + np.nan_to_num (new_norms / norms, posinf=0, neginf=0)[:, None] * direction
+            norms = new_norms
+
+    return factors.astype (fixed.dtype)
+
+
+@timed (memory=True)
+def create_item_embeddings(user_pro_matrix, dim=64, method="svd", iterations=10, regularization=0.1, alpha=10.0,
+                           seed=42):
+    """
+    Returns the embedding vectors of the products of sparse user-product matrix with unit length.
+    If 'method' is "svd", the vectors are the right singular vectors of the matrix of log scaled counts
+    scaled by their singular values, so their cosine similarity approximates the cosine similarity of the products.
+    If 'method' is "als", the vectors are the item factors of implicit ALS with 'iterations' iterations,
+    'regularization' and confidence '1 + alpha * count'.
+    """
+    matrix = user_pro_matrix.matrix.astype (np.float32)
+    dim = max (min (dim, min (matrix.shape) - 1), 1)
+    rng = np.random.default_rng (seed)
+
+    if method == "svd":
+        from scipy.sparse.linalg import svds
+
+        matrix.data = np.log1p (matrix.data)
+        _, singular_values, vt = svds (matrix, k=dim, v0=rng.random (min (matrix.shape)))
+        return _normalize_rows (vt.T * singular_values)
+    elif method == "als":
+        matrix.data *= alpha
+        matrix_t = matrix.T.tocsr ()
+        session_factors = rng.normal (0, 0.01, (matrix.shape[0], dim)).astype (np.float32)
+        item_factors = rng.normal (0, 0.01, (matrix.shape[1], dim)).astype (np.float32)
+        for _ in range (iterations):
+            session_factors = _als_solve (matrix, item_factors, session_factors, regularization)
+            item_factors = _als_solve (matrix_t, session_factors, item_factors, regularization)
+        return _normalize_rows (item_factors)
+
+    raise ValueError ("Unknown embedding method '{}'.".format (method))
+
+
+def _spherical_kmeans(vectors, n_clusters, iterations=10, sample_size=None, batch_size=8192, seed=42):
+    """
+    Returns the centroids of unit length vectors clustered by cosine similarity and the cluster of every vector.
+    The centroids are trained on a random sample of 'sample_size' vectors, 64 vectors per cluster by default,
+    and all vectors are assigned to their nearest centroid at the end.
+    """
+    rng = np.random.default_rng (seed)
+    n_clusters = max (min (n_clusters, len (vectors)), 1)
+    sample_size = min (sample_size or 64 * n_clusters, len (vectors))
+    sample = vectors[np.sort (rng.choice (len (vectors), sample_size, replace=False))]
+    centroids = sample[rng.choice (sample_size, n_clusters, replace=False)]
+
+    def assign(points):
+        return np.concatenate ([np.argmax (points[start:start + batch_size] @ centroids.T, axis=1)
+                                for start in range (0, len (points), batch_size)] or [np.array ([], dtype=np.int64)])
+
+    for _ in range (iterations):
+        clusters = assign (sample)
+        sums = np.zeros_like (centroids)
+        np.add.at (sums, clusters, sample)
+        # Empty clusters keep their centroids.
+        empty = np.bincount (clusters, minlength=n_clusters) == 0
+        centroids = np.where (empty[:, None], centroids, _normalize_rows (sums))
+
+    return centroids, assign (vectors)
+
+
+@timed (memory=True)
+def create_item_embedding_index(user_pro_matrix, dim=64, method="svd", n_lists=None, n_probe=8, seed=42, **params):
+    """
+    Creates the item embedding index of all products from sparse user-product matrix. The vectors are created by
+    'create_item_embeddings' with given 'dim', 'method' and other parameters, and clustered into 'n_lists' lists,
+    the square root of the number of products by default. 'n_probe' is the default number of probed lists.
+    """
+    vectors = create_item_embeddings (user_pro_matrix, dim=dim, method=method, seed=seed, **params)
+    n_lists = n_lists or max (int (np.sqrt (len (vectors))), 1)
+    centroids, clusters = _spherical_kmeans (vectors, n_lists, seed=seed)
+
+    order = np.argsort (clusters, kind="stable")
+    return ItemEmbeddingIndex ({"products": np.asarray (user_pro_matrix.products).astype (str),
+                                "vectors": vectors,
+                                "centroids": centroids,
+                                "list_indptr": np.r_[0, np.cumsum (np.bincount (clusters, minlength=len (centroids)))],
+                                "list_items": order.astype (np.int32),
+                                "n_probe": np.array (n_probe)})
+
+
+def read_item_embedding_index(user_pro_matrix, method="svd", upgrade=False, store=None):
+    """
+    Converts given sparse user-product matrix to item embedding index if 'upgrade' parameter is True or
+    reads item embedding index from its npz format that is already exist if 'upgrade' parameter is False.
+    If 'store' parameter is given, the index is saved to and loaded from the artifact store.
+    """
+    if store is not None and upgrade:
+        embedding_index = create_item_embedding_index (user_pro_matrix, method=method)
+        # The method is recorded, so the index is created again in the same way when the artifacts are refreshed.
+        store.save_arrays ("item_embeddings", embedding_index.arrays, kind="ItemEmbeddingIndex", meta={"method": method})
+    elif store is not None:
+        embedding_index = store.load ("item_embeddings", ItemEmbeddingIndex)
+    elif upgrade:
+        embedding_index = create_item_embedding_index (user_pro_matrix, method=method)
+        np.savez ("item_embeddings.npz", **embedding_index.arrays)
+    else:
+        with np.load ("item_embeddings.npz") as npz_file:
+            embedding_index = ItemEmbeddingIndex ({name: npz_file[name] for name in npz_file.files})
+
+    return embedding_index
+
+
+## RECOMMENDATION INDEX
+def _create_csr_lists(lists, positions):
+    """
+    Converts the list of product lists to 'indptr' and 'indices' arrays by using product positions.
+    """
+    indptr = np.zeros (len (lists) + 1, dtype=np.int64)
+    indices = []
+    for i, product_list in enumerate (lists):
+        product_positions = positions.positions (product_list)
+        product_positions = product_positions[product_positions >= 0]
+        indices.extend (product_positions.tolist ())
+        indptr[i + 1] = indptr[i] + len (product_positions)
+
+    return indptr, np.array (indices, dtype=np.int32)
+
+
+@timed (memory=True)
+def create_recommendation_index(prep_df, rules_df, user_pro_matrix, rec_count=10, item_based_threshold=0.5):
+    """
+    Creates the recommendation index which includes association rules, item based and popularity based
+    recommendations of all products and all day and time labels.
+    """
+    arrays = dict (create_bestseller_tables (prep_df).arrays)
+    products = arrays["products"]
+    positions = ProductPositions (products)
+
+    # Association rules and item based recommendations of every product.
+    if not isinstance (rules_df, RuleIndex):
+        rules_df = RuleIndex.from_rules (rules_df)
+    arl_lists = [arl_recommender (rules_df, product, rec_count) for product in products]
+    arrays["arl_indptr"], arrays["arl_indices"] = _create_csr_lists (arl_lists, positions)
+
+    item_lists = []
+    for product in products:
+        if isinstance (user_pro_matrix, (ItemSimilarityTable, ItemEmbeddingIndex)):
+            item_lists.append (user_pro_matrix.similar_products (product, item_based_threshold, 5))
+            continue
+        product_correlated = product_correlations (user_pro_matrix, product)
+        item_lists.append (product_correlated[product_correlated > item_based_threshold].head (5).index.tolist ())
+    arrays["item_indptr"], arrays["item_indices"] = _create_csr_lists (item_lists, positions)
+
+    return RecommendationIndex (arrays)
+
+
+def read_recommendation_index(prep_df=None, rules_df=None, user_pro_matrix=None, upgrade=False, store=None):
+    """
+    Creates the recommendation index from the prepared dataframe, association rules and user-product matrix
+    if 'upgrade' parameter is True or reads the recommendation index from its npz format that is already exist
+    if 'upgrade' parameter is False.
+    If 'store' parameter is given, the recommendation index is saved to and loaded from the artifact store.
+    """
+    if store is not None and upgrade:
+        rec_index = create_recommendation_index (prep_df, rules_df, user_pro_matrix)
+        store.save ("recommendation_index", rec_index)
+    elif store is not None:
+        rec_index = store.load ("recommendation_index", RecommendationIndex)
+    elif upgrade:
+        rec_index = create_recommendation_index (prep_df, rules_df, user_pro_matrix)
+        np.savez ("recommendation_index.npz", **rec_index.arrays)
+    else:
+        with np.load ("recommendation_index.npz") as npz_file:
+            rec_index = RecommendationIndex ({name: npz_file[name] for name in npz_file.files})
+
+    return rec_index
+
+
+## BATCH RECOMMENDATION
+# The artifacts which are shared by the batch recommendation worker processes.
+_batch_artifacts = None
+
+
+def _init_batch_worker(artifacts):
+    global _batch_artifacts
+    _batch_artifacts = artifacts
+
+
+def _expand_lists(indptr, indices, list_rows):
+    """
+    Returns rows, items and ranks of the lists of every row. The row 'i' gets the list at 'list_rows[i]'
+    of 'indptr' and 'indices' arrays, rows whose list is -1 get nothing.
+    """
+    rows = np.flatnonzero (list_rows >= 0)
+    starts, sizes = indptr[list_rows[rows]], np.diff (indptr)[list_rows[rows]]
+    ranks = np.arange (sizes.sum ()) - np.repeat (np.cumsum (sizes) - sizes, sizes)
+    return np.repeat (rows, sizes), indices[np.repeat (starts, sizes) + ranks], ranks
+
+
+def _positions_of(products, product_ids):
+    """
+    Returns the positions of product ids in sorted 'products' array, the missing product ids get -1.
+    """
+    positions = np.searchsorted (products, product_ids)
+    positions[positions == len (products)] = 0
+    return np.where (products[positions] == product_ids, positions, -1) if len (products) else positions - 1
+
+
+def _ranked_lists(rows, items, keys, n_rows):
+    """
+    Returns rows, items and ranks of the lists of every row ordered by the keys. Repeated items of a row are removed,
+    so the ranks are the positions of the items in the list of the row.
+    """
+    indptr, items, _ = top_per_row (rows, items, keys, len (rows), n_rows)
+    rows = np.repeat (np.arange (n_rows), np.diff (indptr))
+    return rows, items, np.arange (len (items)) - indptr[rows]
+
+
+def _hybrid_rank_rows(lists, bestseller_tables, carts, daytime_label, rec_count=10, weights=None, method="rrf",
+                      rrf_k=60, category_cap=3):
+    """
+    Returns 'indptr' and product positions of 'rec_count' products of every cart by merging the candidate lists,
+    which are given as a dictionary of approach names and rows, items and ranks arrays.
+    It is the vectorized 'hybrid_rank' of many carts: the same scores, category cap and popularity fallback are used.
+    """
+    weights = dict (HYBRID_WEIGHTS, **(weights or {}))
+    n_carts, n_products = carts.shape
+
+    keys, scores = [np.array ([], dtype=np.int64)], [np.array ([], dtype=float)]
+    for approach, (rows, items, ranks) in lists.items ():
+        if method == "rrf":
+            scores.append (weights.get (approach, 1.0) / (rrf_k + ranks + 1))
+        else:
+            lengths = np.bincount (rows, minlength=n_carts)[rows]
+            scores.append (weights.get (approach, 1.0) * (1 - ranks / np.maximum (lengths, 1)))
+        keys.append (rows * n_products + items)
+
+    # Scores of the same product in different lists of a cart are summed.
+    keys, inverse = np.unique (np.concatenate (keys), return_inverse=True)
+    scores = np.bincount (inverse, weights=np.concatenate (scores), minlength=len (keys))
+
+    # Most sold products follow the candidates of every cart in popularity order.
+    depth = rec_count + np.diff (carts.indptr).max (initial=0) + np.bincount (keys // n_products).max (initial=0)
+    popular = bestseller_tables.popular_positions (daytime_label, depth=depth)[:depth]
+    popular_keys = np.repeat (np.arange (n_carts, dtype=np.int64), len (popular)) * n_products + \
+                   np.tile (popular, n_carts)
+    new = ~np.isin (popular_keys, keys)
+    popular_scores = -np.tile (np.arange (len (popular), dtype=float), n_carts)
+    tiers = np.r_[np.zeros (len (keys)), np.ones (new.sum ())]
+    keys, scores = np.r_[keys, popular_keys[new]], np.r_[scores, popular_scores[new]]
+    rows, items = keys // n_products, keys % n_products
+
+    not_in_cart = ~matrix_contains (carts, rows, items)
+    rows, items, scores, tiers = rows[not_in_cart], items[not_in_cart], scores[not_in_cart], tiers[not_in_cart]
+    order = np.lexsort ((items, -scores, tiers, rows))
+    rows, items, tiers = rows[order], items[order], tiers[order]
+
+    # The rank of every product in its category in the cart, products after the cap are used only if needed.
+    categories = bestseller_tables.arrays["product_category"][items].astype (np.int64)
+    by_category = np.lexsort ((categories, rows))
+    groups = (rows * (categories.max (initial=0) + 1) + categories)[by_category]
+    starts = np.flatnonzero (np.r_[True, groups[1:] != groups[:-1]]) if len (groups) else groups
+    category_ranks = np.empty (len (items), dtype=np.int64)
+    category_ranks[by_category] = np.arange (len (items)) - np.repeat (starts, np.diff (np.r_[starts, len (items)]))
+    order = np.lexsort ((category_ranks >= category_cap, rows))
+    rows, items, tiers = rows[order], items[order], tiers[order]
+
+    counts = np.bincount (rows, minlength=n_carts)
+    top = np.arange (len (rows)) - np.repeat (np.cumsum (counts) - counts, counts) < rec_count
+    rows, items, tiers = rows[top], items[top], tiers[top]
+    counts = np.bincount (rows, minlength=n_carts)
+
+    fallbacks = np.count_nonzero (np.bincount (rows, weights=tiers, minlength=n_carts))
+    if fallbacks:
+        increment ("fallbacks_total", fallbacks, reason="popularity")
+    if (counts < rec_count).any ():
+        increment ("short_recommendations_total", int ((counts < rec_count).sum ()))
+
+    return np.r_[0, np.cumsum (counts)], items
+
+
+def _recommend_batch_chunk(task):
+    shopping_carts, daytime_label, rec_count, ranking = task
+    rec_index, session_neighborhood, rules = _batch_artifacts
+    products, positions = rec_index.products, rec_index.product_positions
+    n_carts = len (shopping_carts)
+    carts = create_cart_matrix (shopping_carts, positions, len (products))
+
+    # The last product of every cart is the product added to cart.
+    added = np.full (n_carts, -1, dtype=np.int64)
+    not_empty = np.array ([len (cart) > 0 for cart in shopping_carts], dtype=bool)
+    added[not_empty] = positions.positions (cart[-1] for cart in shopping_carts if len (cart))
+    unique_added, added_rows = np.unique (added[added >= 0], return_inverse=True)
+    list_rows = np.full (n_carts, -1, dtype=np.int64)
+    list_rows[added >= 0] = added_rows
+
+    # Popularity based recommendations of every added product.
+    best_indptr, best_indices = _create_csr_lists (
+        [rec_index.bestseller_products (products[product], daytime_label) for product in unique_added], positions)
+    lists = {"bestseller": _ranked_lists (*_expand_lists (best_indptr, best_indices, list_rows), n_carts)}
+
+    # Association rules of the cart first, then the rules of the added product.
+    arl_rows, arl_items, arl_ranks = _expand_lists (rec_index.arrays["arl_indptr"], rec_index.arrays["arl_indices"],
+                                                    added)
+    arl_rows, arl_items, arl_keys = arl_rows[arl_ranks < 5], arl_items[arl_ranks < 5], 5 + arl_ranks[arl_ranks < 5]
+    if rules is not None:
+        cart_indptr, cart_products = rules.recommend_cart_batch (shopping_carts, 5)
+        cart_rows = np.repeat (np.arange (n_carts), np.diff (cart_indptr))
+        cart_ranks = np.arange (len (cart_rows)) - np.repeat (cart_indptr[:-1], np.diff (cart_indptr))
+        cart_items = _positions_of (products, cart_products)
+        found = cart_items >= 0
+        arl_rows = np.r_[cart_rows[found], arl_rows]
+        arl_items = np.r_[cart_items[found], arl_items]
+        arl_keys = np.r_[cart_ranks[found], arl_keys]
+    not_in_cart = ~matrix_contains (carts, arl_rows, arl_items)
+    arl_rows, arl_items, arl_ranks = _ranked_lists (arl_rows[not_in_cart], arl_items[not_in_cart],
+                                                    arl_keys[not_in_cart], n_carts)
+    lists["arl"] = arl_rows[arl_ranks < 5], arl_items[arl_ranks < 5], arl_ranks[arl_ranks < 5]
+
+    # User based recommendations of the whole cart.
+    user_indptr, user_products = session_neighborhood.recommend_batch (shopping_carts)
+    user_rows = np.repeat (np.arange (n_carts), np.diff (user_indptr))
+    user_ranks = np.arange (len (user_rows)) - np.repeat (user_indptr[:-1], np.diff (user_indptr))
+    user_items = _positions_of (products, user_products)
+    found = user_items >= 0
+    lists["user"] = _ranked_lists (user_rows[found], user_items[found], user_ranks[found], n_carts)
+
+    # Item based recommendations are the correlated products of the added product.
+    lists["item"] = _ranked_lists (*_expand_lists (rec_index.arrays["item_indptr"], rec_index.arrays["item_indices"],
+                                                   added), n_carts)
+
+    indptr, items = _hybrid_rank_rows (lists, rec_index, carts, daytime_label, rec_count, **ranking)
+    return [products[items[indptr[i]:indptr[i + 1]]].tolist () for i in range (n_carts)]
+
+
+@timed ()
+def recommend_batch(shopping_carts, rec_index, session_neighborhood, rules=None, daytime_label=None, rec_count=10,
+                    weights=None, method="rrf", rrf_k=60, category_cap=3, n_jobs=1, chunk_size=10000):
+    """
+    Returns the hybrid recommendations of many carts as a dictionary of session ids and recommendation lists.
+    The 'shopping_carts' parameter is a dictionary or a list of session id and cart pairs,
+    the last product of a cart is the product added to cart.
+    Like the app, the candidate lists of all approaches are merged by 'hybrid_rank' with given 'weights', 'method',
+    'rrf_k' and 'category_cap' parameters and completed with the most sold products of the day and time label.
+    If 'rules' parameter is given as RuleIndex, the rules whose antecedents are included by the whole cart are used first.
+    The carts are recommended in chunks of 'chunk_size' carts by 'n_jobs' processes.
+    """
+    if method not in ("rrf", "weighted"):
+        raise ValueError ("Unknown ranking method '{}'.".format (method))
+
+    pairs = list (shopping_carts.items ()) if isinstance (shopping_carts, dict) else list (shopping_carts)
+    session_ids = [session_id for session_id, _ in pairs]
+    carts = [list (shopping_cart) for _, shopping_cart in pairs]
+    if daytime_label is None:
+        daytime_label = create_current_time ()
+
+    ranking = {"weights": weights, "method": method, "rrf_k": rrf_k, "category_cap": category_cap}
+    tasks = [(carts[start:start + chunk_size], daytime_label, rec_count, ranking)
+             for start in range (0, len (carts), chunk_size)]
+
+    recommendations = []
+    artifacts = (rec_index, session_neighborhood, rules)
+    if n_jobs > 1 and len (tasks) > 1:
+        with ProcessPoolExecutor (n_jobs, initializer=_init_batch_worker, initargs=(artifacts,)) as executor:
+            for chunk_recommendations in executor.map (_recommend_batch_chunk, tasks):
+                recommendations += chunk_recommendations
+    else:
+        _init_batch_worker (artifacts)
+        for task in tasks:
+            recommendations += _recommend_batch_chunk (task)
+        _init_batch_worker (None)
+
+    return dict (zip (session_ids, recommendations))
@@ -0,0 +1,568 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from funcs import DAY_TIME_LABELS, BestsellerTables, ProductPositions, RuleIndex, ItemSimilarityTable, \
+    RecommendationIndex, SparseSessionProductMatrix, add_time_features, arl_recommender, concat_chunks, \
+    create_item_embedding_index, create_item_similarity_table, create_session_neighborhood_from_matrix, _create_csr_lists
+
+# Number of day and time labels, the daytime columns of a product are 'product * DAYTIME_COUNT + label code'.
+DAYTIME_COUNT = len (DAY_TIME_LABELS)
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 10 ** 9
+
+# The weights are rebased when the weight of a session id is bigger than 2 ** MAX_WEIGHT_EXPONENT.
+MAX_WEIGHT_EXPONENT = 256
+
+
+class RefreshState:
+    """
+    Creates the RefreshState class which keeps the counts that the artifacts are created from, so the artifacts
+    can be updated with a new batch of events instead of being created from the whole history.
+    Session ids are rows of the session id-product count matrix and the session id-daytime count matrix,
+    every session id has a weight which is used for the day and time counts, product counts and pair counts.
+    If 'half_life' is not 0, the weight of a session id is doubled for every 'half_life' nanoseconds
+    between its last event time and 'reference_time', so old session ids decay relatively to new ones.
+    If 'window' is not 0, the session ids whose last event time is older than 'window' nanoseconds
+    from the last event are evicted.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.products = arrays["products"]
+        self.categories = arrays["categories"]
+        self.sessions = arrays["sessions"]
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls (arrays)
+
+    def _matrix(self, name, shape):
+        return sp.csr_matrix ((self.arrays[name + "_data"], self.arrays[name + "_indices"],
+                               self.arrays[name + "_indptr"]), shape=shape)
+
+    def count_matrix(self):
+        """
+        Returns session id-product count matrix.
+        """
+        return self._matrix ("count", (len (self.sessions), len (self.products)))
+
+    def daytime_matrix(self):
+        """
+        Returns session id-daytime count matrix whose columns are 'product * DAYTIME_COUNT + label code'.
+        """
+        return self._matrix ("daytime", (len (self.sessions), len (self.products) * DAYTIME_COUNT))
+
+    def pair_matrix(self):
+        """
+        Returns the weighted counts of the session ids which include both products, for session ids
+        that include more than 1 kind of product.
+        """
+        return self._matrix ("pair", (len (self.products), len (self.products)))
+
+    def session_weights(self, times):
+        """
+        Returns the weights of the session ids whose last event times are given.
+        """
+        half_life = int (self.arrays["half_life"])
+        if half_life == 0:
+            return np.ones (len (times))
+        return np.exp2 ((np.asarray (times) - int (self.arrays["reference_time"])) / half_life)
+
+
+def create_refresh_state(half_life_days=None, window_days=None, metric="support", min_support=0.002,
+                         min_threshold=0.002):
+    """
+    Creates an empty refresh state. The 'half_life_days' parameter determines the time decay of the session ids
+    and the 'window_days' parameter determines the time window of the session ids that are kept.
+    The 'metric', 'min_support' and 'min_threshold' parameters are used for the association rules like 'create_rules'.
+    """
+    empty_csr = {"_indptr": np.zeros (1, dtype=np.int64), "_indices": np.array ([], dtype=np.int64)}
+    arrays = {"products": np.array ([], dtype=str),
+              "categories": np.array ([], dtype=str),
+              "product_category": np.array ([], dtype=np.int32),
+              "sessions": np.array ([], dtype=str),
+              "session_times": np.array ([], dtype=np.int64),
+              "session_weights": np.array ([], dtype=np.float64),
+              "daytime_counts": np.zeros ((0, DAYTIME_COUNT)),
+              "product_weights": np.array ([], dtype=np.float64),
+              "transaction_weight": np.array (0.0),
+              "reference_time": np.array (0, dtype=np.int64),
+              "half_life": np.array (int ((half_life_days or 0) * NANOSECONDS_PER_DAY), dtype=np.int64),
+              "window": np.array (int ((window_days or 0) * NANOSECONDS_PER_DAY), dtype=np.int64),
+              "metric": np.array (metric),
+              "min_support": np.array (min_support),
+              "min_threshold": np.array (min_threshold)}
+    for name, dtype in [("count", np.int32), ("daytime", np.int32), ("pair", np.float64)]:
+        arrays.update ({name + key: value for key, value in empty_csr.items ()})
+        arrays[name + "_data"] = np.array ([], dtype=dtype)
+
+    return RefreshState (arrays)
+
+
+def prepare_event_batch(dataframe):
+    """
+    Returns the batch of events with day and time features. The events which do not have session id, product id,
+    event time or category are removed. Prepared dataframes are used as they are.
+    """
+    dataframe = dataframe.rename (columns=str.upper)
+    if "NEW_DAY_TIME" not in dataframe.columns:
+        add_time_features (dataframe)
+
+    return dataframe.dropna (subset=["SESSIONID", "PRODUCTID", "EVENTTIME", "CATEGORY", "NEW_DAY_TIME"])
+
+
+def _event_times(dataframe):
+    event_time = dataframe["EVENTTIME"]
+    if event_time.dt.tz is not None:
+        event_time = event_time.dt.tz_convert (None)
+    return event_time.values.astype ("datetime64[ns]").view (np.int64)
+
+
+def _remap_product_columns(matrix, remap, n_products, width=1):
+    """
+    Returns the matrix whose product columns are moved to new positions given by 'remap'.
+    Every product has 'width' columns. Positions keep their order, so the indices stay sorted.
+    """
+    indices = remap[matrix.indices // width] * width + matrix.indices % width
+    return sp.csr_matrix ((matrix.data, indices, matrix.indptr), shape=(matrix.shape[0], n_products * width))
+
+
+def _contributions(counts, daytime, weights, n_products):
+    """
+    Returns the weighted day and time counts, product counts, pair counts and transaction weight of given rows.
+    Product counts, pair counts and transaction weight are counted for rows that include more than 1 kind of
+    product, like the association rules.
+    """
+    daytime_counts = np.asarray (daytime.T @ weights).reshape (n_products, DAYTIME_COUNT)
+
+    multi = np.diff (counts.indptr) > 1
+    binary = counts[multi].astype (bool).astype (np.float64)
+    multi_weights = weights[multi]
+    pairs = sp.csr_matrix (binary.T @ sp.diags (multi_weights) @ binary)
+    pairs = sp.csr_matrix (pairs - sp.diags (pairs.diagonal ()))
+
+    return daytime_counts, binary.T @ multi_weights, pairs, multi_weights.sum ()
+
+
+def update_refresh_state(state, dataframe):
+    """
+    Updates the refresh state with a new batch of events and returns the new state with the touched products.
+    The counts of the session ids in the batch are added to their previous counts, and the session ids that are
+    out of the window are evicted. Only the rows of the touched and evicted session ids are counted again.
+    The returned dictionary includes the positions of the products whose counts are changed as 'products',
+    the products whose rules can be changed as 'rule_products', the changed daytime columns as 'daytime' and
+    the transaction weight before the batch, in the scale of the new weights, as 'previous_transaction_weight'.
+    """
+    batch = prepare_event_batch (dataframe)
+    arrays = dict (state.arrays)
+
+    # New products and categories are added to the sorted vocabularies and the old positions are moved.
+    batch_products = batch["PRODUCTID"].astype (str).values
+    batch_categories = batch["CATEGORY"].astype (str).values
+    products = np.union1d (state.products, batch_products).astype (str)
+    categories = np.union1d (state.categories, batch_categories).astype (str)
+    remap = np.searchsorted (products, state.products)
+    category_remap = np.searchsorted (categories, state.categories)
+    n_products = len (products)
+
+    product_category = np.full (n_products, -1, dtype=np.int32)
+    product_category[remap] = category_remap[arrays["product_category"]]
+    product_positions = np.searchsorted (products, batch_products)
+    new_category = product_category[product_positions] == -1
+    product_category[product_positions[new_category]] = np.searchsorted (categories, batch_categories[new_category])
+
+    counts = _remap_product_columns (state.count_matrix (), remap, n_products)
+    daytime = _remap_product_columns (state.daytime_matrix (), remap, n_products, DAYTIME_COUNT)
+    pairs = state.pair_matrix ().tocoo ()
+    pairs = sp.csr_matrix ((pairs.data, (remap[pairs.row], remap[pairs.col])), shape=(n_products, n_products))
+    daytime_counts = np.zeros ((n_products, DAYTIME_COUNT))
+    daytime_counts[remap] = arrays["daytime_counts"]
+    product_weights = np.zeros (n_products)
+    product_weights[remap] = arrays["product_weights"]
+
+    # Count matrices of the batch.
+    session_codes, batch_sessions = pd.factorize (batch["SESSIONID"].astype (str).values)
+    daytime_codes = pd.Categorical (batch["NEW_DAY_TIME"].astype (str), categories=DAY_TIME_LABELS).codes
+    ones = np.ones (len (session_codes), dtype=np.int32)
+    batch_counts = sp.csr_matrix ((ones, (session_codes, product_positions)), shape=(len (batch_sessions), n_products))
+    batch_daytime = sp.csr_matrix ((ones, (session_codes, product_positions * DAYTIME_COUNT + daytime_codes)),
+                                   shape=(len (batch_sessions), n_products * DAYTIME_COUNT))
+    batch_times = np.full (len (batch_sessions), np.iinfo (np.int64).min)
+    np.maximum.at (batch_times, session_codes, _event_times (batch))
+
+    if len (state.sessions) == 0 and len (batch_times):
+        arrays["reference_time"] = np.array (batch_times.max (), dtype=np.int64)
+        state = RefreshState (arrays)
+
+    # Session ids of the batch which already exist get their previous counts.
+    old_rows = pd.Index (state.sessions).get_indexer (batch_sessions)
+    existing = np.flatnonzero (old_rows >= 0)
+    old_rows = old_rows[existing]
+    moving = sp.csr_matrix ((np.ones (len (existing)), (existing, old_rows)), shape=(len (batch_sessions),
+                                                                                     len (state.sessions)))
+    new_counts = sp.csr_matrix (batch_counts + moving @ counts).astype (np.int32)
+    new_daytime = sp.csr_matrix (batch_daytime + moving @ daytime).astype (np.int32)
+    batch_times[existing] = np.maximum (batch_times[existing], arrays["session_times"][old_rows])
+    new_weights = state.session_weights (batch_times)
+
+    removed = np.zeros (len (state.sessions), dtype=bool)
+    removed[old_rows] = True
+    if int (arrays["window"]) and len (batch_times):
+        latest = max (batch_times.max (), arrays["session_times"].max (initial=batch_times.max ()))
+        removed |= arrays["session_times"] < latest - int (arrays["window"])
+    removed_rows = np.flatnonzero (removed)
+
+    # The old counts of the touched and evicted session ids are removed, the new counts are added.
+    old_daytime_counts, old_product_weights, old_pairs, old_transaction_weight = _contributions (
+        counts[removed_rows], daytime[removed_rows], arrays["session_weights"][removed_rows], n_products)
+    add_daytime_counts, add_product_weights, add_pairs, add_transaction_weight = _contributions (
+        new_counts, new_daytime, new_weights, n_products)
+
+    tolerance = 1e-9 * max (new_weights.max (initial=1.0), 1.0)
+    daytime_counts += add_daytime_counts - old_daytime_counts
+    daytime_counts[np.abs (daytime_counts) < tolerance] = 0
+    product_weights += add_product_weights - old_product_weights
+    product_weights[np.abs (product_weights) < tolerance] = 0
+    pairs = sp.csr_matrix (pairs + add_pairs - old_pairs)
+    pairs.data[np.abs (pairs.data) < tolerance] = 0
+    pairs.eliminate_zeros ()
+    previous_transaction_weight = float (arrays["transaction_weight"])
+    transaction_weight = previous_transaction_weight + add_transaction_weight - old_transaction_weight
+
+    touched_products = np.unique (np.concatenate ([counts[removed_rows].indices, new_counts.indices]))
+    touched_daytime = np.unique (np.concatenate ([daytime[removed_rows].indices, new_daytime.indices]))
+
+    # Touched and new session ids are moved to the end, so the rows are ordered by their last update.
+    kept_rows = np.flatnonzero (~removed)
+    counts = sp.vstack ([counts[kept_rows], new_counts], format="csr")
+    daytime = sp.vstack ([daytime[kept_rows], new_daytime], format="csr")
+    session_weights = np.concatenate ([arrays["session_weights"][kept_rows], new_weights])
+
+    half_life = int (arrays["half_life"])
+    if half_life and len (session_weights) and np.log2 (session_weights.max ()) > MAX_WEIGHT_EXPONENT:
+        # The weights are divided by the same power of 2, so the ratios of the weights do not change.
+        shift = int (np.floor (np.log2 (session_weights.max ())))
+        session_weights = session_weights / 2.0 ** shift
+        daytime_counts = daytime_counts / 2.0 ** shift
+        product_weights = product_weights / 2.0 ** shift
+        pairs = pairs / 2.0 ** shift
+        transaction_weight /= 2.0 ** shift
+        previous_transaction_weight /= 2.0 ** shift
+        arrays["reference_time"] = np.array (int (arrays["reference_time"]) + shift * half_life, dtype=np.int64)
+
+    arrays.update ({"products": products,
+                    "categories": categories,
+                    "product_category": product_category,
+                    "sessions": np.concatenate ([state.sessions[kept_rows], np.asarray (batch_sessions)]).astype (str),
+                    "session_times": np.concatenate ([arrays["session_times"][kept_rows], batch_times]),
+                    "session_weights": session_weights,
+                    "daytime_counts": daytime_counts,
+                    "product_weights": product_weights,
+                    "transaction_weight": np.array (transaction_weight)})
+    for name, matrix in [("count", counts), ("daytime", daytime), ("pair", sp.csr_matrix (pairs))]:
+        arrays.update ({name + "_indptr": matrix.indptr.astype (np.int64), name + "_indices": matrix.indices,
+                        name + "_data": matrix.data})
+
+    # Rules of the products which are paired with touched products can change by the product counts.
+    new_state = RefreshState (arrays)
+    rule_products = np.union1d (touched_products, new_state.pair_matrix ()[touched_products].indices)
+
+    return new_state, {"products": touched_products, "rule_products": rule_products, "daytime": touched_daytime,
+                       "previous_transaction_weight": previous_transaction_weight}
+
+
+def state_session_product_matrix(state, binary=True):
+    """
+    Returns the session id-product matrix of the refresh state with sorted session ids, like
+    'create_sparse_session_product_matrix'.
+    """
+    order = np.argsort (state.sessions, kind="mergesort")
+    matrix = state.count_matrix ()[order]
+    if binary:
+        matrix.data[:] = 1
+
+    return SparseSessionProductMatrix (matrix, state.sessions[order], state.products)
+
+
+def state_session_neighborhood(state):
+    """
+    Returns the session neighborhood of the refresh state, like 'create_session_neighborhood'.
+    """
+    order = np.lexsort ((state.sessions, -state.arrays["session_times"]))
+    return create_session_neighborhood_from_matrix (state.count_matrix ()[order], state.sessions[order],
+                                                    state.products)
+
+
+def refresh_bestseller_tables(bestseller_tables, state, touched):
+    """
+    Returns the bestseller tables of the refresh state. Only the products of the day and time labels and
+    categories which are touched are ranked again, the other products are copied from 'bestseller_tables'.
+    If 'bestseller_tables' is None, all products are ranked.
+    """
+    products, categories = state.products, state.categories
+    product_category = state.arrays["product_category"]
+    counts = state.arrays["daytime_counts"]
+    n_categories = len (categories)
+
+    old_groups = {}
+    if bestseller_tables is not None:
+        old_remap = np.searchsorted (products, bestseller_tables.products)
+        old_category_remap = np.searchsorted (categories, bestseller_tables.categories)
+        old_indptr = bestseller_tables.arrays["same_indptr"]
+        old_n_categories = len (bestseller_tables.categories)
+        for i, label in enumerate (bestseller_tables.daytime_labels.tolist ()):
+            for j in range (old_n_categories):
+                key = DAY_TIME_LABELS.index (label) * n_categories + old_category_remap[j]
+                old_groups[key] = (old_indptr[i * old_n_categories + j], old_indptr[i * old_n_categories + j + 1])
+
+    touched_products = touched["daytime"] // DAYTIME_COUNT
+    touched_groups = set ((touched["daytime"] % DAYTIME_COUNT * n_categories +
+                           product_category[touched_products]).tolist ())
+
+    category_order = np.argsort (product_category, kind="mergesort")
+    category_indptr = np.r_[0, np.cumsum (np.bincount (product_category, minlength=n_categories))]
+
+    same_lists = []
+    for key in range (DAYTIME_COUNT * n_categories):
+        if key in old_groups and key not in touched_groups:
+            start, end = old_groups[key]
+            same_lists.append (old_remap[bestseller_tables.arrays["same_indices"][start:end]])
+            continue
+        label_code, category = divmod (key, n_categories)
+        category_products = category_order[category_indptr[category]:category_indptr[category + 1]]
+        product_counts = counts[category_products, label_code]
+        sold = product_counts > 0
+        category_products, product_counts = category_products[sold], product_counts[sold]
+        same_lists.append (category_products[np.lexsort ((category_products, -product_counts))])
+
+    same_indptr = np.r_[0, np.cumsum ([len (x) for x in same_lists])].astype (np.int64)
+    same_indices = np.concatenate (same_lists + [np.array ([], dtype=np.int64)]).astype (np.int32)
+
+    # Ranked categories of every day and time label by the count of their most sold products.
+    group_keys = np.flatnonzero (np.diff (same_indptr) > 0)
+    top_products = same_indices[same_indptr[group_keys]]
+    top_labels, top_categories = group_keys // n_categories, group_keys % n_categories
+    top_counts = counts[top_products, top_labels]
+    top_order = np.lexsort ((top_categories, -top_counts, top_labels))
+
+    arrays = {"products": products,
+              "categories": categories,
+              "product_category": product_category,
+              "daytime_labels": np.array (DAY_TIME_LABELS),
+              "same_indptr": same_indptr,
+              "same_indices": same_indices,
+              "diff_indptr": np.r_[0, np.cumsum (np.bincount (top_labels, minlength=DAYTIME_COUNT))],
+              "diff_indices": top_products[top_order],
+              "diff_categories": top_categories[top_order].astype (np.int32)}
+
+    return BestsellerTables (arrays)
+
+
+def refresh_rules(rules, state, touched):
+    """
+    Returns the rule index of the refresh state. The rules of 2 products are created from the pair counts of
+    the state, so they are the same as the rules created from scratch. The rules whose antecedent is a single
+    touched product are created again, the other rules are copied from 'rules' with their support and lift
+    rescaled by the change of the transaction weight, and the rules which do not pass the thresholds anymore
+    are removed. The rules of longer itemsets keep their itemset counts until the rules are created from scratch.
+    """
+    metric = str (state.arrays["metric"])
+    min_support, min_threshold = float (state.arrays["min_support"]), float (state.arrays["min_threshold"])
+    transaction_weight = float (state.arrays["transaction_weight"])
+    previous_transaction_weight = float (touched["previous_transaction_weight"])
+    scale = previous_transaction_weight / transaction_weight if transaction_weight else 0.0
+
+    # Pair rules of the untouched antecedents which are copied, as 'antecedent * n_products + consequent' keys.
+    n_products = len (state.products)
+    kept_keys = np.array ([], dtype=np.int64)
+    rules_list = []
+    if rules is not None:
+        antecedent_indptr = rules.arrays["antecedent_indptr"]
+        antecedent_items = rules.arrays["antecedent_items"]
+        remap = np.searchsorted (state.products, rules.products)
+        single = np.diff (antecedent_indptr) == 1
+        first_products = remap[antecedent_items[antecedent_indptr[:-1]]]
+        kept = ~(single & np.isin (first_products, touched["rule_products"]))
+        kept_keys = first_products[kept & single] * n_products + remap[rules.arrays["consequents"][kept & single]]
+
+        # Itemset counts of untouched rules do not change, only the transaction weight changes.
+        support = rules.arrays["support"] * scale
+        lift = rules.arrays["lift"] / scale if scale else rules.arrays["lift"]
+        metrics = {"support": support, "confidence": rules.arrays["confidence"], "lift": lift}
+        kept &= (support >= min_support - 1e-9) & (metrics[metric] >= min_threshold)
+        for row in np.flatnonzero (kept):
+            antecedents = antecedent_items[antecedent_indptr[row]:antecedent_indptr[row + 1]]
+            rules_list.append ({"antecedents": frozenset (rules.products[antecedents].tolist ()),
+                                "consequents": frozenset ([rules.products[rules.arrays["consequents"][row]]]),
+                                "support": support[row],
+                                "confidence": rules.arrays["confidence"][row],
+                                "lift": lift[row]})
+    old_rules = pd.DataFrame (rules_list, columns=["antecedents", "consequents", "support", "confidence", "lift"])
+
+    # Pair rules of the touched antecedents and the pair rules which pass the thresholds only now.
+    pairs = state.pair_matrix ().tocoo ()
+    product_weights = state.arrays["product_weights"]
+    frequent = pairs.data >= min_support * transaction_weight - 1e-9
+    frequent &= ~np.isin (pairs.row.astype (np.int64) * n_products + pairs.col, kept_keys)
+    antecedents, consequents, pair_weights = pairs.row[frequent], pairs.col[frequent], pairs.data[frequent]
+
+    new_rules = pd.DataFrame ({"antecedents": [frozenset ([product]) for product in state.products[antecedents]],
+                              "consequents": [frozenset ([product]) for product in state.products[consequents]],
+                              "support": pair_weights / transaction_weight,
+                              "confidence": pair_weights / product_weights[antecedents]})
+    new_rules["lift"] = new_rules["confidence"] / (product_weights[consequents] / transaction_weight)
+    new_rules = new_rules[new_rules[metric] >= min_threshold]
+
+    return RuleIndex.from_rules (pd.concat ([old_rules, new_rules], ignore_index=True), metric)
+
+
+def refresh_item_similarity_table(similarity_table, state, touched, k=20, method="pearson", min_support=2):
+    """
+    Returns the item similarity table of the refresh state. Only the rows of touched products are computed again,
+    by using the session ids which include them. The similarity of two products changes only when a session id
+    which includes both of them is touched, so the rows of the other products do not change.
+    """
+    products = state.products
+    counts = state.count_matrix ()
+    csc = counts.tocsc ()
+    rows = np.unique (np.concatenate ([csc.indices[csc.indptr[position]:csc.indptr[position + 1]]
+                                       for position in touched["products"]] + [np.array ([], dtype=np.int32)]))
+
+    norms = None
+    if method == "cosine":
+        norms = np.sqrt (np.asarray (counts.multiply (counts).sum (axis=0)).ravel ())
+
+    if similarity_table is not None:
+        k = similarity_table.neighbors.shape[1]
+    touched_table = create_item_similarity_table (SparseSessionProductMatrix (counts[rows], state.sessions[rows],
+                                                                              products),
+                                                  k=k, method=method, min_support=min_support,
+                                                  columns=touched["products"], norms=norms)
+    neighbors, scores = touched_table.neighbors, touched_table.scores
+
+    if similarity_table is not None:
+        old_remap = np.searchsorted (products, similarity_table.products)
+        untouched = ~np.isin (old_remap, touched["products"])
+        old_neighbors = similarity_table.neighbors[untouched]
+        neighbors[old_remap[untouched]] = np.where (old_neighbors >= 0, old_remap[old_neighbors], -1)
+        scores[old_remap[untouched]] = similarity_table.scores[untouched]
+
+    return ItemSimilarityTable (products, neighbors, scores)
+
+
+def refresh_recommendation_index(rec_index, bestseller_tables, rules, similarity_table, touched, state,
+                                 rec_count=10, item_based_threshold=0.5):
+    """
+    Returns the recommendation index of the refreshed artifacts. Item based recommendations are created again
+    only for touched products, the other item based recommendations are copied from 'rec_index'.
+    Association rules recommendations are read from 'rules' for all products, since the rules of untouched
+    products can pass or fail the thresholds when the transaction weight changes.
+    """
+    arrays = dict (bestseller_tables.arrays)
+    products = arrays["products"]
+    positions = ProductPositions (products)
+    touched_products = set (state.products[touched["products"]].tolist ())
+
+    arl_lists, item_lists = [], []
+    for product in products.tolist ():
+        arl_lists.append (arl_recommender (rules, product, rec_count))
+
+        if rec_index is not None and product in rec_index and product not in touched_products:
+            item_lists.append (rec_index._products_of ("item", rec_index.product_positions[product]))
+        elif product in similarity_table:
+            item_lists.append (similarity_table.similar_products (product, item_based_threshold, 5))
+        else:
+            item_lists.append ([])
+    arrays["arl_indptr"], arrays["arl_indices"] = _create_csr_lists (arl_lists, positions)
+    arrays["item_indptr"], arrays["item_indices"] = _create_csr_lists (item_lists, positions)
+
+    return RecommendationIndex (arrays)
+
+
+def read_refresh_state(prep_df, upgrade=False, store=None, half_life_days=None, window_days=None):
+    """
+    Creates the refresh state from prepared dataframe if 'upgrade' parameter is True or
+    reads the refresh state from its npz format that is already exist if 'upgrade' parameter is False.
+    If 'store' parameter is given, the refresh state is saved to and loaded from the artifact store.
+    """
+    if upgrade:
+        refresh_state, _ = update_refresh_state (create_refresh_state (half_life_days, window_days), prep_df)
+        if store is not None:
+            store.save ("refresh_state", refresh_state)
+        else:
+            np.savez ("refresh_state.npz", **refresh_state.arrays)
+    elif store is not None:
+        refresh_state = store.load ("refresh_state", RefreshState, mmap=False)
+    else:
+        with np.load ("refresh_state.npz") as npz_file:
+            refresh_state = RefreshState ({name: npz_file[name] for name in npz_file.files})
+
+    return refresh_state
+
+
+def refresh_df_prep(df_prep, batch):
+    """
+    Appends the prepared batch of events to the prepared dataframe. The batch gets the columns and the types of
+    the prepared dataframe, its other columns are dropped and its missing columns are empty.
+    """
+    batch = batch.reindex (columns=df_prep.columns)
+    for col in df_prep.columns:
+        if pd.api.types.is_categorical_dtype (df_prep[col]):
+            batch[col] = batch[col].astype ("category")
+        else:
+            try:
+                batch[col] = batch[col].astype (df_prep[col].dtype)
+            except (TypeError, ValueError):
+                pass
+
+    return concat_chunks ([df_prep, batch.reset_index (drop=True)])
+
+
+def refresh_artifacts(dataframe, store):
+    """
+    Updates the artifacts of the store with a new batch of events, which can be a row dataframe or
+    a prepared dataframe. All refreshed artifacts are saved as new versions and published together by one
+    manifest write, so a running service keeps its mapped files until it is reloaded. The item embedding index
+    is created again with its recorded method and the batch is appended to the prepared dataframe,
+    if the store has them. Returns the refreshed artifacts as a dictionary.
+    """
+    batch = prepare_event_batch (dataframe)
+    state = store.load ("refresh_state", RefreshState, mmap=False, check_sources=False)
+    state, touched = update_refresh_state (state, batch)
+
+    old = {name: store.load (name, cls, mmap=False, check_sources=False)
+           for name, cls in [("bestseller_tables", BestsellerTables), ("rules", RuleIndex),
+                             ("item_similarity_table", ItemSimilarityTable),
+                             ("recommendation_index", RecommendationIndex)]}
+
+    artifacts = {"refresh_state": state,
+                 "session_pro_matrix": state_session_product_matrix (state),
+                 "user_product_matrix": state_session_product_matrix (state, binary=False),
+                 "session_neighborhood": state_session_neighborhood (state),
+                 "bestseller_tables": refresh_bestseller_tables (old["bestseller_tables"], state, touched),
+                 "rules": refresh_rules (old["rules"], state, touched),
+                 "item_similarity_table": refresh_item_similarity_table (old["item_similarity_table"], state, touched)}
+    artifacts["recommendation_index"] = refresh_recommendation_index (old["recommendation_index"],
+                                                                      artifacts["bestseller_tables"],
+                                                                      artifacts["rules"],
+                                                                      artifacts["item_similarity_table"],
+                                                                      touched, state)
+
+    # The embeddings are learned from all counts, so they are not updated for the touched products only.
+    entries = store.manifest["artifacts"]
+    if "item_embeddings" in entries:
+        method = entries["item_embeddings"]["meta"].get ("method", "svd")
+        artifacts["item_embeddings"] = create_item_embedding_index (artifacts["user_product_matrix"], method=method)
+
+    with store.publish ():
+        for name, artifact in artifacts.items ():
+            if name == "item_embeddings":
+                store.save_arrays (name, artifact.arrays, kind=type (artifact).__name__, meta={"method": method})
+            else:
+                store.save (name, artifact)
+        if "df_prep" in entries:
+            store.save_dataframe ("df_prep", refresh_df_prep (store.load_dataframe ("df_prep", check_sources=False),
+                                                              batch))
+
+    return artifacts
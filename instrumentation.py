@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+import itertools
+import threading
+import tracemalloc
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Upper bounds of the span duration histogram buckets in seconds.
+SPAN_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of the process on Linux, so 'peak_rss' returns the peak from now on.
+    Returns False if the peak can not be reset.
+    """
+    try:
+        with open ("/proc/self/clear_refs", 'w') as f:
+            f.write ("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the process in bytes, or None if it is not known.
+    """
+    try:
+        with open ("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith ("VmHWM:"):
+                    return int (line.split ()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # Maximum resident set size is in kilobytes on Linux and in bytes on macOS.
+        return resource.getrusage (resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return None
+
+
+def _label_text(labels):
+    return ",".join ('{}="{}"'.format (key, str (value).replace ('"', '\\"')) for key, value in labels)
+
+
+class Instrumentation:
+    """
+    Creates the Instrumentation class which keeps the durations of the spans, the counters and the memory snapshots.
+    Spans and counters are aggregated, so they can be kept for the whole process, and the last 'max_events'
+    records are kept to be exported as json lines. If 'profile_dir' is given, the blocks which are run in
+    'profile' are profiled by cProfile and their stats are dumped to the directory.
+    """
+
+    def __init__(self, max_events=10000, profile_dir=None):
+        self.spans = {}
+        self.counters = defaultdict (float)
+        self.memory = {}
+        self.events = deque (maxlen=max_events)
+        self.profile_dir = profile_dir
+        self._profile_ids = itertools.count ()
+        self._lock = threading.Lock ()
+
+    def record_span(self, name, seconds):
+        """
+        Adds the duration of the span to the count, sum, maximum and histogram of its name.
+        """
+        with self._lock:
+            if name not in self.spans:
+                self.spans[name] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len (SPAN_BUCKETS)}
+            span = self.spans[name]
+            span["count"] += 1
+            span["sum"] += seconds
+            span["max"] = max (span["max"], seconds)
+            for i, bound in enumerate (SPAN_BUCKETS):
+                if seconds <= bound:
+                    span["buckets"][i] += 1
+                    break
+            self.events.append ({"type": "span", "name": name, "seconds": seconds, "time": time.time ()})
+
+    @contextmanager
+    def span(self, name):
+        """
+        Records the duration of the block as a span of given name.
+        """
+        start = time.perf_counter ()
+        try:
+            yield
+        finally:
+            self.record_span (name, time.perf_counter () - start)
+
+    def timed(self, name=None, memory=False):
+        """
+        Returns a decorator which records the duration of every call of the function as a span.
+        The span is named by the function if 'name' is not given. If 'memory' parameter is True,
+        a memory snapshot is taken after every call, which is used for the functions that build artifacts.
+        """
+
+        def decorator(function):
+            span_name = name or function.__name__
+
+            @functools.wraps (function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter ()
+                try:
+                    return function (*args, **kwargs)
+                finally:
+                    self.record_span (span_name, time.perf_counter () - start)
+                    if memory:
+                        self.memory_snapshot (span_name)
+
+            return wrapper
+
+        return decorator
+
+    def increment(self, name, value=1, **labels):
+        """
+        Increases the counter of given name and labels by 'value'.
+        """
+        with self._lock:
+            self.counters[(name, tuple (sorted (labels.items ())))] += value
+
+    def memory_snapshot(self, name):
+        """
+        Records the maximum resident set size of the process and, if tracemalloc is tracing,
+        the current and peak traced memory with given name.
+        """
+        snapshot = {"type": "memory", "name": name, "time": time.time ()}
+        rss = peak_rss ()
+        if rss is not None:
+            snapshot["max_rss_bytes"] = rss
+        if tracemalloc.is_tracing ():
+            snapshot["traced_bytes"], snapshot["traced_peak_bytes"] = tracemalloc.get_traced_memory ()
+        with self._lock:
+            self.memory[name] = snapshot
+            self.events.append (snapshot)
+        return snapshot
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profiles the block with cProfile and dumps its stats to '<profile_dir>/<name>-<number>.prof'
+        if 'profile_dir' is given, otherwise runs the block without profiling.
+        """
+        if not self.profile_dir:
+            yield
+            return
+
+        profiler = cProfile.Profile ()
+        profiler.enable ()
+        try:
+            yield
+        finally:
+            profiler.disable ()
+            os.makedirs (self.profile_dir, exist_ok=True)
+            profiler.dump_stats (os.path.join (self.profile_dir, "{}-{}.prof".format (name, next (self._profile_ids))))
+
+    def reset(self):
+        """
+        Removes all spans, counters, memory snapshots and events.
+        """
+        with self._lock:
+            self.spans.clear ()
+            self.counters.clear ()
+            self.memory.clear ()
+            self.events.clear ()
+
+    def records(self):
+        """
+        Returns the summary records of the spans, counters and memory snapshots.
+        """
+        with self._lock:
+            records = [{"type": "span_summary", "name": name, "count": span["count"], "sum": span["sum"],
+                        "max": span["max"], "buckets": dict (zip (map (str, SPAN_BUCKETS), span["buckets"]))}
+                       for name, span in self.spans.items ()]
+            records += [{"type": "counter", "name": name, "labels": dict (labels), "value": value}
+                        for (name, labels), value in self.counters.items ()]
+            records += list (self.memory.values ())
+        return records
+
+    def export_jsonl(self, path, events=True):
+        """
+        Appends the summary records and, if 'events' parameter is True, the last events to the json lines file.
+        """
+        with self._lock:
+            recent_events = list (self.events) if events else []
+        with open (path, 'a') as f:
+            for record in recent_events + self.records ():
+                f.write (json.dumps (record) + "\n")
+
+    def prometheus_text(self, prefix="hybrid_recommender"):
+        """
+        Returns the spans, counters and memory snapshots in Prometheus text exposition format.
+        """
+        lines = ["# TYPE {}_span_seconds histogram".format (prefix)]
+        with self._lock:
+            for name, span in sorted (self.spans.items ()):
+                cumulative = 0
+                for bound, count in zip (SPAN_BUCKETS, span["buckets"]):
+                    cumulative += count
+                    lines.append ('{}_span_seconds_bucket{{span="{}",le="{}"}} {}'.format (prefix, name, bound, cumulative))
+                lines.append ('{}_span_seconds_bucket{{span="{}",le="+Inf"}} {}'.format (prefix, name, span["count"]))
+                lines.append ('{}_span_seconds_sum{{span="{}"}} {}'.format (prefix, name, span["sum"]))
+                lines.append ('{}_span_seconds_count{{span="{}"}} {}'.format (prefix, name, span["count"]))
+
+            for name in sorted (set (name for name, _ in self.counters)):
+                lines.append ("# TYPE {}_{} counter".format (prefix, name))
+                for (counter_name, labels), value in sorted (self.counters.items ()):
+                    if counter_name == name:
+                        lines.append ("{}_{}{{{}}} {}".format (prefix, name, _label_text (labels), value))
+
+            lines.append ("# TYPE {}_memory_bytes gauge".format (prefix))
+            for name, snapshot in sorted (self.memory.items ()):
+                for key in ["max_rss_bytes", "traced_bytes", "traced_peak_bytes"]:
+                    if key in snapshot:
+                        lines.append ('{}_memory_bytes{{span="{}",kind="{}"}} {}'.format (prefix, name, key[:-6],
+                                                                                          snapshot[key]))
+        return "\n".join (lines) + "\n"
+
+    def export_prometheus(self, path, prefix="hybrid_recommender"):
+        """
+        Writes the Prometheus text to the file, which can be read by the textfile collector of node exporter.
+        """
+        with open (path, 'w') as f:
+            f.write (self.prometheus_text (prefix))
+
+
+# The instrumentation of the process. Profiles are dumped if HR_PROFILE_DIR environment variable is set.
+INSTRUMENTATION = Instrumentation (profile_dir=os.environ.get ("HR_PROFILE_DIR"))
+
+span = INSTRUMENTATION.span
+timed = INSTRUMENTATION.timed
+increment = INSTRUMENTATION.increment
+memory_snapshot = INSTRUMENTATION.memory_snapshot
+profile = INSTRUMENTATION.profile
@@ -1,21 +1,24 @@
-from funcs import *
+import seaborn as sns
+import matplotlib.pyplot as plt
 
-df = create_row_dataframe ()
+from artifact_store import ArtifactStore
 
-df_prep = data_preparation (df)
 
-
-def plot_most_purch_cats(count=3):
+def plot_most_purch_cats(count=3, df_prep=None):
     """
     Plots top specified number purchased product categories of all dataset with 'count' parameter according to day and time.
+    If 'df_prep' is not given, the prepared dataframe is loaded from the artifact store created by create_data.py,
+    so the json files are not read again.
     """
-    df_prep = pd.read_pickle ("df_prep.pickle")
+    if df_prep is None:
+        df_prep = ArtifactStore ("artifacts").load_dataframe ("df_prep", check_sources=False)
 
     category_df = df_prep.groupby ("NEW_DAY_TIME").agg ({"CATEGORY": "value_counts"})
     category_df.rename (columns={"CATEGORY": "COUNT"}, inplace=True)
     category_df = category_df.reset_index ()
+    category_df = category_df[category_df["COUNT"] > 0]
 
-    top_categories_all_time = category_df.groupby ("CATEGORY").agg ({"COUNT": "sum"}).sort_values (by="COUNT",
+    top_categories_all_time = category_df.groupby ("CATEGORY", observed=True).agg ({"COUNT": "sum"}).sort_values (by="COUNT",
                                                                                                    ascending=False)
 
     top_count_categories_list = top_categories_all_time.head (count).index
@@ -31,4 +34,5 @@ def plot_most_purch_cats(count=3):
     plt.show ();
 
 
-plot_most_purch_cats ()
+if __name__ == '__main__':
+    plot_most_purch_cats ()
@@ -1,4 +1,8 @@
-from funcs import *
+import sys
+
+from recommender_core import *
+from artifact_store import ArtifactStore, StaleArtifactError
+from instrumentation import INSTRUMENTATION, profile, span
 
 
 # 4 DIFFERENT APPROACHES WERE USED IN THIS PROJECT
@@ -15,55 +19,92 @@ from funcs import *
 # product_id_5 = "OFIS3101-080"
 
 
-def main():
-    df = create_row_dataframe ()
+def main(use_index=False, metrics_path=None, use_embeddings=False):
+    """
+    Runs the recommendation app. If 'use_index' parameter is True, the recommendations of association rules,
+    item based and popularity based approaches are read from the recommendation index created by create_data.py
+    and only user based recommendations are computed when a product is added to cart.
+    Product names are read from the product catalogue, so the prepared dataframe is not loaded.
+    The artifacts are loaded by the serving core, so pandas and the build functions of funcs.py are not imported.
+    The candidate lists of the approaches are kept in a cache until the day and time label changes and
+    they are merged by the hybrid ranker. If 'use_embeddings' parameter is True, the item based recommendations
+    are searched for the whole cart in the item embedding index created by 'create_data.py --embeddings'.
+    If 'metrics_path' parameter is given, the spans and counters are appended to the json lines file at the end.
+    Every cart addition is profiled if HR_PROFILE_DIR environment variable is set.
+    """
+    store = ArtifactStore ("artifacts", sources=[EVENTS_PATH, META_PATH])
+    rec_index = rules = similarity_table = bestseller_tables = item_embeddings = None
 
-    df_prep = read_data_prepared (dataframe=df)
+    try:
+        product_catalogue = store.load ("product_catalogue", ProductCatalogue)
 
-    session_pro_df = read_session_pro_df (dataframe=df_prep)
+        session_neighborhood = store.load ("session_neighborhood", SessionNeighborhood)
 
-    rules = read_rules_df (session_product_df=session_pro_df)
+        if use_index:
+            rec_index = store.load ("recommendation_index", RecommendationIndex)
+            products = rec_index
+        else:
+            rules = store.load ("rules", RuleIndex)
 
-    user_product_matrix = read_user_product_matrix_df (prep_data=df_prep)
+            similarity_table = store.load ("item_similarity_table", ItemSimilarityTable)
 
-    my_cart = Cart ()
+            bestseller_tables = store.load ("bestseller_tables", BestsellerTables)
 
-    try:
-        while True:
-            product_id = str (input (
-                "Sepete Eklemek İstediğiniz Ürün Kodunu Giriniz. Alışverişinizi tamamladıysanız 'e', sepetinizi temizlemek için 'c' tuşuna basabilirsiniz.\nSepetinizi görüntülemek için 'p' tuşuna basabilirsiniz.\n"))
-            if product_id.lower () == "e":
-                print (my_cart.shopping_list)
-                break
-            elif product_id.lower () == "c":
-                my_cart.clear_cart ()
-            elif product_id.lower () == "p":
-                my_cart.display_cart ()
-            elif (product_id in df_prep["PRODUCTID"].unique ()):
-                print ("Sepete eklenen ürün: {}".format (product_name (df_prep, product_id)))
-                print ("Ürün önerileriniz yükleniyor... Biraz zaman alabilir..")
+            products = bestseller_tables
 
-                my_cart.add_to_cart (product_id)
-                best_same_diff_cat_pro_list = bestseller_same_diff_cat_day_time (df_prep, product_id)
-                arl_recommender_list = arl_recommender (rules, product_id, 5)
-                user_based_recommender_list = user_based_recommendation (session_df=session_pro_df, prep_df=df_prep,
-                                                                         shopping_cart=my_cart.shopping_list)
-                item_based_recommender_list = item_based_recommendation (user_product_matrix, product_id)
+        if use_embeddings:
+            item_embeddings = store.load ("item_embeddings", ItemEmbeddingIndex)
+    except StaleArtifactError as error:
+        print ("Veri dosyaları güncel değil, lütfen önce create_data.py dosyasını çalıştırınız. ({})".format (error))
+        return
 
-                recommendation_list = best_same_diff_cat_pro_list + arl_recommender_list + user_based_recommender_list + item_based_recommender_list
-                recommendations = list (set (recommendation_list))
+    my_cart = Cart ()
+    cache = CandidateCache ()
+
+    while True:
+        product_id = str (input (
+            "Sepete Eklemek İstediğiniz Ürün Kodunu Giriniz. Alışverişinizi tamamladıysanız 'e', sepetinizi temizlemek için 'c' tuşuna basabilirsiniz.\nSepetinizi görüntülemek için 'p' tuşuna basabilirsiniz.\n"))
+        if product_id.lower () == "e":
+            print (my_cart.shopping_list)
+            if metrics_path:
+                INSTRUMENTATION.export_jsonl (metrics_path)
+            break
+        elif product_id.lower () == "c":
+            my_cart.clear_cart ()
+        elif product_id.lower () == "p":
+            my_cart.display_cart ()
+        elif (product_id in products):
+            with profile ("add_to_cart"), span ("add_to_cart"):
+                print ("Sepete eklenen ürün: {}".format (product_catalogue.name (product_id)))
 
-                final_recommendations = random.sample (recommendations, 10)
+                my_cart.add_to_cart (product_id)
+                if not use_index:
+                    print ("Ürün önerileriniz yükleniyor... Biraz zaman alabilir..")
+
+                # Candidate lists are kept in the cache and merged by the hybrid ranker, which completes
+                # the recommendations with the most sold products if the candidates are not enough.
+                candidates = recommendation_candidates (product_id, my_cart.shopping_list, session_neighborhood,
+                                                        rec_index=rec_index, rules=rules,
+                                                        similarity_table=similarity_table,
+                                                        bestseller_tables=bestseller_tables, cache=cache,
+                                                        item_embeddings=item_embeddings)
+                final_recommendations = hybrid_rank (candidates, products, rec_count=10,
+                                                     shopping_cart=my_cart.shopping_list)
 
                 print ("#" * 50)
-                for product in final_recommendations:
-                    print (product_name (df_prep, product))
+                for product in product_catalogue.names (final_recommendations):
+                    print (product)
                 print ("#" * 50)
-            else:
-                print ("Girilen ürün kodu hatalı. Lütfen tekrar deneyiniz.\n")
-    except ValueError:
-        print ("Önerilecek ürün bulunamadı.")
+        else:
+            print ("Girilen ürün kodu hatalı. Lütfen tekrar deneyiniz.\n")
 
 
 if __name__ == '__main__':
-    main ()
+    if "--serve" in sys.argv:
+        from recommendation_service import serve
+
+        serve (use_index="--index" in sys.argv, use_embeddings="--embeddings" in sys.argv)
+    else:
+        main (use_index="--index" in sys.argv,
+              metrics_path=sys.argv[sys.argv.index ("--metrics") + 1] if "--metrics" in sys.argv else None,
+              use_embeddings="--embeddings" in sys.argv)
@@ -0,0 +1,266 @@
+import sys
+import json
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from recommender_core import Cart, CandidateCache, EVENTS_PATH, META_PATH, ProductCatalogue, SessionNeighborhood, \
+    RecommendationIndex, RuleIndex, ItemSimilarityTable, BestsellerTables, ItemEmbeddingIndex, product_candidates, \
+    cart_candidates, hybrid_rank
+from artifact_store import ArtifactStore
+from instrumentation import INSTRUMENTATION, profile, span
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    """
+    Raised by the request handlers to return an error response with given status.
+    """
+
+    def __init__(self, status, message):
+        super ().__init__ (message)
+        self.status = status
+        self.message = message
+
+
+class RecommendationService:
+    """
+    Creates the RecommendationService class which loads the artifacts once and keeps the cart of every session id.
+    The recommendations are computed in a thread pool of 'max_workers' threads, so the event loop is not blocked.
+    The recommendations of a product which do not depend on the cart are computed once for the concurrent requests
+    of the same product. At most 'max_sessions' carts are kept, the least recently used carts are removed.
+    The candidate lists of the approaches are kept in a cache of 'cache_size' lists, which is cleared when
+    the artifacts are reloaded. The lists are merged by 'hybrid_rank' with given 'weights', 'method' and 'category_cap'.
+    If 'use_embeddings' parameter is True, the item based list is searched for the whole cart in the item embedding index.
+    """
+
+    def __init__(self, store=None, use_index=False, max_workers=4, rec_count=10, max_sessions=100000,
+                 cache_size=10000, weights=None, method="rrf", category_cap=3, use_embeddings=False):
+        self.store = store if store is not None else ArtifactStore ("artifacts", sources=[EVENTS_PATH, META_PATH])
+        self.use_index = use_index
+        self.use_embeddings = use_embeddings
+        self.rec_count = rec_count
+        self.max_sessions = max_sessions
+        self.weights = weights
+        self.method = method
+        self.category_cap = category_cap
+        self.executor = ThreadPoolExecutor (max_workers)
+        self.carts = OrderedDict ()
+        self.counters = {"requests": 0, "errors": 0, "product_lookups": 0, "coalesced_lookups": 0}
+        self._product_lookups = {}
+        self.cache = CandidateCache (cache_size)
+        self.load_artifacts ()
+
+    def load_artifacts(self):
+        """
+        Reads the manifest of the store again, loads the artifacts and clears the cache. The artifacts are replaced
+        after all of them are loaded, so the requests which are served while reloading use the old artifacts.
+        Raises StaleArtifactError if the artifacts can not be used.
+        The artifacts are loaded directly from the store, so funcs.py and pandas are not imported by the service.
+        """
+        rec_index = rules = similarity_table = bestseller_tables = item_embeddings = None
+        self.store.reload ()
+        product_catalogue = self.store.load ("product_catalogue", ProductCatalogue)
+        session_neighborhood = self.store.load ("session_neighborhood", SessionNeighborhood)
+        if self.use_index:
+            rec_index = self.store.load ("recommendation_index", RecommendationIndex)
+        else:
+            rules = self.store.load ("rules", RuleIndex)
+            similarity_table = self.store.load ("item_similarity_table", ItemSimilarityTable)
+            bestseller_tables = self.store.load ("bestseller_tables", BestsellerTables)
+        if self.use_embeddings:
+            item_embeddings = self.store.load ("item_embeddings", ItemEmbeddingIndex)
+
+        self.product_catalogue, self.session_neighborhood = product_catalogue, session_neighborhood
+        self.rec_index, self.rules = rec_index, rules
+        self.similarity_table, self.bestseller_tables = similarity_table, bestseller_tables
+        self.item_embeddings = item_embeddings
+        self.products = rec_index if self.use_index else bestseller_tables
+        self.cache.clear ()
+
+    def product_recommendations(self, product_id):
+        """
+        Returns the candidate lists of the approaches which do not depend on the cart.
+        """
+        with profile ("product_recommendations"):
+            return product_candidates (product_id, self.rec_index, self.similarity_table, self.bestseller_tables,
+                                       self.cache)
+
+    def cart_recommendations(self, shopping_cart, product_id):
+        """
+        Returns the candidate lists of the approaches which depend on the cart.
+        """
+        with profile ("cart_recommendations"):
+            return cart_candidates (product_id, shopping_cart, self.session_neighborhood, self.rules, self.cache,
+                                    self.item_embeddings)
+
+    def rank(self, candidates, shopping_cart):
+        """
+        Returns the recommendations merged from the candidate lists by the hybrid ranker.
+        """
+        with profile ("rank"):
+            return hybrid_rank (candidates, self.products, self.rec_count, self.weights, self.method,
+                                category_cap=self.category_cap, shopping_cart=shopping_cart)
+
+    async def _coalesced_product_recommendations(self, product_id):
+        # Concurrent requests of the same product wait for the same computation.
+        self.counters["product_lookups"] += 1
+        future = self._product_lookups.get (product_id)
+        if future is not None:
+            self.counters["coalesced_lookups"] += 1
+            return await asyncio.shield (future)
+
+        future = asyncio.get_running_loop ().run_in_executor (self.executor, self.product_recommendations, product_id)
+        self._product_lookups[product_id] = future
+        try:
+            return await asyncio.shield (future)
+        finally:
+            self._product_lookups.pop (product_id, None)
+
+    def get_cart(self, session_id):
+        """
+        Returns the cart of given session id, the cart is created if it does not exist.
+        """
+        if session_id not in self.carts:
+            self.carts[session_id] = Cart ()
+            while len (self.carts) > self.max_sessions:
+                self.carts.popitem (last=False)
+        self.carts.move_to_end (session_id)
+        return self.carts[session_id]
+
+    async def add_to_cart(self, session_id, product_id):
+        """
+        Adds the product to the cart of given session id and returns the recommendations of the cart.
+        """
+        if product_id not in self.products:
+            raise HTTPError (404, "Product '{}' is not found.".format (product_id))
+
+        cart = self.get_cart (session_id)
+        cart.add_to_cart (product_id)
+        shopping_cart = list (cart.shopping_list)
+
+        loop = asyncio.get_running_loop ()
+        product_lists, cart_lists = await asyncio.gather (
+            self._coalesced_product_recommendations (product_id),
+            loop.run_in_executor (self.executor, self.cart_recommendations, shopping_cart, product_id))
+
+        final_recommendations = await loop.run_in_executor (self.executor, self.rank, dict (product_lists, **cart_lists),
+                                                            shopping_cart)
+
+        return {"session_id": session_id,
+                "product": {"product_id": product_id, "name": self.product_catalogue.name (product_id)},
+                "cart": shopping_cart,
+                "recommendations": [{"product_id": product, "name": name} for product, name in
+                                    zip (final_recommendations, self.product_catalogue.names (final_recommendations))]}
+
+    async def handle(self, method, path, body):
+        """
+        Returns the response of the request as a dictionary. The endpoints are:
+        GET /health, GET /metrics, POST /reload, POST /sessions/<session_id>/cart with {"product_id": ...} body,
+        GET /sessions/<session_id>/cart and DELETE /sessions/<session_id>/cart.
+        The response of GET /metrics is the Prometheus text of the spans and counters.
+        """
+        parts = [part for part in path.split ("?")[0].split ("/") if part]
+        if parts == ["metrics"]:
+            return INSTRUMENTATION.prometheus_text ()
+        elif parts == ["health"]:
+            return dict (self.counters, status="ok", sessions=len (self.carts), cache=self.cache.stats ())
+        elif parts == ["reload"] and method == "POST":
+            await asyncio.get_running_loop ().run_in_executor (self.executor, self.load_artifacts)
+            return {"status": "reloaded", "cache": self.cache.stats ()}
+
+        if len (parts) != 3 or parts[0] != "sessions" or parts[2] != "cart":
+            raise HTTPError (404, "Path '{}' is not found.".format (path))
+
+        session_id = parts[1]
+        if method == "POST":
+            try:
+                product_id = str (json.loads (body or b"{}")["product_id"])
+            except (ValueError, KeyError, TypeError):
+                raise HTTPError (400, "The body must be a json object with 'product_id'.")
+            return await self.add_to_cart (session_id, product_id)
+        elif method == "GET":
+            return {"session_id": session_id, "cart": list (self.get_cart (session_id).shopping_list)}
+        elif method == "DELETE":
+            self.get_cart (session_id).clear_cart ()
+            return {"session_id": session_id, "cart": []}
+
+        raise HTTPError (405, "Method '{}' is not allowed.".format (method))
+
+    async def handle_connection(self, reader, writer):
+        """
+        Reads HTTP/1.1 requests from the connection and writes their json responses.
+        The connection is kept alive until the client closes it or sends 'Connection: close'.
+        """
+        try:
+            while True:
+                request_line = await reader.readline ()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode ("latin-1").split ()
+
+                headers = {}
+                while True:
+                    line = await reader.readline ()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode ("latin-1").partition (":")
+                    headers[name.strip ().lower ()] = value.strip ()
+                body = await reader.readexactly (int (headers.get ("content-length", 0)))
+
+                self.counters["requests"] += 1
+                try:
+                    with span ("request"):
+                        status, response = 200, await self.handle (method, path, body)
+                except HTTPError as error:
+                    status, response = error.status, {"error": error.message}
+                except Exception as error:
+                    status, response = 500, {"error": str (error)}
+                if status != 200:
+                    self.counters["errors"] += 1
+
+                keep_alive = version == "HTTP/1.1" and headers.get ("connection", "").lower () != "close"
+                if isinstance (response, str):
+                    content_type, content = "text/plain; version=0.0.4", response.encode ("utf-8")
+                else:
+                    content_type, content = "application/json", json.dumps (response, ensure_ascii=False).encode ("utf-8")
+                writer.write ("HTTP/1.1 {} {}\r\nContent-Type: {}; charset=utf-8\r\n"
+                              "Content-Length: {}\r\nConnection: {}\r\n\r\n".format (
+                    status, HTTP_REASONS[status], content_type, len (content), "keep-alive" if keep_alive else "close")
+                              .encode ("latin-1") + content)
+                await writer.drain ()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close ()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        """
+        Serves the recommendations on given host and port until the task is cancelled.
+        """
+        server = await asyncio.start_server (self.handle_connection, host, port)
+        print ("Recommendation service is listening on http://{}:{}".format (host, port))
+        async with server:
+            await server.serve_forever ()
+
+
+def serve(host="127.0.0.1", port=8080, use_index=False, max_workers=4, use_embeddings=False):
+    """
+    Loads the artifacts and runs the recommendation service.
+    """
+    service = RecommendationService (use_index=use_index, max_workers=max_workers, use_embeddings=use_embeddings)
+    try:
+        asyncio.run (service.serve (host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.executor.shutdown ()
+
+
+if __name__ == '__main__':
+    serve (port=int (sys.argv[1]) if len (sys.argv) > 1 and sys.argv[1].isdigit () else 8080,
+           use_index="--index" in sys.argv, use_embeddings="--embeddings" in sys.argv)
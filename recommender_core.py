@@ -0,0 +1,979 @@
+import random
+import heapq
+import hashlib
+import threading
+import datetime as dt
+from collections import OrderedDict
+
+import numpy as np
+
+from instrumentation import timed, increment
+
+# The serving core of the recommenders: the artifact classes, the candidate cache and the hybrid ranker.
+# Only numpy is imported, scipy is imported by the batch methods when they are called, so the app and the service
+# start without importing pandas, scipy or the plotting libraries. The artifacts are created by funcs.py.
+
+EVENTS_PATH = '/Users/ozanguner/PycharmProjects/Hybrid_Recommender/raw_datasets/events.json'
+META_PATH = '/Users/ozanguner/PycharmProjects/Hybrid_Recommender/raw_datasets/meta.json'
+
+
+DAY_MAP = {0: "MONDAY",
+           1: "TUESDAY",
+           2: "WEDNESDAY",
+           3: "THURSDAY",
+           4: "FRIDAY",
+           5: "SATURDAY",
+           6: "SUNDAY"}
+
+HOUR_RANGES = ["0_3", "4_7", "8_11", "12_15", "16_19", "20_23"]
+
+# The hour range label of every hour of the day, same as 'NEW_EVENTHOURS_RANGE' of the prepared dataframe.
+HOUR_RANGE_MAP = tuple (HOUR_RANGES[hour // 4] for hour in range (24))
+
+# Day and time labels ordered by their codes, the code of a label is 'weekday * 6 + hour // 4'.
+DAY_TIME_LABELS = ["_".join ([DAY_MAP[day], hour_range]) for day in range (7) for hour_range in HOUR_RANGES]
+
+
+class Cart:
+    """
+    Creates the Cart class.
+    """
+
+    def __init__(self):
+        self.shopping_list = []
+
+    def display_cart(self):
+        """
+        Displays the cart.
+        """
+        print (self.shopping_list)
+
+    def add_to_cart(self, product_id):
+        """
+        Adds product to cart.
+        """
+        self.shopping_list.append (product_id)
+
+    def clear_cart(self):
+        """
+        Clears the cart.
+        """
+        self.shopping_list.clear ()
+
+
+## PRODUCT POSITIONS
+class ProductPositions:
+    """
+    Creates the ProductPositions class which finds the positions of product ids in the products array of an artifact.
+    The products are sorted once and product ids are found by binary search, so loading an artifact does not create
+    a dict of every product id. It is used like a dict, 'positions' method finds many product ids at once.
+    """
+
+    def __init__(self, products):
+        self.products = np.asarray (products)
+        if len (self.products) < 2 or (self.products[1:] > self.products[:-1]).all ():
+            self.order = None
+            self.sorted_products = self.products
+        else:
+            self.order = np.argsort (self.products, kind="stable")
+            self.sorted_products = self.products[self.order]
+
+    def positions(self, product_ids):
+        """
+        Returns the positions of given product ids, -1 for the product ids which are not in the products.
+        """
+        product_ids = list (product_ids)
+        if not len (product_ids) or not len (self.products):
+            return np.full (len (product_ids), -1, dtype=np.int64)
+
+        product_ids = np.array (product_ids, dtype=object if self.products.dtype == object else str)
+        found = np.minimum (np.searchsorted (self.sorted_products, product_ids), len (self.products) - 1)
+        positions = found if self.order is None else self.order[found]
+        return np.where (self.sorted_products[found] == product_ids, positions, -1).astype (np.int64)
+
+    def get(self, product_id, default=None):
+        position = self.positions ([product_id])[0]
+        return int (position) if position >= 0 else default
+
+    def __getitem__(self, product_id):
+        position = self.get (product_id)
+        if position is None:
+            raise KeyError (product_id)
+        return position
+
+    def __contains__(self, product_id):
+        return self.get (product_id) is not None
+
+    def __len__(self):
+        return len (self.products)
+
+
+## SPARSE HELPERS
+def create_cart_matrix(shopping_carts, product_positions, n_products):
+    """
+    Creates binary cart-product matrix of given carts. The products which are not in 'product_positions' are skipped.
+    """
+    import scipy.sparse as sp
+
+    sizes = [len (shopping_cart) for shopping_cart in shopping_carts]
+    rows = np.repeat (np.arange (len (shopping_carts), dtype=np.int64), sizes)
+    cols = product_positions.positions (product for shopping_cart in shopping_carts for product in shopping_cart)
+    rows, cols = rows[cols >= 0], cols[cols >= 0]
+
+    matrix = sp.csr_matrix ((np.ones (len (rows), dtype=np.int32), (rows, cols)), shape=(len (shopping_carts), n_products))
+    matrix.sum_duplicates ()
+    matrix.data[:] = 1
+    return matrix
+
+
+def matrix_contains(matrix, rows, cols):
+    """
+    Returns whether the entries of sparse matrix at given rows and columns are stored.
+    """
+    import scipy.sparse as sp
+
+    matrix = sp.csr_matrix (matrix)
+    keys = np.repeat (np.arange (matrix.shape[0], dtype=np.int64), np.diff (matrix.indptr)) * matrix.shape[1] + \
+           matrix.indices
+    return np.isin (np.asarray (rows, dtype=np.int64) * matrix.shape[1] + cols, keys)
+
+
+def top_per_row(rows, items, keys, limit, n_rows):
+    """
+    Returns 'indptr', 'items' and 'keys' arrays of the 'limit' items with the smallest keys of every row,
+    ordered by the keys. If an item is repeated in a row, its smallest key is used.
+    Equal keys are ordered by the items.
+    """
+    rows, items, keys = np.asarray (rows, dtype=np.int64), np.asarray (items, dtype=np.int64), np.asarray (keys)
+    row_items = rows * (items.max (initial=0) + 1) + items
+    order = np.lexsort ((keys, row_items))
+    row_items, rows, items, keys = row_items[order], rows[order], items[order], keys[order]
+    first = np.r_[True, row_items[1:] != row_items[:-1]] if len (rows) else rows.astype (bool)
+    rows, items, keys = rows[first], items[first], keys[first]
+
+    # Stable sorting by the keys and then by the rows keeps the items ordered when the keys are equal.
+    order = np.argsort (keys, kind="stable")
+    order = order[np.argsort (rows[order], kind="stable")]
+    rows, items, keys = rows[order], items[order], keys[order]
+    counts = np.bincount (rows, minlength=n_rows)
+    ranks = np.arange (len (rows)) - np.repeat (np.cumsum (counts) - counts, counts)
+    top = ranks < limit
+
+    return np.r_[0, np.cumsum (np.bincount (rows[top], minlength=n_rows))], items[top], keys[top]
+
+
+## ASSOCIATION RULES
+class RuleIndex:
+    """
+    Creates the RuleIndex class which keeps the rule rows of every antecedent product as an inverted index.
+    The rules are sorted by given metric once, so the rule rows of every product are also sorted by the metric.
+    Antecedents and consequents are kept as product positions in 'arrays'.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.products = arrays["products"]
+        self.product_positions = ProductPositions (self.products)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls (arrays)
+
+    @classmethod
+    def from_rules(cls, rules_df, metric="support"):
+        """
+        Creates the rule index from association rules dataframe by sorting the rules by given metric.
+        The rules of the same metric are sorted by their products, since the order of the rules of
+        association_rules depends on the hash order of the product sets, which changes in every process.
+        """
+        antecedent_keys = np.array ([",".join (sorted (x)) for x in rules_df["antecedents"]], dtype=object)
+        consequent_keys = np.array ([",".join (sorted (x)) for x in rules_df["consequents"]], dtype=object)
+        order = np.lexsort ((consequent_keys, antecedent_keys, -rules_df[metric].values))
+        rules_df = rules_df.iloc[order].reset_index (drop=True)
+        antecedents = [sorted (x) for x in rules_df["antecedents"]]
+        consequents = [sorted (x)[0] for x in rules_df["consequents"]]
+
+        products = np.array (sorted (set (consequents).union (*antecedents)), dtype=str)
+        positions = {product: i for i, product in enumerate (products.tolist ())}
+
+        antecedent_indptr = np.r_[0, np.cumsum ([len (x) for x in antecedents])].astype (np.int64)
+        antecedent_items = np.array ([positions[product] for x in antecedents for product in x], dtype=np.int32)
+
+        # Rule rows of every antecedent product. Stable sorting keeps the rule rows sorted by the metric.
+        rule_rows = np.repeat (np.arange (len (antecedents), dtype=np.int32), np.diff (antecedent_indptr))
+        order = np.argsort (antecedent_items, kind="stable")
+
+        arrays = {"products": products,
+                  "metric": np.array (metric),
+                  "antecedent_indptr": antecedent_indptr,
+                  "antecedent_items": antecedent_items,
+                  "consequents": np.array ([positions[product] for product in consequents], dtype=np.int32),
+                  "rule_indptr": np.r_[0, np.cumsum (np.bincount (antecedent_items, minlength=len (products)))],
+                  "rule_rows": rule_rows[order]}
+        for col in ["support", "confidence", "lift"]:
+            arrays[col] = rules_df[col].values.astype (float)
+
+        return cls (arrays)
+
+    def __contains__(self, product_id):
+        return product_id in self.product_positions
+
+    def _rule_rows(self, product_id):
+        if product_id not in self.product_positions:
+            return self.arrays["rule_rows"][:0]
+        position = self.product_positions[product_id]
+        indptr = self.arrays["rule_indptr"]
+        return self.arrays["rule_rows"][indptr[position]:indptr[position + 1]]
+
+    def recommend(self, product_id, rec_count=10, rule_count=20):
+        """
+        Returns the consequents of the top 'rule_count' rules whose antecedents include given product id.
+        """
+        consequents = self.arrays["consequents"][self._rule_rows (product_id)[:rule_count]]
+        return self.products[list (dict.fromkeys (consequents.tolist ()))[:rec_count]].tolist ()
+
+    def recommend_cart(self, shopping_cart, rec_count=10):
+        """
+        Returns the consequents of the top rules whose antecedents are fully included by given cart.
+        The rule rows of the products in the cart are merged by metric order and the merge stops
+        when enough products are found.
+        """
+        cart = set (self.product_positions.positions (shopping_cart).tolist ()) - {-1}
+        antecedent_indptr = self.arrays["antecedent_indptr"]
+        antecedent_items = self.arrays["antecedent_items"]
+        consequents = {}
+        previous_row = -1
+        for row in heapq.merge (*[self._rule_rows (product).tolist () for product in set (shopping_cart)]):
+            if row == previous_row:
+                continue
+            previous_row = row
+            consequent = int (self.arrays["consequents"][row])
+            if consequent not in cart and \
+                    cart.issuperset (antecedent_items[antecedent_indptr[row]:antecedent_indptr[row + 1]].tolist ()):
+                consequents[consequent] = None
+                if len (consequents) == rec_count:
+                    break
+
+        return self.products[list (consequents)].tolist ()
+
+    def recommend_with_cart(self, product_id, shopping_cart=None, rec_count=10):
+        """
+        Returns the consequents of the rules whose antecedents are included by the whole cart first,
+        and the consequents of the rules of given product id complete the list.
+        """
+        if not shopping_cart:
+            return self.recommend (product_id, rec_count)
+        recommendation_list = self.recommend_cart (shopping_cart, rec_count)
+        recommendation_list += [product for product in self.recommend (product_id, rec_count)
+                                if product not in recommendation_list and product not in shopping_cart]
+        return recommendation_list[:rec_count]
+
+    def recommend_cart_batch(self, shopping_carts, rec_count=10):
+        """
+        Returns 'indptr' and product ids arrays of the recommendations of many carts like 'recommend_cart'.
+        The rules whose antecedents are fully included by every cart are found with one sparse matrix product.
+        """
+        import scipy.sparse as sp
+
+        antecedent_indptr = self.arrays["antecedent_indptr"]
+        antecedent_sizes = np.diff (antecedent_indptr)
+        antecedents = sp.csr_matrix ((np.ones (len (self.arrays["antecedent_items"]), dtype=np.int32),
+                                      self.arrays["antecedent_items"], antecedent_indptr),
+                                     shape=(len (antecedent_sizes), len (self.products)))
+        carts = create_cart_matrix (shopping_carts, self.product_positions, len (self.products))
+
+        # Number of antecedent products of every rule in every cart.
+        included = (carts @ antecedents.T).tocoo ()
+        full = included.data == antecedent_sizes[included.col]
+        cart_rows, rule_rows = included.row[full], included.col[full]
+        consequents = self.arrays["consequents"][rule_rows]
+        not_in_cart = ~matrix_contains (carts, cart_rows, consequents)
+
+        indptr, positions, _ = top_per_row (cart_rows[not_in_cart], consequents[not_in_cart], rule_rows[not_in_cart],
+                                            rec_count, len (shopping_carts))
+        return indptr, self.products[positions]
+
+
+## PRODUCT CATALOGUE
+class ProductCatalogue:
+    """
+    Creates the ProductCatalogue class which keeps brand, category, subcategory and name of every product.
+    The columns are kept as integer codes of their categories, product ids are found by hash lookup.
+    """
+
+    COLUMNS = ["BRAND", "CATEGORY", "SUBCATEGORY", "NAME"]
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.products = arrays["products"]
+        self.product_positions = ProductPositions (self.products)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls (arrays)
+
+    def __contains__(self, product_id):
+        return product_id in self.product_positions
+
+    def __len__(self):
+        return len (self.products)
+
+    def column_values(self, col, product_ids):
+        """
+        Returns the values of given column for given product ids. The values of the products which are not
+        in the catalogue are 'None', like the missing values.
+        """
+        positions = self.product_positions.positions (product_ids)
+        known = positions >= 0
+        values = np.full (len (positions), "None", dtype=object)
+        values[known] = self.arrays[col + "_categories"][self.arrays[col + "_codes"][positions[known]]]
+        return values.tolist ()
+
+    def names(self, product_ids):
+        """
+        Returns the names of given product ids as 'brand, category, name, product id'.
+        The brand is not included if it is unknown. The name of a product which is not in the catalogue
+        is its product id.
+        """
+        product_ids = list (product_ids)
+        product_names = []
+        for product, brand, category, name in zip (product_ids, self.column_values ("BRAND", product_ids),
+                                                   self.column_values ("CATEGORY", product_ids),
+                                                   self.column_values ("NAME", product_ids)):
+            if product not in self.product_positions:
+                product_names.append (product)
+                continue
+            product = [brand, category, name, product]
+            if product[0] == "None":
+                product_names.append (", ".join (product[1:]))
+            else:
+                product_names.append (", ".join (product))
+        return product_names
+
+    def name(self, product_id):
+        """
+        Returns the name of the product whose id is given.
+        """
+        return self.names ([product_id])[0]
+
+
+## POPULARITY-BASED
+def create_current_time(dataframe=None):
+    """
+    Creates day and time label of current day and time by using datetime module.
+    The 'dataframe' parameter is not used anymore, the hour range is read from 'HOUR_RANGE_MAP'.
+    """
+    now = dt.datetime.now ()
+    day_time_label = "_".join ([DAY_MAP[now.weekday ()], HOUR_RANGE_MAP[now.hour]])
+    return day_time_label
+
+
+class BestsellerTables:
+    """
+    Creates the BestsellerTables class which keeps the ranked products of every day and time label and category,
+    and the ranked categories of every day and time label with their most sold products.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.products = arrays["products"]
+        self.categories = arrays["categories"]
+        self.daytime_labels = arrays["daytime_labels"]
+        self.product_positions = ProductPositions (self.products)
+        self.daytime_positions = {label: i for i, label in enumerate (self.daytime_labels.tolist ())}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls (arrays)
+
+    def __contains__(self, product_id):
+        return product_id in self.product_positions
+
+    def _slice(self, name, row):
+        indptr = self.arrays[name + "_indptr"]
+        return slice (indptr[row], indptr[row + 1])
+
+    def current_daytime_label(self):
+        """
+        Creates day and time label of current day and time.
+        """
+        return create_current_time ()
+
+    def bestseller_products(self, product_id, daytime_label, diff_cat_rec_count=5, same_cat_rec_count=3):
+        """
+        Returns the most sold products in the same and different categories as the given product
+        for given day and time label.
+        """
+        if daytime_label not in self.daytime_positions or product_id not in self.product_positions:
+            return []
+
+        label_position = self.daytime_positions[daytime_label]
+        category = self.arrays["product_category"][self.product_positions[product_id]]
+
+        diff_slice = self._slice ("diff", label_position)
+        diff_products = self.arrays["diff_indices"][diff_slice]
+        diff_products = diff_products[self.arrays["diff_categories"][diff_slice] != category][:diff_cat_rec_count]
+
+        same_products = self.arrays["same_indices"][
+            self._slice ("same", label_position * len (self.categories) + category)][:same_cat_rec_count + 1]
+        same_products = same_products[same_products != self.product_positions[product_id]][:same_cat_rec_count]
+
+        return self.products[diff_products].tolist () + self.products[same_products].tolist ()
+
+    def popular_positions(self, daytime_label, depth=None):
+        """
+        Returns the positions of the most sold products of given day and time label. The products are taken in turns
+        from the categories ordered by their most sold products: the most sold product of every category first,
+        then the second ones and so on. The 'depth' parameter limits the number of products of every category.
+        """
+        if daytime_label not in self.daytime_positions:
+            return np.array ([], dtype=np.int64)
+
+        label_position = self.daytime_positions[daytime_label]
+        categories = self.arrays["diff_categories"][self._slice ("diff", label_position)]
+        rows = label_position * len (self.categories) + categories
+        starts = self.arrays["same_indptr"][rows]
+        sizes = self.arrays["same_indptr"][rows + 1] - starts
+        if depth is not None:
+            sizes = np.minimum (sizes, depth)
+
+        offsets = np.arange (sizes.sum ()) - np.repeat (np.cumsum (sizes) - sizes, sizes)
+        category_ranks = np.repeat (np.arange (len (categories)), sizes)
+        positions = self.arrays["same_indices"][np.repeat (starts, sizes) + offsets]
+        return positions[np.lexsort ((category_ranks, offsets))].astype (np.int64)
+
+    def popular_products(self, daytime_label, rec_count=10):
+        """
+        Returns the most sold 'rec_count' products of given day and time label, see 'popular_positions'.
+        """
+        return self.products[self.popular_positions (daytime_label)[:rec_count]].tolist ()
+
+
+## USER-BASED
+class SessionNeighborhood:
+    """
+    Creates the SessionNeighborhood class which finds the similar session ids of a cart by using only
+    the session ids that include the products of the cart.
+    Session ids are ordered by their last event time descending, so the posting list of every product
+    keeps the most recent session ids first. Products of every session id are ordered by their counts.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.products = arrays["products"]
+        self.sessions = arrays["sessions"]
+        self.session_sizes = np.diff (arrays["session_indptr"])
+        self.product_positions = ProductPositions (self.products)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls (arrays)
+
+    def __contains__(self, product_id):
+        return product_id in self.product_positions
+
+    def session_products(self, session_position):
+        """
+        Returns the products of given session position by descending counts.
+        """
+        indptr = self.arrays["session_indptr"]
+        return self.arrays["session_products"][indptr[session_position]:indptr[session_position + 1]]
+
+    def similar_sessions(self, cart_positions, neighbor_count=10, similarity="jaccard", max_postings=1000):
+        """
+        Returns the positions and scores of the most similar 'neighbor_count' session ids to the cart.
+        The 'similarity' parameter can be 'jaccard' or 'overlap'. If 'max_postings' parameter is given,
+        only the most recent 'max_postings' session ids of every product are used.
+        """
+        indptr = self.arrays["posting_indptr"]
+        postings = [self.arrays["posting_sessions"][indptr[position]:indptr[position + 1]][:max_postings]
+                    for position in cart_positions]
+        if not postings:
+            return np.array ([], dtype=np.int64), np.array ([])
+
+        candidates, overlaps = np.unique (np.concatenate (postings), return_counts=True)
+
+        # Session ids which include only the products of the cart have nothing to recommend.
+        useful = self.session_sizes[candidates] > overlaps
+        candidates, overlaps = candidates[useful], overlaps[useful]
+
+        if similarity == "jaccard":
+            scores = overlaps / (len (cart_positions) + self.session_sizes[candidates] - overlaps)
+        else:
+            scores = overlaps.astype (float)
+
+        # Stable sorting keeps the more recent session ids first when the scores are equal.
+        top = np.argsort (-scores, kind="stable")[:neighbor_count]
+        return candidates[top], scores[top]
+
+    def recommend(self, shopping_cart, rec_count=5, neighbor_count=10, similarity="jaccard", max_postings=1000):
+        """
+        Returns the products of the most similar session ids to the cart. The products are scored by
+        the sum of the similarities of the session ids which include them.
+        """
+        cart_positions = np.unique (self.product_positions.positions (set (shopping_cart)))
+        cart_positions = cart_positions[cart_positions >= 0]
+        sessions, scores = self.similar_sessions (cart_positions, neighbor_count, similarity, max_postings)
+        if len (sessions) == 0:
+            return []
+
+        products = [self.session_products (session) for session in sessions]
+        candidates, inverse = np.unique (np.concatenate (products), return_inverse=True)
+        product_scores = np.bincount (inverse, weights=np.repeat (scores, [len (x) for x in products]))
+        product_scores[np.isin (candidates, cart_positions)] = 0
+
+        top = np.argsort (-product_scores, kind="stable")[:rec_count]
+        top = top[product_scores[top] > 0]
+        return self.products[candidates[top]].tolist ()
+
+    def recommend_batch(self, shopping_carts, rec_count=5, neighbor_count=10, similarity="jaccard", max_postings=1000):
+        """
+        Returns 'indptr' and product ids arrays of the recommendations of many carts like 'recommend'.
+        The similar session ids of all carts and the scores of their products are found with sparse matrix products.
+        """
+        import scipy.sparse as sp
+
+        n_carts, n_products, n_sessions = len (shopping_carts), len (self.products), len (self.sessions)
+        carts = create_cart_matrix (shopping_carts, self.product_positions, n_products)
+
+        # Posting lists are cut to the most recent 'max_postings' session ids.
+        posting_indptr = self.arrays["posting_indptr"]
+        posting_sizes = np.minimum (np.diff (posting_indptr), max_postings)
+        cut_indptr = np.r_[0, np.cumsum (posting_sizes)]
+        offsets = np.arange (cut_indptr[-1]) - np.repeat (cut_indptr[:-1], posting_sizes)
+        postings = sp.csr_matrix ((np.ones (cut_indptr[-1], dtype=np.int32),
+                                   self.arrays["posting_sessions"][np.repeat (posting_indptr[:-1], posting_sizes) + offsets],
+                                   cut_indptr), shape=(n_products, n_sessions))
+
+        overlaps = (carts @ postings).tocoo ()
+        cart_rows, sessions, overlap = overlaps.row, overlaps.col, overlaps.data.astype (float)
+        useful = self.session_sizes[sessions] > overlap
+        cart_rows, sessions, overlap = cart_rows[useful], sessions[useful], overlap[useful]
+        if similarity == "jaccard":
+            cart_sizes = np.diff (carts.indptr)
+            scores = overlap / (cart_sizes[cart_rows] + self.session_sizes[sessions] - overlap)
+        else:
+            scores = overlap
+
+        # The most similar session ids of every cart, the more recent session ids first when the scores are equal.
+        neighbor_indptr, neighbors, neighbor_scores = top_per_row (cart_rows, sessions, -scores, neighbor_count, n_carts)
+        neighbor_rows = np.repeat (np.arange (n_carts), np.diff (neighbor_indptr))
+        neighbor_matrix = sp.csr_matrix ((-neighbor_scores, (neighbor_rows, neighbors)), shape=(n_carts, n_sessions))
+
+        session_products = sp.csr_matrix ((np.ones (len (self.arrays["session_products"])),
+                                           self.arrays["session_products"], self.arrays["session_indptr"]),
+                                          shape=(n_sessions, n_products))
+        product_scores = (neighbor_matrix @ session_products).tocoo ()
+        not_in_cart = ~matrix_contains (carts, product_scores.row, product_scores.col)
+
+        # The scores are rounded, so the sums of the same scores in different order are still equal.
+        indptr, positions, _ = top_per_row (product_scores.row[not_in_cart], product_scores.col[not_in_cart],
+                                         -np.round (product_scores.data[not_in_cart], 12), rec_count, n_carts)
+        return indptr, self.products[positions]
+
+    def to_npz(self, path):
+        """
+        Saves the session neighborhood to given path in npz format.
+        """
+        np.savez (path, **self.arrays)
+
+    @classmethod
+    def read_npz(cls, path):
+        """
+        Reads the session neighborhood from given path which is saved by 'to_npz' method.
+        """
+        with np.load (path) as npz_file:
+            return cls ({name: npz_file[name] for name in npz_file.files})
+
+
+## ITEM-BASED
+class ItemSimilarityTable:
+    """
+    Creates the ItemSimilarityTable class which keeps the top 'k' most similar products of every product.
+    The 'neighbors' and 'scores' arrays have a row for every product, sorted by descending similarity,
+    and missing neighbors are filled with -1 and NaN.
+    """
+
+    def __init__(self, products, neighbors, scores):
+        self.products = np.asarray (products)
+        self.neighbors = neighbors
+        self.scores = scores
+        self.product_positions = ProductPositions (self.products)
+
+    def __contains__(self, product_id):
+        return product_id in self.product_positions
+
+    def similar_products(self, product_id, threshold=None, count=None):
+        """
+        Returns the similar products of given product id whose similarity is higher than threshold
+        by descending order.
+        """
+        row = self.product_positions[product_id]
+        valid = self.neighbors[row] >= 0
+        if threshold is not None:
+            valid &= self.scores[row] > threshold
+        return self.products[self.neighbors[row][valid][:count]].tolist ()
+
+    @property
+    def arrays(self):
+        return {"products": self.products.astype (str), "neighbors": self.neighbors, "scores": self.scores}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls (arrays["products"], arrays["neighbors"], arrays["scores"])
+
+    def to_npz(self, path):
+        """
+        Saves the similarity table to given path in npz format.
+        """
+        np.savez (path, **self.arrays)
+
+    @classmethod
+    def read_npz(cls, path):
+        """
+        Reads the similarity table from given path which is saved by 'to_npz' method.
+        """
+        with np.load (path) as npz_file:
+            return cls.from_arrays ({name: npz_file[name] for name in npz_file.files})
+
+
+## ITEM EMBEDDINGS
+class ItemEmbeddingIndex:
+    """
+    Creates the ItemEmbeddingIndex class which keeps the embedding vectors of the products with an inverted file
+    index for approximate nearest neighbor search. The vectors are clustered around 'centroids' and the products
+    of every cluster are kept as a list, so a query is compared only with the products of the 'n_probe' clusters
+    whose centroids are the most similar to it. More clusters are probed for higher recall and slower queries.
+    Similar products can be read like ItemSimilarityTable, and the products similar to a whole cart are searched
+    with the mean vector of the cart.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.products = arrays["products"]
+        self.vectors = arrays["vectors"]
+        self.n_probe = int (arrays["n_probe"])
+        self.product_positions = ProductPositions (self.products)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls (arrays)
+
+    def __contains__(self, product_id):
+        return product_id in self.product_positions
+
+    def search(self, query, count=10, n_probe=None, exclude=(), exact=False):
+        """
+        Returns the positions and cosine similarities of the 'count' products most similar to the query vector
+        by descending similarity. The positions in 'exclude' are not returned. If 'exact' parameter is True,
+        the query is compared with all products instead of the products of the probed clusters.
+        """
+        if exact:
+            candidates = np.arange (len (self.vectors))
+        else:
+            centroid_scores = self.arrays["centroids"] @ query
+            n_probe = min (n_probe or self.n_probe, len (centroid_scores))
+            clusters = np.argpartition (-centroid_scores, n_probe - 1)[:n_probe]
+            indptr = self.arrays["list_indptr"]
+            candidates = np.concatenate ([self.arrays["list_items"][indptr[cluster]:indptr[cluster + 1]]
+                                          for cluster in clusters])
+        if len (exclude):
+            candidates = candidates[~np.isin (candidates, exclude)]
+
+        scores = self.vectors[candidates] @ query
+        if len (candidates) > count:
+            top = np.argpartition (-scores, count - 1)[:count]
+            candidates, scores = candidates[top], scores[top]
+        order = np.lexsort ((candidates, -scores))
+        return candidates[order], scores[order]
+
+    def similar_products(self, product_id, threshold=None, count=None, n_probe=None, exact=False):
+        """
+        Returns the similar products of given product id whose cosine similarity is higher than threshold
+        by descending order. At most 20 products are returned if 'count' is not given.
+        """
+        position = self.product_positions[product_id]
+        positions, scores = self.search (self.vectors[position], count or 20, n_probe, [position], exact)
+        if threshold is not None:
+            positions = positions[scores > threshold]
+        return self.products[positions].tolist ()
+
+    def recommend_cart(self, shopping_cart, rec_count=10, threshold=None, n_probe=None, exact=False):
+        """
+        Returns the products most similar to the mean vector of the products in the cart by descending order.
+        The products in the cart and the products whose cosine similarity is not higher than threshold are not returned.
+        """
+        cart = self.product_positions.positions (dict.fromkeys (shopping_cart))
+        cart = cart[cart >= 0]
+        if not len (cart):
+            return []
+
+        query = self.vectors[cart].mean (axis=0)
+        norm = np.linalg.norm (query)
+        if norm == 0:
+            return []
+        positions, scores = self.search (query / norm, rec_count, n_probe, cart, exact)
+        if threshold is not None:
+            positions = positions[scores > threshold]
+        return self.products[positions].tolist ()
+
+
+## RECOMMENDATION INDEX
+class RecommendationIndex(BestsellerTables):
+    """
+    Creates the RecommendationIndex class which keeps the precomputed recommendations of every product.
+    Association rules and item based recommendations are kept per product, popularity based recommendations
+    are kept as bestseller tables.
+    """
+
+    def _products_of(self, name, row):
+        return self.products[self.arrays[name + "_indices"][self._slice (name, row)]].tolist ()
+
+    def arl_products(self, product_id, rec_count=5):
+        """
+        Returns the products recommended by association rules for given product id.
+        """
+        return self._products_of ("arl", self.product_positions[product_id])[:rec_count]
+
+    def item_based_candidates(self, product_id):
+        """
+        Returns the precomputed correlated products of given product id, which are sampled by 'item_based_products'.
+        """
+        return self._products_of ("item", self.product_positions[product_id])
+
+    def item_based_products(self, product_id, rec_count=4):
+        """
+        Returns the products recommended by item based collaborative filtering for given product id.
+        The products are sampled randomly from the precomputed correlated products.
+        """
+        candidates = self.item_based_candidates (product_id)
+        return random.sample (candidates, min (rec_count, len (candidates)))
+
+    def recommend(self, product_id, daytime_label=None, arl_rec_count=5):
+        """
+        Returns the recommendation list of the approaches that do not depend on the cart for given product id.
+        """
+        if daytime_label is None:
+            daytime_label = self.current_daytime_label ()
+
+        return self.bestseller_products (product_id, daytime_label) + \
+               self.arl_products (product_id, arl_rec_count) + \
+               self.item_based_products (product_id)
+
+
+## CANDIDATE CACHE
+def daytime_bucket_end(now=None):
+    """
+    Returns the end of the 4 hours range of given time, when the day and time label of 'create_current_time' changes.
+    """
+    now = now if now is not None else dt.datetime.now ()
+    bucket_start = now.replace (hour=now.hour - now.hour % 4, minute=0, second=0, microsecond=0)
+    return bucket_start + dt.timedelta (hours=4)
+
+
+def cart_key(shopping_cart):
+    """
+    Returns the hash of the unique products of the cart, which does not depend on the order of the products.
+    """
+    return hashlib.sha1 ("\n".join (sorted (set (shopping_cart))).encode ("utf-8")).hexdigest ()
+
+
+class CandidateCache:
+    """
+    Creates the CandidateCache class which keeps the candidate lists of the recommendation approaches.
+    At most 'max_entries' lists are kept and the least recently used list is removed when the cache is full.
+    A list expires at the end of the day and time label in which it is computed, since the popularity based
+    lists change with the label. The cache can be shared by threads.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict ()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._lock = threading.Lock ()
+
+    def __len__(self):
+        return len (self.entries)
+
+    def get(self, key, compute, now=None):
+        """
+        Returns the list of given key. If the key is not found or its list is expired, the list is computed
+        by calling 'compute' and kept in the cache. A copy of the list is returned, so it can be changed.
+        """
+        now = now if now is not None else dt.datetime.now ()
+        with self._lock:
+            entry = self.entries.get (key)
+            if entry is not None and entry[0] > now:
+                self.counters["hits"] += 1
+                self.entries.move_to_end (key)
+                return list (entry[1])
+            if entry is not None:
+                self.counters["expirations"] += 1
+                del self.entries[key]
+            self.counters["misses"] += 1
+
+        value = list (compute ())
+        with self._lock:
+            self.entries[key] = (daytime_bucket_end (now), value)
+            self.entries.move_to_end (key)
+            while len (self.entries) > self.max_entries:
+                self.entries.popitem (last=False)
+                self.counters["evictions"] += 1
+
+        return list (value)
+
+    def clear(self):
+        """
+        Removes all lists, for example when the artifacts which the lists are computed from are reloaded.
+        """
+        with self._lock:
+            self.entries.clear ()
+            self.counters["invalidations"] += 1
+
+    def stats(self):
+        """
+        Returns the counters of the cache with its size.
+        """
+        with self._lock:
+            return dict (self.counters, size=len (self.entries))
+
+
+def _cached(cache, key, compute):
+    return compute () if cache is None else cache.get (key, compute)
+
+
+def _count_candidates(candidates):
+    # Candidate counts of the approaches, empty lists are counted separately.
+    for approach, products in candidates.items ():
+        increment ("candidates_total", len (products), approach=approach)
+        if not products:
+            increment ("empty_candidates_total", approach=approach)
+    return candidates
+
+
+@timed ()
+def product_candidates(product_id, rec_index=None, similarity_table=None, bestseller_tables=None, cache=None,
+                       daytime_label=None):
+    """
+    Returns the candidate lists of the approaches which do not depend on the cart for the product added to the cart.
+    If 'rec_index' is given, popularity based, association rules and item based lists are read from the index,
+    otherwise popularity based and item based lists are read from the bestseller tables and similarity table.
+    Item based lists keep all correlated products in their order, so they can be ranked by 'hybrid_rank'.
+    If 'cache' is given, the lists are kept in the cache by product id.
+    """
+    daytime_label = daytime_label if daytime_label is not None else create_current_time ()
+    if rec_index is not None:
+        return _count_candidates ({
+            "bestseller": _cached (cache, ("bestseller", product_id, daytime_label),
+                                   lambda: rec_index.bestseller_products (product_id, daytime_label)),
+            "arl": _cached (cache, ("arl", product_id), lambda: rec_index.arl_products (product_id)),
+            "item": _cached (cache, ("item", product_id), lambda: rec_index.item_based_candidates (product_id))})
+
+    return _count_candidates ({
+        "bestseller": _cached (cache, ("bestseller", product_id, daytime_label),
+                               lambda: bestseller_tables.bestseller_products (product_id, daytime_label)),
+        "item": _cached (cache, ("item", product_id), lambda: similarity_table.similar_products (product_id, 0.5, 5))})
+
+
+@timed ()
+def cart_candidates(product_id, shopping_cart, session_neighborhood, rules=None, cache=None, item_embeddings=None):
+    """
+    Returns the candidate lists of the approaches which depend on the cart: user based list and, if 'rules' is given,
+    association rules list of the cart. If 'item_embeddings' index is given, the item based list is searched
+    for the whole cart and replaces the item based list of the product.
+    If 'cache' is given, the lists are kept in the cache by the hash of the cart.
+    """
+    shopping_cart = list (shopping_cart)
+    key = cart_key (shopping_cart)
+    candidates = {"user": _cached (cache, ("user", key), lambda: session_neighborhood.recommend (shopping_cart))}
+    if rules is not None:
+        candidates["arl"] = _cached (cache, ("arl", product_id, key),
+                                     lambda: rules.recommend_with_cart (product_id, shopping_cart, 5))
+    if item_embeddings is not None:
+        candidates["item"] = _cached (cache, ("item_cart", key),
+                                      lambda: item_embeddings.recommend_cart (shopping_cart, 5, threshold=0.5))
+    return _count_candidates (candidates)
+
+
+def recommendation_candidates(product_id, shopping_cart, session_neighborhood, rec_index=None, rules=None,
+                              similarity_table=None, bestseller_tables=None, cache=None, daytime_label=None,
+                              item_embeddings=None):
+    """
+    Returns the candidate lists of popularity based, association rules, user based and item based approaches
+    for the product added to the cart as a dictionary. See 'product_candidates' and 'cart_candidates'.
+    """
+    candidates = product_candidates (product_id, rec_index, similarity_table, bestseller_tables, cache, daytime_label)
+    candidates.update (cart_candidates (product_id, shopping_cart, session_neighborhood,
+                                        rules if rec_index is None else None, cache, item_embeddings))
+    return candidates
+
+
+## HYBRID RANKING
+# Weights of the candidate lists of the approaches.
+HYBRID_WEIGHTS = {"bestseller": 1.0, "arl": 1.0, "user": 1.0, "item": 1.0}
+
+
+@timed ()
+def hybrid_rank(candidates, bestseller_tables, rec_count=10, weights=None, method="rrf", rrf_k=60, category_cap=3,
+                shopping_cart=(), daytime_label=None):
+    """
+    Returns 'rec_count' products by merging the ranked candidate lists of the approaches, which are given as
+    a dictionary of approach names and product lists.
+    If 'method' is "rrf", a product is scored by the sum of 'weight / (rrf_k + rank)' of the lists including it
+    (reciprocal rank fusion). If 'method' is "weighted", it is scored by the sum of 'weight * (1 - rank / length)'.
+    At most 'category_cap' products of every category are recommended. If the candidates are not enough,
+    the list is completed with the most sold products of the day and time label and the cap is relaxed only if
+    the products are still not enough. Products in the cart and products which are not in the bestseller tables
+    are not recommended.
+    """
+    if method not in ("rrf", "weighted"):
+        raise ValueError ("Unknown ranking method '{}'.".format (method))
+
+    weights = dict (HYBRID_WEIGHTS, **(weights or {}))
+    positions = bestseller_tables.product_positions
+    daytime_label = daytime_label if daytime_label is not None else create_current_time ()
+
+    items, scores = [np.array ([], dtype=np.int64)], [np.array ([], dtype=float)]
+    for approach, products in candidates.items ():
+        ranked = positions.positions (dict.fromkeys (products))
+        ranked = ranked[ranked >= 0]
+        ranks = np.arange (len (ranked), dtype=float)
+        if method == "rrf":
+            scores.append (weights.get (approach, 1.0) / (rrf_k + ranks + 1))
+        else:
+            scores.append (weights.get (approach, 1.0) * (1 - ranks / max (len (ranked), 1)))
+        items.append (ranked)
+
+    # Scores of the same product in different lists are summed.
+    items, inverse = np.unique (np.concatenate (items), return_inverse=True)
+    scores = np.bincount (inverse, weights=np.concatenate (scores), minlength=len (items))
+
+    # Most sold products follow the candidates in popularity order.
+    cart = positions.positions (set (shopping_cart))
+    cart = cart[cart >= 0]
+    popular = bestseller_tables.popular_positions (daytime_label, depth=rec_count + len (cart) + len (items))
+    popular = popular[~np.isin (popular, items)]
+    items = np.concatenate ([items, popular])
+    tiers = np.r_[np.zeros (len (scores)), np.ones (len (popular))]
+    scores = np.r_[scores, -np.arange (len (popular), dtype=float)]
+
+    order = np.lexsort ((items, -scores, tiers))
+    items, tiers = items[order], tiers[order]
+    not_in_cart = ~np.isin (items, cart)
+    items, tiers = items[not_in_cart], tiers[not_in_cart]
+
+    # The rank of every product in its category, products after the cap are used only if needed.
+    product_categories = bestseller_tables.arrays["product_category"][items]
+    by_category = np.argsort (product_categories, kind="stable")
+    sizes = np.bincount (product_categories)
+    category_ranks = np.empty (len (items), dtype=np.int64)
+    category_ranks[by_category] = np.arange (len (items)) - np.repeat (np.cumsum (sizes) - sizes, sizes)
+    capped = category_ranks >= category_cap
+    items = np.concatenate ([items[~capped], items[capped]])[:rec_count]
+
+    if np.concatenate ([tiers[~capped], tiers[capped]])[:rec_count].any ():
+        increment ("fallbacks_total", reason="popularity")
+    if len (items) < rec_count:
+        increment ("short_recommendations_total")
+
+    return bestseller_tables.products[items].tolist ()
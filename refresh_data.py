@@ -0,0 +1,27 @@
+import sys
+import warnings
+
+import pandas as pd
+
+from funcs import *
+from artifact_store import ArtifactStore
+from incremental_refresh import refresh_artifacts
+
+# RUN THIS FILE WITH THE PATH OF A NEW EVENTS JSON FILE, FOR UPDATING THE DATAFRAMES CREATED BY create_data.py
+# WITH THE NEW EVENTS INSTEAD OF CREATING THEM FROM THE WHOLE HISTORY.
+# python refresh_data.py new_events.json
+
+warnings.filterwarnings ("ignore")
+
+pd.set_option ('display.max_rows', 30)
+pd.set_option ('display.width', 500)
+pd.set_option ('display.max_columns', 50)
+
+store = ArtifactStore ("artifacts", sources=[EVENTS_PATH, META_PATH])
+
+new_events_df = create_row_dataframe (events_path=sys.argv[1])
+
+artifacts = refresh_artifacts (new_events_df, store)
+
+product_catalogue = read_product_catalogue (meta_df=convert_json_to_df (META_PATH, "meta", chunk_size=100000),
+                                            upgrade=True, store=store)
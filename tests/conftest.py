@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname (os.path.dirname (os.path.abspath (__file__)))
+sys.path.insert (0, ROOT)
+sys.path.insert (0, os.path.join (ROOT, "benchmarks"))
+
+from funcs import create_sparse_session_product_matrix
+
+
+@pytest.fixture (scope="session")
+def df_prep():
+    """
+    Returns the session id, product id and event time columns of synthetic events. Product popularity follows
+    a zipf distribution and every session id buys mostly from a few neighbouring products.
+    """
+    rng = np.random.default_rng (42)
+    n_events, n_products, n_sessions = 20000, 300, 6000
+    session_codes = np.sort (rng.integers (0, n_sessions, n_events))
+    session_base = rng.zipf (1.3, n_sessions) % n_products
+    product_codes = (session_base[session_codes] + rng.zipf (1.6, n_events) - 1) % n_products
+
+    session_start = pd.Timestamp ("2020-06-01", tz="UTC") + pd.to_timedelta (
+        rng.integers (0, 30 * 24 * 3600, n_sessions), unit="s")
+    event_times = session_start[session_codes] + pd.to_timedelta (rng.integers (0, 1800, n_events), unit="s")
+
+    return pd.DataFrame ({"SESSIONID": np.char.add ("s", session_codes.astype (str)),
+                          "PRODUCTID": np.char.add ("HBV", np.char.zfill (product_codes.astype (str), 8)),
+                          "EVENTTIME": event_times})
+
+
+@pytest.fixture (scope="session")
+def session_pro_matrix(df_prep):
+    return create_sparse_session_product_matrix (df_prep)
+
+
+@pytest.fixture (scope="session")
+def user_pro_matrix(df_prep):
+    return create_sparse_session_product_matrix (df_prep, binary=False)
+
+
+@pytest.fixture (scope="session")
+def rules_df(session_pro_matrix):
+    """
+    Returns the association rules of single consequents sorted by descending support and then by their products,
+    so the rules of equal support have the same order in the rule index and in the tests.
+    """
+    pytest.importorskip ("mlxtend")
+    from funcs import create_rules
+
+    rules_df = create_rules (session_pro_matrix)
+    rules_df = rules_df[rules_df["consequents"].apply (len) == 1]
+    rules_df = rules_df.assign (antecedent_key=[",".join (sorted (x)) for x in rules_df["antecedents"]],
+                                consequent_key=[",".join (sorted (x)) for x in rules_df["consequents"]])
+    rules_df = rules_df.sort_values (["antecedent_key", "consequent_key"], kind="stable")
+    return rules_df.sort_values ("support", ascending=False, kind="stable").reset_index (drop=True)
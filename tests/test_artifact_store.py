@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifact_store import ArtifactStore, StaleArtifactError
+
+
+class Artifact:
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls (arrays)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "events.json"
+    path.write_text ('{"events": []}')
+    return str (path)
+
+
+def test_save_and_load_memory_mapped_arrays(tmp_path):
+    store = ArtifactStore (str (tmp_path / "artifacts"))
+    store.save ("artifact", Artifact ({"values": np.arange (10), "names": np.array (["a", "bc"], dtype=object)}))
+
+    artifact = ArtifactStore (store.root).load ("artifact", Artifact)
+
+    assert isinstance (artifact.arrays["values"], np.memmap)
+    np.testing.assert_array_equal (artifact.arrays["values"], np.arange (10))
+    assert artifact.arrays["names"].tolist () == ["a", "bc"]
+
+
+def test_dataframe_round_trip(tmp_path):
+    dataframe = pd.DataFrame ({"PRODUCTID": pd.Categorical (["b", "a", None, "b"]),
+                               "NEW_EVENTHOURS_RANGE": pd.Categorical (["0-4", "4-8", "0-4", "8-12"], ordered=True),
+                               "EVENTTIME": pd.to_datetime (["2020-06-01 10:00", None, "2020-06-02 11:30",
+                                                             "2020-06-03 00:00"]).tz_localize ("UTC"),
+                               "NEW_EVENTTIME": pd.to_datetime (["2020-06-01", "2020-06-01", "2020-06-02",
+                                                                 "2020-06-03"]),
+                               "PRICE": [1.5, np.nan, 3.0, 4.25],
+                               "NEW_EVENTHOURS": np.array ([10, 0, 11, 0], dtype=np.int64),
+                               "NAME": ["x", "y", "z", "w"],
+                               "BRAND": ["x", None, "None", np.nan]})
+    store = ArtifactStore (str (tmp_path / "artifacts"))
+    store.save_dataframe ("df_prep", dataframe)
+
+    loaded = ArtifactStore (store.root).load_dataframe ("df_prep")
+    pd.testing.assert_frame_equal (loaded, dataframe)
+    assert loaded["BRAND"].isnull ().tolist () == [False, True, False, True]
+
+
+def test_changed_source_makes_artifact_stale(tmp_path, source):
+    store = ArtifactStore (str (tmp_path / "artifacts"), sources=[source])
+    store.save ("artifact", Artifact ({"values": np.arange (3)}))
+
+    # Only the modification time is changed, the content is hashed again and the artifact can be used.
+    os.utime (source, ns=(0, 0))
+    ArtifactStore (store.root).load ("artifact", Artifact)
+
+    with open (source, 'w') as f:
+        f.write ('{"events": [{}]}')
+    with pytest.raises (StaleArtifactError):
+        ArtifactStore (store.root).load ("artifact", Artifact)
+    ArtifactStore (store.root).load ("artifact", Artifact, check_sources=False)
+
+
+def test_missing_artifact_and_other_store_version(tmp_path):
+    store = ArtifactStore (str (tmp_path / "artifacts"))
+    with pytest.raises (StaleArtifactError):
+        store.load ("artifact", Artifact)
+
+    store.save ("artifact", Artifact ({"values": np.arange (3)}))
+    store.manifest["version"] = -1
+    with pytest.raises (StaleArtifactError):
+        store.load ("artifact", Artifact)
+
+
+def test_saves_write_new_versions_and_keep_the_newest(tmp_path):
+    store = ArtifactStore (str (tmp_path / "artifacts"), keep_versions=2)
+    store.save ("artifact", Artifact ({"values": np.arange (3)}))
+    mapped = ArtifactStore (store.root).load ("artifact", Artifact).arrays["values"]
+
+    for i in range (1, 4):
+        store.save ("artifact", Artifact ({"values": np.arange (3) + i}))
+
+    versions = sorted (os.listdir (os.path.join (store.root, "artifact")))
+    assert len (versions) == 2
+    assert versions[-1] == store.manifest["artifacts"]["artifact"]["version"]
+    np.testing.assert_array_equal (ArtifactStore (store.root).load ("artifact", Artifact).arrays["values"],
+                                   np.arange (3) + 3)
+    # The removed version is still mapped by the process which loaded it.
+    np.testing.assert_array_equal (mapped, np.arange (3))
+
+
+def test_publish_writes_the_manifest_once(tmp_path):
+    store = ArtifactStore (str (tmp_path / "artifacts"))
+    store.save ("first", Artifact ({"values": np.zeros (2)}))
+    store.save ("second", Artifact ({"values": np.zeros (2)}))
+    reader = ArtifactStore (store.root)
+
+    with store.publish ():
+        store.save ("first", Artifact ({"values": np.ones (2)}))
+        store.save ("second", Artifact ({"values": np.ones (2)}))
+        reader.reload ()
+        assert reader.load ("first", Artifact).arrays["values"].tolist () == [0, 0]
+        assert reader.load ("second", Artifact).arrays["values"].tolist () == [0, 0]
+
+    reader.reload ()
+    assert reader.load ("first", Artifact).arrays["values"].tolist () == [1, 1]
+    assert reader.load ("second", Artifact).arrays["values"].tolist () == [1, 1]
+
+
+def test_publish_does_not_write_the_manifest_on_error(tmp_path):
+    store = ArtifactStore (str (tmp_path / "artifacts"))
+    store.save ("artifact", Artifact ({"values": np.zeros (2)}))
+
+    with pytest.raises (RuntimeError):
+        with store.publish ():
+            store.save ("artifact", Artifact ({"values": np.ones (2)}))
+            raise RuntimeError ("refresh failed")
+
+    assert store.save_manifest
+    assert ArtifactStore (store.root).load ("artifact", Artifact).arrays["values"].tolist () == [0, 0]
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from funcs import RuleIndex, create_recommendation_index, create_rules, create_session_neighborhood, \
+    create_sparse_session_product_matrix, data_preparation, recommend_batch
+from recommender_core import hybrid_rank
+from synthetic_data import create_synthetic_row_dataframe
+
+
+@pytest.fixture (scope="module")
+def artifacts():
+    pytest.importorskip ("mlxtend")
+    df_prep = data_preparation (create_synthetic_row_dataframe (n_events=10000, n_products=200))
+    rules = RuleIndex.from_rules (create_rules (create_sparse_session_product_matrix (df_prep)))
+    rec_index = create_recommendation_index (df_prep, rules,
+                                             create_sparse_session_product_matrix (df_prep, binary=False))
+    return df_prep, rec_index, create_session_neighborhood (df_prep), rules
+
+
+@pytest.fixture (scope="module")
+def shopping_carts(artifacts):
+    df_prep = artifacts[0]
+    carts = df_prep.groupby ("SESSIONID", observed=True)["PRODUCTID"].agg (lambda x: list (x.astype (str)))
+    return dict (carts.head (300).items ())
+
+
+def test_session_neighborhood_recommend_batch_matches_recommend(artifacts, shopping_carts):
+    session_neighborhood = artifacts[2]
+    carts = list (shopping_carts.values ()) + [[], ["UNKNOWN"]]
+    indptr, products = session_neighborhood.recommend_batch (carts, rec_count=5)
+    for i, shopping_cart in enumerate (carts):
+        assert products[indptr[i]:indptr[i + 1]].tolist () == session_neighborhood.recommend (shopping_cart, 5)
+
+
+def test_rule_index_recommend_cart_batch_matches_recommend_cart(artifacts, shopping_carts):
+    rules = artifacts[3]
+    carts = list (shopping_carts.values ())
+    indptr, products = rules.recommend_cart_batch (carts, 5)
+    for i, shopping_cart in enumerate (carts):
+        assert products[indptr[i]:indptr[i + 1]].tolist () == rules.recommend_cart (shopping_cart, 5)
+
+
+def hybrid_recommendations(shopping_cart, rec_index, session_neighborhood, rules, daytime_label, **ranking):
+    """
+    Returns the recommendations of one cart by ranking its candidate lists with 'hybrid_rank'.
+    """
+    product_id = shopping_cart[-1]
+    arl = rules.recommend_cart (shopping_cart, 5) + rec_index.arl_products (product_id, 5)
+    candidates = {"bestseller": rec_index.bestseller_products (product_id, daytime_label),
+                  "arl": [product for product in dict.fromkeys (arl) if product not in shopping_cart][:5],
+                  "user": session_neighborhood.recommend (shopping_cart),
+                  "item": rec_index.item_based_candidates (product_id)}
+    return hybrid_rank (candidates, rec_index, 5, shopping_cart=shopping_cart, daytime_label=daytime_label, **ranking)
+
+
+@pytest.mark.parametrize ("ranking", [{}, {"method": "weighted", "weights": {"user": 2.0}, "category_cap": 2}])
+def test_recommend_batch_matches_hybrid_rank(artifacts, shopping_carts, ranking):
+    _, rec_index, session_neighborhood, rules = artifacts
+    daytime_label = rec_index.current_daytime_label ()
+    recommendations = recommend_batch (shopping_carts, rec_index, session_neighborhood, rules,
+                                       daytime_label=daytime_label, rec_count=5, **ranking)
+
+    assert list (recommendations) == list (shopping_carts)
+    for session_id, products in recommendations.items ():
+        assert len (products) == 5
+        assert products == hybrid_recommendations (shopping_carts[session_id], rec_index, session_neighborhood, rules,
+                                                   daytime_label, **ranking)
+
+
+def test_recommend_batch_does_not_depend_on_processes(artifacts, shopping_carts):
+    _, rec_index, session_neighborhood, rules = artifacts
+    kwargs = dict (daytime_label="MONDAY_8_11", rec_count=5, chunk_size=70)
+
+    assert recommend_batch (shopping_carts, rec_index, session_neighborhood, rules, n_jobs=2, **kwargs) == \
+           recommend_batch (shopping_carts, rec_index, session_neighborhood, rules, **kwargs)
@@ -0,0 +1,51 @@
+import numpy as np
+
+from artifact_store import ArtifactStore
+from build_pipeline import create_stages, run_pipeline
+from funcs import RuleIndex
+from synthetic_data import write_synthetic_json
+
+
+def statuses(report):
+    return {name: stage_report["status"] for name, stage_report in report.items ()}
+
+
+def test_pipeline_skips_unchanged_stages(tmp_path):
+    events_path, meta_path = write_synthetic_json (str (tmp_path / "data"), n_events=3000, n_products=100)
+    store = ArtifactStore (str (tmp_path / "artifacts"), sources=[events_path, meta_path])
+    stages = create_stages (events_path, meta_path, n_jobs=2)
+
+    report = run_pipeline (store, stages, n_jobs=2, verbose=False)
+    assert set (statuses (report).values ()) == {"built"}
+    rules = ArtifactStore (store.root).load ("rules", RuleIndex)
+
+    # Nothing changed, so every stage is skipped and the artifacts are kept.
+    report = run_pipeline (ArtifactStore (store.root, sources=[events_path, meta_path]), stages, n_jobs=2,
+                           verbose=False)
+    assert set (statuses (report).values ()) == {"skipped"}
+    for key, array in ArtifactStore (store.root).load ("rules", RuleIndex).arrays.items ():
+        np.testing.assert_array_equal (array, rules.arrays[key])
+
+    # The parameters of the rules stage changed, so the rules and the stages which read them are built again.
+    report = run_pipeline (ArtifactStore (store.root, sources=[events_path, meta_path]),
+                           create_stages (events_path, meta_path, n_jobs=4), n_jobs=2, verbose=False)
+    assert {name for name, status in statuses (report).items () if status == "built"} == \
+           {"rules", "recommendation_index"}
+
+    report = run_pipeline (ArtifactStore (store.root, sources=[events_path, meta_path]), stages, n_jobs=2,
+                           force=True, verbose=False)
+    assert set (statuses (report).values ()) == {"built"}
+
+
+def test_changed_source_builds_its_stages_again(tmp_path):
+    events_path, meta_path = write_synthetic_json (str (tmp_path / "data"), n_events=3000, n_products=100)
+    stages = create_stages (events_path, meta_path, n_jobs=2)
+    run_pipeline (ArtifactStore (str (tmp_path / "artifacts"), sources=[events_path, meta_path]), stages, n_jobs=2,
+                  verbose=False)
+
+    with open (events_path, 'a') as f:
+        f.write ("\n")
+    report = run_pipeline (ArtifactStore (str (tmp_path / "artifacts"), sources=[events_path, meta_path]), stages,
+                           n_jobs=2, verbose=False)
+
+    assert {name for name, status in statuses (report).items () if status == "skipped"} == {"product_catalogue"}
@@ -0,0 +1,56 @@
+import datetime as dt
+
+from recommender_core import CandidateCache, cart_key, daytime_bucket_end
+
+
+class Compute:
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return [self.calls]
+
+
+def test_daytime_bucket_end():
+    assert daytime_bucket_end (dt.datetime (2020, 6, 1, 9, 59, 30)) == dt.datetime (2020, 6, 1, 12)
+    assert daytime_bucket_end (dt.datetime (2020, 6, 1, 12)) == dt.datetime (2020, 6, 1, 16)
+    assert daytime_bucket_end (dt.datetime (2020, 6, 1, 22, 30)) == dt.datetime (2020, 6, 2)
+
+
+def test_cart_key_does_not_depend_on_order():
+    assert cart_key (["a", "b", "a"]) == cart_key (["b", "a"])
+    assert cart_key (["a", "b"]) != cart_key (["a", "b", "c"])
+
+
+def test_least_recently_used_lists_are_evicted():
+    cache, compute, now = CandidateCache (max_entries=2), Compute (), dt.datetime (2020, 6, 1, 9)
+    cache.get ("a", compute, now)
+    cache.get ("b", compute, now)
+    assert cache.get ("a", compute, now) == [1]
+    cache.get ("c", compute, now)
+
+    assert list (cache.entries) == ["a", "c"]
+    assert cache.get ("b", compute, now) == [4]
+    assert cache.stats () == {"hits": 1, "misses": 4, "evictions": 2, "expirations": 0, "invalidations": 0,
+                              "size": 2}
+
+
+def test_lists_expire_at_the_end_of_daytime_label():
+    cache, compute = CandidateCache (), Compute ()
+    assert cache.get ("a", compute, dt.datetime (2020, 6, 1, 8, 1)) == [1]
+    assert cache.get ("a", compute, dt.datetime (2020, 6, 1, 11, 59)) == [1]
+    assert cache.get ("a", compute, dt.datetime (2020, 6, 1, 12)) == [2]
+    assert cache.stats ()["expirations"] == 1
+
+
+def test_returned_lists_are_copies_and_clear_invalidates():
+    cache, compute, now = CandidateCache (), Compute (), dt.datetime (2020, 6, 1, 9)
+    cache.get ("a", compute, now).append ("changed")
+    assert cache.get ("a", compute, now) == [1]
+
+    cache.clear ()
+    assert len (cache) == 0
+    assert cache.get ("a", compute, now) == [2]
+    assert cache.stats ()["invalidations"] == 1
@@ -0,0 +1,28 @@
+import pytest
+
+from bench_data_preparation import data_preparation_legacy
+from funcs import data_preparation
+from synthetic_data import create_synthetic_row_dataframe
+
+
+@pytest.fixture (scope="module")
+def row_dataframe():
+    return create_synthetic_row_dataframe (n_events=5000, n_products=200)
+
+
+def test_data_preparation_matches_legacy(row_dataframe):
+    legacy = data_preparation_legacy (row_dataframe.copy ())
+    current = data_preparation (row_dataframe.copy ())
+
+    assert list (current.columns) == list (legacy.columns)
+    assert (current.astype (str).values == legacy.astype (str).values).all ()
+
+
+@pytest.mark.parametrize ("chunk_size", [1000, 1777])
+def test_data_preparation_chunks_match_whole_dataframe(row_dataframe, chunk_size):
+    whole = data_preparation (row_dataframe.copy ())
+    chunked = data_preparation (row_dataframe.iloc[i:i + chunk_size].copy ()
+                                for i in range (0, len (row_dataframe), chunk_size))
+
+    assert list (chunked.columns) == list (whole.columns)
+    assert (chunked.astype (str).values == whole.astype (str).values).all ()
@@ -0,0 +1,153 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+from funcs import EVENTS_SCHEMA, concat_chunks, convert_json_to_df, create_item_similarity_table, create_rules, \
+    create_user_product_matrix_item_based, eclat, item_based_recommendation, iter_json_records, \
+    product_correlations, sparse_corrwith
+from instrumentation import INSTRUMENTATION
+from synthetic_data import write_synthetic_json
+
+
+def test_sparse_corrwith_matches_corrwith(df_prep, user_pro_matrix):
+    dense = create_user_product_matrix_item_based (df_prep)
+    for product_id in user_pro_matrix.products[:30].tolist ():
+        expected = dense.corrwith (dense[product_id]).reindex (user_pro_matrix.products)
+
+        np.testing.assert_allclose (sparse_corrwith (user_pro_matrix, product_id).values, expected.values,
+                                    rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_item_based_recommendation_with_sparse_matrix(user_pro_matrix):
+    for product_id in user_pro_matrix.products[:20].tolist ():
+        correlated = product_correlations (user_pro_matrix, product_id)
+        candidates = correlated[correlated > 0.02].head (5).index.tolist ()
+
+        recommendations = item_based_recommendation (user_pro_matrix, product_id, threshold=0.02, rec_count=4)
+
+        assert len (recommendations) == min (4, len (candidates))
+        assert set (recommendations) <= set (candidates)
+
+
+def test_item_based_recommendation_counts_short_candidates(user_pro_matrix):
+    key = ("fallbacks_total", (("reason", "item_based_short_candidates"),))
+    for product_id in user_pro_matrix.products[:20].tolist ():
+        correlated = product_correlations (user_pro_matrix, product_id)
+        short = len (correlated[correlated > 0.02].head (5)) < 4
+        before = INSTRUMENTATION.counters[key]
+
+        item_based_recommendation (user_pro_matrix, product_id, threshold=0.02, rec_count=4)
+
+        assert INSTRUMENTATION.counters[key] - before == short
+
+
+def test_item_based_recommendation_with_similarity_table(user_pro_matrix):
+    table = create_item_similarity_table (user_pro_matrix)
+    for product_id in user_pro_matrix.products[:20].tolist ():
+        candidates = table.similar_products (product_id, 0.02, 5)
+
+        recommendations = item_based_recommendation (table, product_id, threshold=0.02, rec_count=4)
+
+        assert len (recommendations) == min (4, len (candidates))
+        assert set (recommendations) <= set (candidates)
+
+
+@pytest.fixture
+def events_json(tmp_path):
+    events = [{"event": "cart", "sessionid": "s{}".format (i % 7), "eventtime": "2020-06-01T10:00:{:02d}.000Z".format (i),
+               "price": i * 1.5, "productid": "HBV{:08d}".format (i), "name": "Ürün [{}], {{x}}".format (i),
+               "attributes": {"tags": ["a", "b"], "size": i}} for i in range (50)]
+    path = tmp_path / "events.json"
+    path.write_text (json.dumps ({"events": events}, ensure_ascii=False, indent=1),
+                     encoding="utf-8")
+    return str (path)
+
+
+@pytest.mark.parametrize ("buffer_size", [1, 7, 64, 1 << 20])
+def test_iter_json_records_matches_json_load(events_json, buffer_size):
+    with open (events_json, 'r') as f:
+        expected = json.load (f)["events"]
+
+    assert list (iter_json_records (events_json, "events", buffer_size=buffer_size)) == expected
+
+
+
+@pytest.mark.parametrize ("buffer_size", [1, 7, 64, 1 << 20])
+def test_iter_json_records_streams_only_top_level_key(tmp_path, buffer_size):
+    events = [{"sessionid": "s{}".format (i), "price": i * 10} for i in range (20)]
+    data = {"index": {"events": [{"sessionid": "decoy"}]}, "name": "\"events\": [1]", "count": 12345,
+            "events": events, "meta": [{"events": []}]}
+    path = tmp_path / "events.json"
+    path.write_text (json.dumps (data, indent=1), encoding="utf-8")
+
+    assert list (iter_json_records (str (path), "events", buffer_size=buffer_size)) == events
+    assert list (iter_json_records (str (path), "meta", buffer_size=buffer_size)) == [{"events": []}]
+
+
+def test_iter_json_records_raises_for_missing_top_level_key(tmp_path):
+    path = tmp_path / "events.json"
+    path.write_text (json.dumps ({"index": {"events": [1, 2]}, "meta": []}), encoding="utf-8")
+
+    with pytest.raises (ValueError, match="not found"):
+        list (iter_json_records (str (path), "events", buffer_size=4))
+
+def test_convert_json_to_df_chunks_match_whole_file(events_json):
+    expected = convert_json_to_df (events_json, "events")
+
+    for chunk_size in [1, 8, 100]:
+        assert convert_json_to_df (events_json, "events", chunk_size=chunk_size).equals (expected)
+
+
+def test_convert_json_to_df_converts_typed_chunks(tmp_path):
+    events_path, _ = write_synthetic_json (str (tmp_path), n_events=200, n_products=50)
+    expected = convert_json_to_df (events_path, "events", schema=EVENTS_SCHEMA)
+    assert pd.api.types.is_categorical_dtype (expected["productid"])
+    assert pd.api.types.is_datetime64_any_dtype (expected["eventtime"])
+
+    for chunk_size in [1, 30, 1000]:
+        pd.testing.assert_frame_equal (convert_json_to_df (events_path, "events", chunk_size=chunk_size,
+                                                           schema=EVENTS_SCHEMA), expected)
+
+
+def test_concat_chunks_fills_missing_columns():
+    chunks = [pd.DataFrame ({"a": pd.Categorical (["x", "y"]), "b": [1.0, 2.0]}),
+              pd.DataFrame ({"a": pd.Categorical (["z"])}),
+              pd.DataFrame ({"b": [3.0]})]
+    dataframe = concat_chunks (chunks)
+
+    assert dataframe["a"].astype (object).tolist ()[:3] == ["x", "y", "z"] and dataframe["a"].isnull ()[3]
+    assert list (dataframe["a"].cat.categories) == ["x", "y", "z"]
+    np.testing.assert_array_equal (dataframe["b"].values, [1.0, 2.0, np.nan, 3.0])
+
+
+@pytest.mark.parametrize ("max_len, n_jobs", [(None, 1), (2, 1), (None, 2)])
+def test_eclat_matches_apriori(max_len, n_jobs):
+    apriori = pytest.importorskip ("mlxtend.frequent_patterns").apriori
+    rng = np.random.default_rng (0)
+    dense = rng.random ((400, 30)) < np.linspace (0.02, 0.3, 30)
+    products = ["P{:02d}".format (i) for i in range (30)]
+
+    expected = apriori (pd.DataFrame (dense, columns=products), min_support=0.01, use_colnames=True,
+                        max_len=max_len)
+    itemsets = eclat (sp.csr_matrix (dense), products, min_support=0.01, max_len=max_len, n_jobs=n_jobs)
+
+    assert len (itemsets) == len (expected)
+    assert dict (zip (itemsets["itemsets"], itemsets["support"])) == \
+           pytest.approx (dict (zip (expected["itemsets"], expected["support"])))
+
+
+def test_create_rules_engines_match(session_pro_matrix):
+    pytest.importorskip ("mlxtend")
+    rules = [{(antecedents, consequents): (support, confidence, lift)
+              for antecedents, consequents, support, confidence, lift in
+              create_rules (session_pro_matrix, engine=engine)[["antecedents", "consequents", "support",
+                                                                "confidence", "lift"]].itertuples (index=False)}
+             for engine in ("eclat", "apriori")]
+
+    assert len (rules[0]) > 0
+    assert rules[0].keys () == rules[1].keys ()
+    for key, metrics in rules[0].items ():
+        assert metrics == pytest.approx (rules[1][key])
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from funcs import create_bestseller_tables, data_preparation
+from recommender_core import HYBRID_WEIGHTS, hybrid_rank
+from synthetic_data import create_synthetic_row_dataframe
+
+
+@pytest.fixture (scope="module")
+def bestseller_tables():
+    return create_bestseller_tables (data_preparation (create_synthetic_row_dataframe (n_events=10000, n_products=200)))
+
+
+@pytest.fixture (scope="module")
+def daytime_label(bestseller_tables):
+    return max (bestseller_tables.daytime_positions, key=lambda label: len (bestseller_tables.popular_products (
+        label, len (bestseller_tables.products))))
+
+
+def category(bestseller_tables, product_id):
+    return bestseller_tables.arrays["product_category"][bestseller_tables.product_positions[product_id]]
+
+
+def fused_ranking(candidates, bestseller_tables, method, weights=None, rrf_k=60):
+    """
+    Returns the products of the candidate lists ordered by their fused scores, then by their positions.
+    """
+    weights, positions, scores = dict (HYBRID_WEIGHTS, **(weights or {})), bestseller_tables.product_positions, {}
+    for approach, products in candidates.items ():
+        ranked = [product for product in dict.fromkeys (products) if product in positions]
+        for rank, product in enumerate (ranked):
+            if method == "rrf":
+                score = weights[approach] / (rrf_k + rank + 1)
+            else:
+                score = weights[approach] * (1 - rank / len (ranked))
+            scores[product] = scores.get (product, 0) + score
+    return sorted (scores, key=lambda product: (-scores[product], positions[product]))
+
+
+@pytest.mark.parametrize ("method, weights", [("rrf", None), ("rrf", {"user": 3.0}), ("weighted", None),
+                                              ("weighted", {"arl": 0.5, "item": 2.0})])
+def test_candidates_are_ranked_by_fused_scores(bestseller_tables, daytime_label, method, weights):
+    products = bestseller_tables.products.tolist ()
+    candidates = {"bestseller": products[0:8], "arl": products[5:10] + ["UNKNOWN"], "user": products[9:2:-1],
+                  "item": products[20:23] + products[20:21]}
+    expected = fused_ranking (candidates, bestseller_tables, method, weights)
+
+    assert hybrid_rank (candidates, bestseller_tables, rec_count=len (expected), weights=weights, method=method,
+                        category_cap=len (products), daytime_label=daytime_label) == expected
+
+
+def test_products_of_a_category_are_capped(bestseller_tables, daytime_label):
+    products = bestseller_tables.products.tolist ()
+    first_category = category (bestseller_tables, products[0])
+    same = [product for product in products if category (bestseller_tables, product) == first_category][:6]
+    other = [product for product in products if category (bestseller_tables, product) != first_category][:2]
+
+    recommendations = hybrid_rank ({"arl": same + other}, bestseller_tables, rec_count=8, category_cap=3,
+                                   daytime_label=daytime_label)
+
+    assert recommendations[:5] == same[:3] + other
+    categories = [category (bestseller_tables, product) for product in recommendations]
+    assert max (np.bincount (categories)) <= 3 or len (set (categories)) == len (bestseller_tables.categories)
+
+    # The cap is relaxed if the products are still not enough.
+    assert hybrid_rank ({"arl": same}, bestseller_tables, rec_count=len (products), category_cap=3,
+                        daytime_label="UNKNOWN_LABEL") == same
+
+
+def test_popular_products_complete_the_candidates(bestseller_tables, daytime_label):
+    popular = bestseller_tables.popular_products (daytime_label, rec_count=len (bestseller_tables.products))
+    cap = len (bestseller_tables.products)
+
+    assert hybrid_rank ({}, bestseller_tables, rec_count=10, category_cap=cap, daytime_label=daytime_label) == \
+           popular[:10]
+    assert hybrid_rank ({"user": [popular[5]]}, bestseller_tables, rec_count=10, category_cap=cap,
+                        shopping_cart=popular[:2], daytime_label=daytime_label) == \
+           [popular[5]] + [product for product in popular[2:] if product != popular[5]][:9]
+
+
+def test_cart_products_are_not_recommended(bestseller_tables, daytime_label):
+    products = bestseller_tables.products.tolist ()
+    recommendations = hybrid_rank ({"arl": products[:10], "user": products[5:15]}, bestseller_tables, rec_count=10,
+                                   shopping_cart=products[:3], daytime_label=daytime_label)
+
+    assert len (recommendations) == 10
+    assert not set (recommendations) & set (products[:3])
+
+
+def test_unknown_method_raises(bestseller_tables):
+    with pytest.raises (ValueError):
+        hybrid_rank ({}, bestseller_tables, method="borda")
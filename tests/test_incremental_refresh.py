@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifact_store import ArtifactStore
+from funcs import DAY_TIME_LABELS, SparseSessionProductMatrix, RuleIndex, ItemSimilarityTable, data_preparation, \
+    create_bestseller_tables, create_item_similarity_table, create_rules, create_sparse_session_product_matrix, \
+    read_bestseller_tables, read_data_prepared, read_item_similarity_table, read_recommendation_index, \
+    read_rules_df, read_session_neighborhood, read_session_pro_df, read_user_product_matrix_df
+from incremental_refresh import read_refresh_state, refresh_artifacts
+from synthetic_data import create_synthetic_row_dataframe
+
+
+def single_antecedent_rules(rules):
+    """
+    Returns the supports of the rules of single antecedents by antecedent and consequent pairs.
+    """
+    indptr = rules.arrays["antecedent_indptr"]
+    single = np.diff (indptr) == 1
+    antecedents = rules.products[rules.arrays["antecedent_items"][indptr[:-1][single]]]
+    consequents = rules.products[rules.arrays["consequents"][single]]
+    return dict (zip (zip (antecedents.tolist (), consequents.tolist ()), rules.arrays["support"][single].tolist ()))
+
+
+@pytest.fixture (scope="module")
+def refreshed(tmp_path_factory):
+    pytest.importorskip ("mlxtend")
+    row_df = create_synthetic_row_dataframe (n_events=23000, n_products=300)
+    base_df, batch_df = row_df.iloc[:20000].copy (), row_df.iloc[20000:].reset_index (drop=True)
+
+    # The artifacts of the first events are built like create_data.py, then the other events are refreshed.
+    store = ArtifactStore (str (tmp_path_factory.mktemp ("artifacts")))
+    df_prep = read_data_prepared (base_df, upgrade=True, store=store)
+    session_pro_matrix = read_session_pro_df (df_prep, upgrade=True, store=store)
+    read_session_neighborhood (df_prep, upgrade=True, store=store)
+    read_bestseller_tables (df_prep, upgrade=True, store=store)
+    user_pro_matrix = read_user_product_matrix_df (df_prep, upgrade=True, store=store)
+    rules = read_rules_df (session_pro_matrix, upgrade=True, store=store)
+    similarity_table = read_item_similarity_table (user_pro_matrix, upgrade=True, store=store)
+    read_recommendation_index (df_prep, rules, similarity_table, upgrade=True, store=store)
+    read_refresh_state (df_prep, upgrade=True, store=store)
+
+    return store, refresh_artifacts (batch_df, store), data_preparation (row_df)
+
+
+
+def rule_metrics(rules):
+    """
+    Returns the support, confidence and lift of the rules by antecedents and consequent.
+    """
+    indptr, items = rules.arrays["antecedent_indptr"], rules.arrays["antecedent_items"]
+    return {(tuple (rules.products[items[indptr[row]:indptr[row + 1]]].tolist ()),
+             rules.products[rules.arrays["consequents"][row]]):
+                (rules.arrays["support"][row], rules.arrays["confidence"][row], rules.arrays["lift"][row])
+            for row in range (len (indptr) - 1)}
+
+
+@pytest.fixture (scope="module")
+def refreshed_few_products(tmp_path_factory):
+    pytest.importorskip ("mlxtend")
+    row_df = create_synthetic_row_dataframe (n_events=23000, n_products=300)
+    base_df = row_df.iloc[:20000].copy ()
+    # The new session ids of the batch include 2 of the 3 least sold products, so the batch touches only a few
+    # products and their pairs, but it changes the transaction weight of every rule.
+    products = base_df["productid"].astype (str)
+    rows = base_df[products.isin (products.value_counts ().index[-3:])].drop_duplicates ("productid")
+    batch_df = rows.iloc[[0, 1, 1, 2, 2, 0] * 10].reset_index (drop=True)
+    batch_df["sessionid"] = ["new{}".format (i // 2) for i in range (len (batch_df))]
+
+    store = ArtifactStore (str (tmp_path_factory.mktemp ("artifacts")))
+    df_prep = read_data_prepared (base_df, upgrade=True, store=store)
+    session_pro_matrix = read_session_pro_df (df_prep, upgrade=True, store=store)
+    read_bestseller_tables (df_prep, upgrade=True, store=store)
+    user_pro_matrix = read_user_product_matrix_df (df_prep, upgrade=True, store=store)
+    rules = RuleIndex.from_rules (create_rules (session_pro_matrix, max_len=2))
+    store.save ("rules", rules)
+    similarity_table = read_item_similarity_table (user_pro_matrix, upgrade=True, store=store)
+    read_recommendation_index (df_prep, rules, similarity_table, upgrade=True, store=store)
+    read_refresh_state (df_prep, upgrade=True, store=store)
+
+    return refresh_artifacts (batch_df, store), data_preparation (pd.concat ([base_df, batch_df], ignore_index=True))
+
+
+def test_refresh_of_few_products_matches_rebuild_rules(refreshed_few_products):
+    artifacts, df_prep = refreshed_few_products
+    expected = RuleIndex.from_rules (create_rules (create_sparse_session_product_matrix (df_prep), max_len=2))
+    rules, expected_rules = rule_metrics (artifacts["rules"]), rule_metrics (expected)
+
+    assert rules.keys () == expected_rules.keys ()
+    for key, metrics in rules.items ():
+        assert metrics == pytest.approx (expected_rules[key])
+
+    rec_index = artifacts["recommendation_index"]
+    for product_id in rec_index.products.tolist ():
+        assert rec_index.arl_products (product_id, 10) == expected.recommend (product_id, 10)
+
+def test_refresh_matches_rebuild_matrices(refreshed):
+    _, artifacts, df_prep = refreshed
+    for name, binary in [("session_pro_matrix", True), ("user_product_matrix", False)]:
+        expected = create_sparse_session_product_matrix (df_prep, binary=binary)
+
+        np.testing.assert_array_equal (artifacts[name].products.astype (str), expected.products.astype (str))
+        np.testing.assert_array_equal (artifacts[name].sessions.astype (str), expected.sessions.astype (str))
+        assert (artifacts[name].matrix != expected.matrix).nnz == 0
+
+
+def test_refresh_matches_rebuild_bestseller_tables(refreshed):
+    _, artifacts, df_prep = refreshed
+    expected, bestseller_tables = create_bestseller_tables (df_prep), artifacts["bestseller_tables"]
+    for label in DAY_TIME_LABELS:
+        assert bestseller_tables.popular_products (label) == expected.popular_products (label)
+        for product_id in expected.products.tolist ():
+            assert bestseller_tables.bestseller_products (product_id, label) == \
+                   expected.bestseller_products (product_id, label)
+
+
+def test_refresh_matches_rebuild_item_similarity_table(refreshed):
+    _, artifacts, df_prep = refreshed
+    expected = create_item_similarity_table (create_sparse_session_product_matrix (df_prep, binary=False))
+    similarity_table = artifacts["item_similarity_table"]
+
+    np.testing.assert_array_equal (similarity_table.products.astype (str), expected.products.astype (str))
+    np.testing.assert_allclose (similarity_table.scores, expected.scores, rtol=1e-5, equal_nan=True)
+
+
+def test_refresh_matches_rebuild_pair_rules(refreshed):
+    _, artifacts, df_prep = refreshed
+    # Rules of longer itemsets keep their metrics until the rules are created from scratch.
+    expected = RuleIndex.from_rules (create_rules (create_sparse_session_product_matrix (df_prep), max_len=2))
+    rules, expected_rules = single_antecedent_rules (artifacts["rules"]), single_antecedent_rules (expected)
+
+    assert rules.keys () == expected_rules.keys ()
+    assert list (rules.values ()) == pytest.approx ([expected_rules[key] for key in rules])
+
+
+def test_refresh_publishes_saved_artifacts(refreshed):
+    store, artifacts, df_prep = refreshed
+    store = ArtifactStore (store.root)
+    for name, cls in [("session_pro_matrix", SparseSessionProductMatrix), ("rules", RuleIndex),
+                      ("item_similarity_table", ItemSimilarityTable)]:
+        for key, array in artifacts[name].arrays.items ():
+            np.testing.assert_array_equal (store.load (name, cls).arrays[key], array)
+    assert len (store.load_dataframe ("df_prep")) == len (df_prep)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from funcs import create_item_embedding_index, create_item_embeddings, item_based_recommendation
+
+
+@pytest.fixture (scope="module")
+def embedding_index(user_pro_matrix):
+    return create_item_embedding_index (user_pro_matrix, dim=32)
+
+
+@pytest.mark.parametrize ("method", ["svd", "als"])
+def test_embeddings_have_unit_length(user_pro_matrix, method):
+    vectors = create_item_embeddings (user_pro_matrix, dim=16, method=method, iterations=3)
+
+    assert vectors.shape == (len (user_pro_matrix.products), 16)
+    np.testing.assert_allclose (np.linalg.norm (vectors, axis=1), 1, rtol=1e-4)
+
+
+def test_exact_search_matches_brute_force(embedding_index):
+    vectors = embedding_index.vectors
+    for position in range (0, len (vectors), 10):
+        positions, scores = embedding_index.search (vectors[position], 10, exclude=[position], exact=True)
+        similarities = vectors @ vectors[position]
+        similarities[position] = -np.inf
+
+        np.testing.assert_allclose (scores, np.sort (similarities)[::-1][:10], rtol=1e-5)
+        np.testing.assert_allclose (similarities[positions], scores, rtol=1e-5)
+
+
+def test_inverted_file_recall(embedding_index):
+    n_lists = len (embedding_index.arrays["centroids"])
+    products = embedding_index.products.tolist ()
+    exact = [set (embedding_index.similar_products (product, count=10, exact=True)) for product in products]
+
+    def recall(n_probe):
+        found = [len (set (embedding_index.similar_products (product, count=10, n_probe=n_probe)) & expected)
+                 for product, expected in zip (products, exact)]
+        return sum (found) / sum (len (expected) for expected in exact)
+
+    # Probing every list is the exact search, probing more lists never finds fewer products.
+    assert recall (n_lists) == 1
+    assert recall (1) <= recall (embedding_index.n_probe) <= recall (n_lists)
+    assert recall (embedding_index.n_probe) >= 0.9
+
+
+def test_recommend_cart(embedding_index):
+    products = embedding_index.products.tolist ()
+    shopping_cart = products[:3]
+    recommendations = embedding_index.recommend_cart (shopping_cart + ["UNKNOWN"], rec_count=5, exact=True)
+
+    query = embedding_index.vectors[:3].mean (axis=0)
+    similarities = embedding_index.vectors[3:] @ (query / np.linalg.norm (query))
+    assert recommendations == [products[3 + i] for i in np.argsort (-similarities, kind="stable")[:5]]
+    assert embedding_index.recommend_cart (["UNKNOWN"]) == []
+
+
+def test_item_based_recommendation_with_embedding_index(embedding_index):
+    for product_id in embedding_index.products[:20].tolist ():
+        candidates = embedding_index.similar_products (product_id, 0.5, 5)
+        recommendations = item_based_recommendation (embedding_index, product_id, rec_count=4)
+
+        assert len (recommendations) == min (4, len (candidates))
+        assert set (recommendations) <= set (candidates)
@@ -0,0 +1,126 @@
+import json
+import asyncio
+
+import pytest
+
+from artifact_store import ArtifactStore
+from funcs import data_preparation, grab_col_types, META_SCHEMA, read_bestseller_tables, \
+    read_item_similarity_table, read_product_catalogue, read_recommendation_index, read_rules_df, \
+    read_session_neighborhood, read_session_pro_df, read_user_product_matrix_df
+from recommendation_service import HTTPError, RecommendationService
+from synthetic_data import create_synthetic_meta, create_synthetic_row_dataframe
+
+
+@pytest.fixture (scope="module")
+def store(tmp_path_factory):
+    pytest.importorskip ("mlxtend")
+    store = ArtifactStore (str (tmp_path_factory.mktemp ("artifacts")))
+    meta_df = create_synthetic_meta (n_products=200)
+    grab_col_types (meta_df, META_SCHEMA)
+
+    df_prep = data_preparation (create_synthetic_row_dataframe (n_events=10000, n_products=200))
+    read_product_catalogue (meta_df, upgrade=True, store=store)
+    session_pro_matrix = read_session_pro_df (df_prep, upgrade=True, store=store)
+    read_session_neighborhood (df_prep, upgrade=True, store=store)
+    read_bestseller_tables (df_prep, upgrade=True, store=store)
+    rules = read_rules_df (session_pro_matrix, upgrade=True, store=store)
+    similarity_table = read_item_similarity_table (read_user_product_matrix_df (df_prep, upgrade=True, store=store),
+                                                   upgrade=True, store=store)
+    read_recommendation_index (df_prep, rules, similarity_table, upgrade=True, store=store)
+    return store
+
+
+@pytest.fixture (params=[False, True], ids=["artifacts", "index"])
+def service(store, request):
+    service = RecommendationService (store=store, use_index=request.param, rec_count=5, max_sessions=3)
+    yield service
+    service.executor.shutdown ()
+
+
+def test_cart_endpoints(service):
+    async def requests():
+        added = await service.handle ("POST", "/sessions/s1/cart", b'{"product_id": "HBV00000001"}')
+        await service.handle ("POST", "/sessions/s1/cart", b'{"product_id": "HBV00000002"}')
+        return added, await service.handle ("GET", "/sessions/s1/cart", b""), \
+               await service.handle ("DELETE", "/sessions/s1/cart", b""), \
+               await service.handle ("GET", "/sessions/s1/cart?x=1", b"")
+
+    added, cart, deleted, cleared = asyncio.run (requests ())
+
+    product_catalogue = service.product_catalogue
+    assert added["product"] == {"product_id": "HBV00000001", "name": product_catalogue.name ("HBV00000001")}
+    assert added["cart"] == ["HBV00000001"]
+    assert 0 < len (added["recommendations"]) <= 5
+    for recommendation in added["recommendations"]:
+        assert recommendation["name"] == product_catalogue.name (recommendation["product_id"])
+    assert cart == {"session_id": "s1", "cart": ["HBV00000001", "HBV00000002"]}
+    assert deleted == cleared == {"session_id": "s1", "cart": []}
+
+
+@pytest.mark.parametrize ("method, path, body, status", [("POST", "/sessions/s1/cart", b'{"product_id": "X"}', 404),
+                                                         ("POST", "/sessions/s1/cart", b'{"product": 1}', 400),
+                                                         ("POST", "/sessions/s1/cart", b'[1', 400),
+                                                         ("GET", "/sessions/s1", b"", 404),
+                                                         ("PUT", "/sessions/s1/cart", b"", 405)])
+def test_error_responses(service, method, path, body, status):
+    with pytest.raises (HTTPError) as error:
+        asyncio.run (service.handle (method, path, body))
+    assert error.value.status == status
+
+
+def test_least_recently_used_carts_are_removed(service):
+    async def requests():
+        for session_id in ["s1", "s2", "s3", "s1", "s4"]:
+            await service.handle ("POST", "/sessions/{}/cart".format (session_id), b'{"product_id": "HBV00000001"}')
+        return await service.handle ("GET", "/health", b"")
+
+    health = asyncio.run (requests ())
+
+    assert list (service.carts) == ["s3", "s1", "s4"]
+    assert health["status"] == "ok" and health["sessions"] == 3
+
+
+def test_concurrent_lookups_of_a_product_are_coalesced(service):
+    async def requests():
+        return await asyncio.gather (*[service.add_to_cart ("s{}".format (i), "HBV00000003") for i in range (3)])
+
+    responses = asyncio.run (requests ())
+
+    assert [response["cart"] for response in responses] == [["HBV00000003"]] * 3
+    assert service.counters["product_lookups"] == 3
+    assert service.counters["coalesced_lookups"] == 2
+
+
+def test_http_keep_alive_connection(service):
+    async def requests():
+        server = await asyncio.start_server (service.handle_connection, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection (*server.sockets[0].getsockname ())
+        responses = []
+        for request, close in [(("POST", b'{"product_id": "HBV00000001"}'), False), (("GET", b""), False),
+                               (("PATCH", b""), True)]:
+            method, body = request
+            writer.write ("{} /sessions/s1/cart HTTP/1.1\r\nContent-Length: {}\r\n{}\r\n".format (
+                method, len (body), "Connection: close\r\n" if close else "").encode ("latin-1") + body)
+            status_line = await reader.readline ()
+            headers = {}
+            while True:
+                line = await reader.readline ()
+                if line == b"\r\n":
+                    break
+                name, _, value = line.decode ("latin-1").partition (":")
+                headers[name.strip ().lower ()] = value.strip ()
+            content = await reader.readexactly (int (headers["content-length"]))
+            responses.append ((int (status_line.split ()[1]), headers["connection"], json.loads (content)))
+        closed = await reader.read () == b""
+        writer.close ()
+        server.close ()
+        await server.wait_closed ()
+        return responses, closed
+
+    responses, closed = asyncio.run (requests ())
+
+    assert [(status, connection) for status, connection, _ in responses] == \
+           [(200, "keep-alive"), (200, "keep-alive"), (405, "close")]
+    assert responses[1][2]["cart"] == ["HBV00000001"]
+    assert closed
+    assert service.counters["requests"] == 3 and service.counters["errors"] == 1
@@ -0,0 +1,77 @@
+import os
+import sys
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from funcs import create_item_similarity_table, create_product_catalogue, product_correlations
+from recommender_core import ProductPositions, RuleIndex
+
+
+def test_serving_core_does_not_import_pandas_or_scipy():
+    code = "import sys, recommender_core; print (sorted (set (sys.modules) & {'pandas', 'scipy', 'matplotlib'}))"
+    output = subprocess.run ([sys.executable, "-c", code], cwd=os.path.dirname (os.path.dirname (__file__)),
+                             capture_output=True, text=True, check=True).stdout
+
+    assert output.strip () == "[]"
+
+
+def test_product_positions_match_dict(tmp_path):
+    products = np.array (["HBV0003", "HBV0001", "OFIS-1", "HBV0002", "A"])
+    path = str (tmp_path / "products.npy")
+    np.save (path, products)
+    product_ids = ["HBV0002", "HBV00011", "A", "", "HBV000", "OFIS-1", "Z"]
+
+    for array in [products, np.sort (products), products.astype (object), np.load (path, mmap_mode="r")]:
+        positions = ProductPositions (array)
+        expected = {product: i for i, product in enumerate (array.tolist ())}
+
+        assert positions.positions (product_ids).tolist () == [expected.get (product, -1) for product in product_ids]
+        assert [product in positions for product in product_ids] == [product in expected for product in product_ids]
+        assert positions["A"] == expected["A"] and positions.get ("Z") is None
+    assert ProductPositions (products[:0]).positions (["A"]).tolist () == [-1]
+
+
+def test_rule_index_recommend_matches_rules_dataframe(rules_df):
+    rule_index = RuleIndex.from_rules (rules_df)
+    for product_id in sorted (set ().union (*rules_df["antecedents"])):
+        rows = rules_df["antecedents"].apply (lambda x: product_id in x)
+        consequents = [list (x)[0] for x in rules_df.loc[rows, "consequents"]][:20]
+
+        assert rule_index.recommend (product_id, rec_count=10) == list (dict.fromkeys (consequents))[:10]
+
+
+def test_rule_index_recommend_cart_matches_rules_dataframe(rules_df, session_pro_matrix):
+    rule_index = RuleIndex.from_rules (rules_df)
+    matrix, products = session_pro_matrix.matrix, session_pro_matrix.products
+    for row in np.flatnonzero (np.diff (matrix.indptr) > 1)[:200]:
+        cart = products[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]].tolist ()
+        consequents = [list (consequent)[0] for antecedents, consequent in
+                       zip (rules_df["antecedents"], rules_df["consequents"])
+                       if antecedents <= set (cart) and list (consequent)[0] not in cart]
+
+        assert rule_index.recommend_cart (cart, rec_count=5) == list (dict.fromkeys (consequents))[:5]
+
+
+def test_item_similarity_table_matches_correlations(user_pro_matrix):
+    table = create_item_similarity_table (user_pro_matrix, k=10)
+    for product_id in user_pro_matrix.products[:50].tolist ():
+        correlations = product_correlations (user_pro_matrix, product_id)
+        similar = table.similar_products (product_id, threshold=0.1)
+
+        # Products of equal correlations can be ordered differently, so the correlations are compared.
+        expected = correlations[correlations > 0.1].head (10)
+        np.testing.assert_allclose (correlations[similar].values, expected.values, rtol=1e-5)
+
+
+def test_product_catalogue_of_unknown_products():
+    meta_df = pd.DataFrame ({"productid": ["P2", "P1"], "brand": ["B", None], "category": ["C2", "C1"],
+                             "subcategory": ["S2", "S1"], "name": ["N2", "N1"]})
+    product_catalogue = create_product_catalogue (meta_df)
+
+    assert product_catalogue.column_values ("BRAND", ["P1", "X", "P2"]) == ["None", "None", "B"]
+    assert product_catalogue.names (["P2", "X", "P1"]) == ["B, C2, N2, P2", "X", "C1, N1, P1"]
+    assert product_catalogue.name ("X") == "X"
+    assert "X" not in product_catalogue
+    assert create_product_catalogue (meta_df.iloc[:0]).names (["X"]) == ["X"]
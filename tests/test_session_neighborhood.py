@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from funcs import create_session_neighborhood
+
+
+@pytest.fixture (scope="module")
+def session_neighborhood(df_prep):
+    return create_session_neighborhood (df_prep)
+
+
+def brute_force_recommend(df_prep, shopping_cart, neighbor_count=10):
+    """
+    Returns the scores of the products of the most similar session ids to the cart and the similarities of
+    the session ids by comparing the cart with all session ids. Session ids of equal jaccard similarity are
+    ordered by their last event time, then by their ids.
+    """
+    sessions = pd.DataFrame ({"products": df_prep.groupby ("SESSIONID")["PRODUCTID"].agg (set),
+                              "last_time": df_prep.groupby ("SESSIONID")["EVENTTIME"].max ()})
+    cart = set (shopping_cart)
+    overlaps = sessions["products"].apply (lambda products: len (products & cart))
+    sizes = sessions["products"].apply (len)
+    sessions = sessions.assign (score=overlaps / (len (cart) + sizes - overlaps), session=sessions.index)
+    sessions = sessions[(overlaps > 0) & (sizes > overlaps)]
+    neighbors = sessions.sort_values (["score", "last_time", "session"], ascending=[False, False, True]).head (
+        neighbor_count)
+
+    scores = {}
+    for products, score in zip (neighbors["products"], neighbors["score"]):
+        for product in products - cart:
+            scores[product] = scores.get (product, 0) + score
+    return pd.Series (scores, dtype=float), neighbors["score"].values
+
+
+def test_similar_sessions_match_brute_force(df_prep, session_neighborhood):
+    for shopping_cart in [["HBV00000001"], ["HBV00000002", "HBV00000003"], ["HBV00000010", "HBV00000042"]]:
+        positions = np.array ([session_neighborhood.product_positions[product] for product in shopping_cart])
+        _, scores = session_neighborhood.similar_sessions (np.sort (positions), max_postings=None)
+        _, expected_scores = brute_force_recommend (df_prep, shopping_cart)
+
+        np.testing.assert_allclose (scores, expected_scores)
+
+
+def test_recommend_matches_brute_force(df_prep, session_neighborhood):
+    products = session_neighborhood.products.tolist ()
+    for i in range (0, 60, 3):
+        shopping_cart = products[i:i + 1 + i % 3]
+        recommendations = session_neighborhood.recommend (shopping_cart, max_postings=None)
+        expected, _ = brute_force_recommend (df_prep, shopping_cart)
+
+        # Products of equal scores can be ordered differently, so the scores are compared.
+        assert not set (recommendations) & set (shopping_cart)
+        np.testing.assert_allclose (expected[recommendations].values,
+                                    expected.sort_values (ascending=False).head (5).values)